@@ -1,167 +1,376 @@
 import argparse
 import os
-import requests
+import re
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import providers
+from cache import TieredCache
+from deadline import Deadline
+from prompts import Prompt
+from singleflight import normalize_query
+from .corpus import DEFAULT_CORPUS, corpus_config, corpus_root, get_corpus, record_sources, source_keyword
 
 #To run: python3 -m RAG.Query --query "What projects has Shirley worked on?"
 
-# API keys from environment
-COHERE_API_KEY = os.environ.get('COHERE_API_KEY')
-GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
+# Answers we've already generated, so repeat questions skip the whole pipeline.
+# Keyed by (corpus, corpus version, normalized query), so a new version never serves stale answers.
+# With CACHE_REDIS_URL set both are shared across replicas (see cache.py)
+answer_cache = TieredCache('chat_answers', maxsize=512, ttl=3600)
+query_embedding_cache = TieredCache('query_embeddings', maxsize=2048, ttl=24 * 3600)
+# How long a miss waits for another replica that is already generating the same answer
+ANSWER_FILL_WAIT = 5
+# Without a local snapshot, filtered retrieval fetches this many times more RPC matches
+RPC_FILTER_OVERFETCH = 4
 
-def query_rag(query_text):
-    import time
-    start_time = time.time()
+# Precomputed answers for the most asked questions (written by RAG.warm_cache), per corpus version
+WARM_FILE = 'warm.json'
+WARM_TTL = 7 * 24 * 3600
+WARM_CHECK_SECONDS = 10
+_warm_state = {}
+
+# Analytics inserts run here so they never count against a request's budget
+_log_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-log')
 
-    # Supabase setup for logging
+# Concurrent retrieval and generation for /chat/batch
+_batch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='chat-batch')
+
+def _insert_chat_log(row):
     SUPABASE_URL = os.environ.get('SUPABASE_URL')
     SUPABASE_SERVICE_KEY = os.environ.get('SUPABASE_SERVICE_KEY')
-    
-    #Generate query embedding using Cohere (384 dims for embed-english-light-v3.0)
     try:
-        cohere_response = requests.post(
-            "https://api.cohere.ai/v1/embed",
-            headers={"Authorization": f"Bearer {COHERE_API_KEY}", "Content-Type": "application/json"},
-            json={
-                "texts": [query_text],
-                "model": "embed-english-light-v3.0",
-                "input_type": "search_query"
-            },
-            timeout=10
-        )
-        cohere_response.raise_for_status()
-        query_embedding = cohere_response.json()["embeddings"][0]
+        with metrics.upstream('supabase', 'chat_log_insert'):
+            providers.sessions['supabase'].post(
+                f"{SUPABASE_URL}/rest/v1/chat_logs",
+                headers={
+                    "apikey": SUPABASE_SERVICE_KEY,
+                    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json=row,
+                timeout=5
+            )
     except Exception as e:
-        return "I'm having trouble generating an embedding for your question right now."
+        print(f"[WARN] Failed to log query: {e}")
+
 
-    # Search database using HTTP call
-    rpc_url = f"{os.environ.get('SUPABASE_URL')}/rest/v1/rpc/match_documents"
+def log_chat(query_text, response_text, found_results, response_time_ms=None):
+    """Insert one row into chat_logs for analytics, off the request path"""
+    row = {
+        'query': query_text,
+        'response': response_text,
+        'found_results': found_results
+    }
+    if response_time_ms is not None:
+        row['response_time_ms'] = response_time_ms
+    _log_executor.submit(_insert_chat_log, row)
+
+
+def summarize_passages(query_text, results_data, max_sentences=3):
+    """Degraded answer without an LLM: the retrieved sentences that best overlap the question"""
+    terms = {w for w in re.findall(r'[a-z0-9]+', query_text.lower()) if len(w) > 2}
+    candidates = []
+    for rank, doc in enumerate(results_data[:3]):
+        for position, sentence in enumerate(re.split(r'(?<=[.!?])\s+|\n+', doc['content'])):
+            sentence = sentence.strip(' #*-\t')
+            if len(sentence) < 20:
+                continue
+            overlap = len(terms & set(re.findall(r'[a-z0-9]+', sentence.lower())))
+            candidates.append((overlap, -rank, -position, sentence))
+
+    best = sorted(candidates, reverse=True)[:max_sentences]
+    if not best:
+        return None
+    # Keep the original reading order of the chosen sentences
+    best.sort(key=lambda c: (-c[1], -c[2]))
+    return "Here's what I found in my notes: " + ' '.join(c[3] for c in best)
+
+
+def match_documents_rpc(query_embedding, deadline, match_count=5, function='match_documents'):
+    """Server-side vector search via a match_documents-style RPC"""
+    rpc_url = f"{os.environ.get('SUPABASE_URL')}/rest/v1/rpc/{function}"
     headers = {
         "apikey": os.environ.get('SUPABASE_SERVICE_KEY'),
         "Authorization": f"Bearer {os.environ.get('SUPABASE_SERVICE_KEY')}",
         "Content-Type": "application/json",
     }
+
     try:
-        rpc_response = requests.post(
-            rpc_url,
-            headers=headers,
-            json={"query_embedding": query_embedding, "match_count": 5},
-            timeout=10
-        )
-        results_data = rpc_response.json() if rpc_response.status_code == 200 else []
+        rpc_timeout = deadline.timeout(cap=10)
+
+        def match_documents():
+            rpc_response = providers.sessions['supabase'].post(
+                rpc_url,
+                headers=headers,
+                json={"query_embedding": query_embedding, "match_count": match_count},
+                timeout=rpc_timeout
+            )
+            rpc_response.raise_for_status()
+            return rpc_response.json()
+
+        return providers.call('supabase', 'match_documents', match_documents, timeout=rpc_timeout, hedge=True)
     except Exception as e:
-        results_data = []
+        return []
 
-    if not results_data:
 
-        # Log queries with no results
-        try:
-            requests.post(
-                f"{SUPABASE_URL}/rest/v1/chat_logs",
-                headers={
-                    "apikey": SUPABASE_SERVICE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    'query': query_text,
-                    'response': "No relevant information found",
-                    'found_results': False
-                }
-            )
-        except:
-            pass
+def warm_file_path(corpus, corpus_name=DEFAULT_CORPUS):
+    return os.path.join(corpus.path if corpus is not None else corpus_root(corpus_name), WARM_FILE)
 
-        return "I don't have enough information to answer that question."
 
-    #combine all the chunks and pass it to Groq
+def answer_key(corpus_name, corpus, query_text, sources=None):
+    """Cache key for an answer; the normalized query is always last (it also keys the embedding)"""
+    version = corpus.version if corpus is not None else None
+    if sources:
+        # Explicit filters change the answer; inferred ones follow from the query itself
+        return (corpus_name, version, 'sources=' + ','.join(sorted(sources)), normalize_query(query_text))
+    return (corpus_name, version, normalize_query(query_text))
+
+
+def source_filter(query_text, corpus, sources=None):
+    """Sources to restrict retrieval to: the caller's filter, else any the question names, else None"""
+    if sources:
+        metrics.inc('wisest_retrieval_filtered_total', how='explicit')
+        return corpus.resolve_sources(sources) if corpus is not None else list(sources)
+    inferred = corpus.infer_sources(query_text) if corpus is not None else []
+    if inferred:
+        metrics.inc('wisest_retrieval_filtered_total', how='inferred')
+        return inferred
+    return None
+
+
+def refresh_warm_answers(corpus_name=DEFAULT_CORPUS, force=False):
+    """Load precomputed answers into the serving caches when the corpus or warm file changes"""
+    state = _warm_state.setdefault(corpus_name, {'version': None, 'mtime': None, 'checked_at': 0.0})
+    now = time.monotonic()
+    if not force and now - state['checked_at'] < WARM_CHECK_SECONDS:
+        return
+    state['checked_at'] = now
+
+    corpus = get_corpus(corpus_name)
+    version = corpus.version if corpus is not None else None
+    path = warm_file_path(corpus, corpus_name)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    if version == state['version'] and mtime == state['mtime']:
+        return
+    state['version'], state['mtime'] = version, mtime
+    if mtime is None:
+        return
+
+    try:
+        with open(path) as f:
+            entries = json.load(f)['entries']
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[WARN] Failed to load warm answers from {path}: {e}")
+        return
+    for entry in entries:
+        for key in [entry['query']] + entry.get('aliases', []):
+            # Every replica loads the warm file itself, so these stay out of the shared tier
+            query_embedding_cache.set(key, entry['embedding'], ttl=WARM_TTL, shared=False)
+            if entry.get('answer'):
+                answer_cache.set((corpus_name, version, key), entry['answer'], ttl=WARM_TTL, shared=False)
+    metrics.set_gauge('wisest_warm_answers', len(entries), corpus=corpus_name)
+    print(f"Loaded {len(entries)} warm answers for corpus {corpus_name} version {version}")
+
+
+def retrieve(query_embedding, deadline, match_count=5, corpus_name=DEFAULT_CORPUS, sources=None):
+    """Search the local memory-mapped snapshot when one exists, otherwise Supabase over HTTP
+
+    `sources` (see source_filter) restricts the search to those sources' partitions.
+    """
+    corpus = get_corpus(corpus_name)
+    if corpus is not None:
+        return corpus.search(query_embedding, match_count, sources=sources)
+    function = corpus_config(corpus_name)['match_function']
+    if sources is None:
+        return match_documents_rpc(query_embedding, deadline, match_count, function)
+    # The RPC can't filter, so over-fetch and keep the requested sources' chunks
+    wanted = {source_keyword(source) for source in sources}
+    rows = match_documents_rpc(query_embedding, deadline, match_count * RPC_FILTER_OVERFETCH, function)
+    return [row for row in rows if wanted & {source_keyword(s) for s in record_sources(row)}][:match_count]
+
+
+DEFAULT_SYSTEM_PROMPT = """You are Shirley Huang answering questions about yourself. Keep responses concise (2-3 sentences). When asked about "you" or what makes you unique, focus on YOUR skills and experience as a person, not just describing project features. Be accurate and use the context."""
+
+# System prompt + few-shot exchanges, compiled once per distinct system prompt (one per corpus)
+_chat_prompts = {}
+
+
+def chat_prompt(system_prompt):
+    prompt = _chat_prompts.get(system_prompt)
+    if prompt is None:
+        prompt = _chat_prompts[system_prompt] = Prompt(
+            'chat',
+            {"role": "system", "content": system_prompt},
+            # Few-shot examples
+            {"role": "user", "content": "Context: [React, TypeScript, Python, Flask]\n\nWhat tech do you use?"},
+            {"role": "assistant", "content": "I work with React and TypeScript on frontend, Python and Flask on backend."},
+            {"role": "user", "content": "Context: [BERT fine-tuning, 0.98 F1]\n\nDo you have ML experience?"},
+            {"role": "assistant", "content": "Yeah, I fine-tuned BERT models for fraud detection and got a 0.98 F1 score."},
+            {"role": "user", "content": "Context: [Full-stack dev, UI/UX, scalable systems]\n\nWhat makes you unique?"},
+            {"role": "assistant", "content": "I combine strong full-stack skills with user-centered design thinking. I build products that are both technically solid and genuinely useful."},
+        )
+    return prompt
+
+
+def build_messages(query_text, results_data, corpus_name=DEFAULT_CORPUS):
+    #combine all the chunks and pass it to Groq (best first, so trimming to the budget drops the weakest)
     all_context = "\n\n".join([
         f"Source: {doc['metadata']['source']}\n{doc['content']}"
         for doc in results_data
     ])
+    system_prompt = corpus_config(corpus_name).get('system_prompt') or DEFAULT_SYSTEM_PROMPT
+    return chat_prompt(system_prompt).render("Context: {context}\n\n{question}", fit='context',
+                                             context=all_context, question=query_text)
 
-    #Create a prompt for Groq (natural, concise, adaptive)
-    system_prompt = """You are Shirley Huang answering questions about yourself. Keep responses concise (2-3 sentences). When asked about "you" or what makes you unique, focus on YOUR skills and experience as a person, not just describing project features. Be accurate and use the context."""
 
-    # Run the query using the Groq model via API
+def query_rag(query_text, deadline=None, corpus_name=DEFAULT_CORPUS, sources=None):
+    start_time = time.time()
+    deadline = deadline or Deadline.for_endpoint('chat')
+    cache_key = answer_key(corpus_name, get_corpus(corpus_name), query_text, sources)
+
+    refresh_warm_answers(corpus_name)
+    cached = answer_cache.get(cache_key, wait=deadline.timeout(cap=ANSWER_FILL_WAIT))
+    if cached is not None:
+        return cached
     try:
-        groq_response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers={"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"},
-            json={
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    # Few-shot examples
-                    {"role": "user", "content": f"Context: [React, TypeScript, Python, Flask]\n\nWhat tech do you use?"},
-                    {"role": "assistant", "content": "I work with React and TypeScript on frontend, Python and Flask on backend."},
-                    {"role": "user", "content": f"Context: [BERT fine-tuning, 0.98 F1]\n\nDo you have ML experience?"},
-                    {"role": "assistant", "content": "Yeah, I fine-tuned BERT models for fraud detection and got a 0.98 F1 score."},
-                    {"role": "user", "content": f"Context: [Full-stack dev, UI/UX, scalable systems]\n\nWhat makes you unique?"},
-                    {"role": "assistant", "content": "I combine strong full-stack skills with user-centered design thinking. I build products that are both technically solid and genuinely useful."},
-                    # Actual query
-                    {"role": "user", "content": f"Context: {all_context}\n\n{query_text}"}
-                ],
-                "model": "llama-3.1-8b-instant",
-                "temperature": 0.6
-            },
-            timeout=30
-        )
-        groq_response.raise_for_status()
-        response_data = groq_response.json()
+        return _answer_uncached(query_text, deadline, cache_key, start_time, corpus_name, sources)
+    finally:
+        # No-op once the answer was cached; otherwise lets the next replica try
+        answer_cache.release(cache_key)
+
+
+def _answer_uncached(query_text, deadline, cache_key, start_time, corpus_name, sources=None):
+    #Generate query embedding using Cohere (384 dims for embed-english-light-v3.0)
+    query_embedding = query_embedding_cache.get(cache_key[-1])
+    if query_embedding is None:
+        try:
+            query_embedding = providers.embed([query_text], input_type="search_query", timeout=deadline.timeout(cap=10))[0]
+        except Exception as e:
+            return "I'm having trouble generating an embedding for your question right now."
+        query_embedding_cache.set(cache_key[-1], query_embedding)
+
+    filtered = source_filter(query_text, get_corpus(corpus_name), sources)
+    results_data = retrieve(query_embedding, deadline, corpus_name=corpus_name, sources=filtered)
+    if not results_data and filtered and not sources:
+        # The name match was a false lead; fall back to the whole corpus
+        results_data = retrieve(query_embedding, deadline, corpus_name=corpus_name)
+
+    if not results_data:
+
+        # Log queries with no results
+        log_chat(query_text, "No relevant information found", found_results=False)
+        return "I don't have enough information to answer that question."
+
+    answer, error = generate_answer(query_text, results_data, deadline, cache_key, start_time, corpus_name)
+    return answer or error
+
+
+def generate_answer(query_text, results_data, deadline, cache_key, start_time, corpus_name=DEFAULT_CORPUS):
+    """Generation for one question with its degraded fallback, logging and caching; returns (answer, error)"""
+    # Run the query on Groq, hedging to / failing over to Gemini when Groq is slow or down
+    messages = build_messages(query_text, results_data, corpus_name)
+    try:
+        response_text = providers.generate('chat', messages, timeout=deadline.timeout(cap=30, reserve=0.1))
     except Exception as e:
-        return "I'm having trouble generating a response right now."
+        # Out of time or every generator is down: answer from the retrieved passages instead
+        degraded = summarize_passages(query_text, results_data)
+        metrics.inc('wisest_degraded_responses_total', endpoint='/chat', reason=type(e).__name__)
+        if degraded:
+            log_chat(query_text, degraded, found_results=True, response_time_ms=int((time.time() - start_time) * 1000))
+            return degraded, None
+        return None, "I'm having trouble generating a response right now."
 
     #Extract the response text
-    if response_data and response_data.get("choices"):
-        response_text = response_data["choices"][0]["message"]["content"]
-
+    if response_text:
         # Log to Supabase for analytics
+        response_time_ms = int((time.time() - start_time) * 1000)
+        log_chat(query_text, response_text, found_results=True, response_time_ms=response_time_ms)
+        answer_cache.set(cache_key, response_text)
+        return response_text, None
+    else:
+        # Log failed queries too
+        log_chat(query_text, "Error: Could not generate response", found_results=False)
+        return None, "Sorry, I couldn't generate a response."
+
+
+def query_rag_batch(questions, deadline=None, corpus_name=DEFAULT_CORPUS, sources=None):
+    """Answer several questions with one embedding call, one retrieval pass and concurrent generation
+
+    Returns one {'question', 'answer'} or {'question', 'error'} per question, in order.
+    Repeated questions are only answered once.
+    """
+    start_time = time.time()
+    deadline = deadline or Deadline.for_endpoint('chat')
+    refresh_warm_answers(corpus_name)
+    corpus = get_corpus(corpus_name)
+
+    outcomes = {}
+    pending = {}
+    for question in questions:
+        key = answer_key(corpus_name, corpus, question, sources)
+        if key in outcomes or key in pending:
+            continue
+        cached = answer_cache.get(key)
+        if cached is not None:
+            outcomes[key] = {'answer': cached}
+        else:
+            pending[key] = question
+
+    # One Cohere request for every question we don't already have an embedding for
+    embeddings = {key: query_embedding_cache.get(key[-1]) for key in pending}
+    missing = [key for key, embedding in embeddings.items() if embedding is None]
+    if missing:
         try:
-            response_time_ms = int((time.time() - start_time) * 1000)
-            requests.post(
-                f"{SUPABASE_URL}/rest/v1/chat_logs",
-                headers={
-                    "apikey": SUPABASE_SERVICE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    'query': query_text,
-                    'response': response_text,
-                    'response_time_ms': response_time_ms,
-                    'found_results': True
-                }
-            )
+            vectors = providers.embed([pending[key] for key in missing], input_type="search_query", timeout=deadline.timeout(cap=10))
+            for key, vector in zip(missing, vectors):
+                embeddings[key] = vector
+                query_embedding_cache.set(key[-1], vector)
         except Exception as e:
-            print(f"[WARN] Failed to log query: {e}")
-        
-        return response_text
+            for key in missing:
+                outcomes[key] = {'error': "I'm having trouble generating an embedding for your question right now."}
+                del pending[key]
+
+    keys = list(pending)
+    if not keys:
+        hits = []
     else:
-        # Log failed queries too
+        filters = [source_filter(pending[key], corpus, sources) for key in keys]
+        if corpus is not None:
+            hits = corpus.search_batch([embeddings[key] for key in keys], 5, sources=filters)
+        else:
+            hits = list(_batch_executor.map(lambda key, f: retrieve(embeddings[key], deadline, 5, corpus_name, f), keys, filters))
+        for i, key in enumerate(keys):
+            if not hits[i] and filters[i] and not sources:
+                hits[i] = retrieve(embeddings[key], deadline, 5, corpus_name)
+
+    futures = {}
+    for key, results_data in zip(keys, hits):
+        if results_data:
+            futures[key] = _batch_executor.submit(generate_answer, pending[key], results_data, deadline, key, start_time, corpus_name)
+        else:
+            log_chat(pending[key], "No relevant information found", found_results=False)
+            outcomes[key] = {'answer': "I don't have enough information to answer that question."}
+    for key, future in futures.items():
         try:
-            requests.post(
-                f"{SUPABASE_URL}/rest/v1/chat_logs",
-                headers={
-                    "apikey": SUPABASE_SERVICE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    'query': query_text,
-                    'response': "Error: Could not generate response",
-                    'found_results': False
-                }
-            )
-        except:
-            pass
-        return "Sorry, I couldn't generate a response."
+            answer, error = future.result(timeout=deadline.remaining() + 1)
+        except Exception as e:
+            answer, error = None, "I'm taking longer than usual to think about that. Please try again in a moment!"
+        outcomes[key] = {'answer': answer} if answer else {'error': error}
+
+    return [dict(outcomes[answer_key(corpus_name, corpus, question, sources)], question=question) for question in questions]
 
 
 def main():
     parser = argparse.ArgumentParser(description="Process query with RAG")
     parser.add_argument("--query", type=str, required=True, help="The query text")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Named corpus to answer from")
+    parser.add_argument("--source", action="append", help="Only search this source (path or name, repeatable)")
     args = parser.parse_args()
-    query_rag(args.query)
+    print(query_rag(args.query, corpus_name=args.corpus, sources=args.source))
 
 if __name__ == "__main__":
     main()
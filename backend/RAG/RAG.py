@@ -6,19 +6,21 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema.document import Document
 from supabase import create_client, Client
 import time
+from .corpus import CORPORA, DEFAULT_CORPUS, corpus_config
+from .dedupe import dedupe_chunks
 
 # Supabase config
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_SERVICE_KEY', os.environ.get('SUPABASE_ANON_KEY'))
-DATA_PATH = 'Shirly8/ShirleyHuang-Data'  # GitHub repo
+DATA_PATH = corpus_config(DEFAULT_CORPUS)['data_path']  # GitHub repo (per corpus, see corpus.CORPORA)
 db = None
 COHERE_API_KEY = os.environ.get('COHERE_API_KEY')
 
 
 # Function processes all documents from GitHub RAG folder only
-def load_documents():
+def load_documents(data_path=DATA_PATH):
     """Load markdown and text files from GitHub repo RAG folder"""
-    api_url = f"https://api.github.com/repos/{DATA_PATH}/git/trees/main?recursive=1"
+    api_url = f"https://api.github.com/repos/{data_path}/git/trees/main?recursive=1"
     
     headers = {}
     github_token = os.environ.get('GITHUB_TOKEN')
@@ -35,7 +37,7 @@ def load_documents():
         # Only process files in the RAG/ folder
         if item['type'] == 'blob' and item['path'].startswith('RAG/') and (item['path'].endswith('.md') or item['path'].endswith('.txt')):
             # Fetch content
-            content_url = f"https://raw.githubusercontent.com/{DATA_PATH}/main/{item['path']}"
+            content_url = f"https://raw.githubusercontent.com/{data_path}/main/{item['path']}"
             content_response = requests.get(content_url, headers=headers)
             
             # Create Document object (same as langchain PDFLoader output)
@@ -121,7 +123,7 @@ def initialize_chroma():
 
 
 #Manage vector database with Supabase storing embeddings (replaces ChromaDB)
-def add_to_chroma(chunks: list[Document]):
+def add_to_chroma(chunks: list[Document], table='documents'):
 
     db = initialize_chroma()
     embed_function = get_embedding()
@@ -129,8 +131,11 @@ def add_to_chroma(chunks: list[Document]):
     #Assign page IDs
     id_chunks = createIds(chunks)
 
+    #Drop near-duplicate chunks (overlapping write-ups) before paying to embed them
+    id_chunks = dedupe_chunks(id_chunks)
+
     #Adding documents - check existing
-    existing_items = db.table('documents').select('metadata').execute()
+    existing_items = db.table(table).select('metadata').execute()
     existing_ids = set()
     if existing_items.data:
         for item in existing_items.data:
@@ -154,7 +159,7 @@ def add_to_chroma(chunks: list[Document]):
                 embedding = embed_function(chunk.page_content)
                 
                 # Insert into Supabase
-                db.table('documents').insert({
+                db.table(table).insert({
                     'content': chunk.page_content,
                     'metadata': chunk.metadata,
                     'embedding': embedding
@@ -171,11 +176,11 @@ def add_to_chroma(chunks: list[Document]):
         print("No new documents to add")
 
 
-def clear():
+def clear(table='documents'):
     """Clear Supabase table (replaces ChromaDB delete)"""
     db = initialize_chroma()
     try:
-        db.table('documents').delete().neq('id', 0).execute()
+        db.table(table).delete().neq('id', 0).execute()
         print("✨ Database cleared")
     except Exception as e:
         print(f"Error clearing: {e}")
@@ -186,17 +191,30 @@ def main():
     #Parse command-line
     parser = argparse.ArgumentParser()
     parser.add_argument("--reset", action="store_true", help="Reset the database.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, choices=sorted(CORPORA), help="Which knowledge base to ingest")
     args = parser.parse_args()
+    config = corpus_config(args.corpus)
 
     # Check if the database should be cleared (using the --reset flag)
     if args.reset:
         print("✨ Clearing Database")
-        clear()
+        clear(config['table'])
 
     # Load documents, split into chunks, and add them to Chroma
-    documents = load_documents()
+    documents = load_documents(config['data_path'])
     chunks = split_documents(documents)
-    add_to_chroma(chunks)
+    add_to_chroma(chunks, config['table'])
+
+    # Refresh the local memory-mapped snapshot that serving workers search
+    from .corpus import sync_corpus
+    sync_corpus(args.corpus)
+
+    # Precompute answers for the most asked questions against the new version
+    from .warm_cache import warm
+    try:
+        warm(corpus_name=args.corpus)
+    except Exception as e:
+        print(f"[WARN] Cache warm-up failed: {e}")
 
 
 if __name__ == "__main__":
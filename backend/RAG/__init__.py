@@ -4,7 +4,7 @@ Adapted from QueryIQ for Shirley's portfolio chatbot
 Uses Gemini API (replaces Ollama) + Supabase (replaces ChromaDB)
 """
 
-from .Query import query_rag
+from .Query import query_rag, query_rag_batch
 from . import RAG
 
-__all__ = ['query_rag', 'RAG']
+__all__ = ['query_rag', 'query_rag_batch', 'RAG']
@@ -0,0 +1,226 @@
+"""
+Inverted-file (IVF) approximate nearest-neighbour index for normalized embeddings
+Vectors are bucketed by their nearest k-means centroid; a query scans only the `nprobe`
+closest buckets, so recall and latency trade off through one knob
+
+Saved as a directory of .npy files that load memory-mapped, like the corpus snapshot.
+
+To run the benchmark: python3 -m RAG.ann --benchmark --n 100000 1000000
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+NPROBE = int(os.environ.get('ANN_NPROBE', 8))
+# Retrain from scratch once the index has grown this much past the set it was trained on
+RETRAIN_GROWTH = 4.0
+TRAIN_SAMPLE_PER_LIST = 64
+BLOCK_ROWS = 65536
+
+
+def _normalize(matrix):
+    matrix = np.array(matrix, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+    return matrix
+
+
+def default_nlist(n):
+    """About sqrt(n) buckets, the usual IVF balance between centroid and bucket scans"""
+    return int(max(1, min(65536, round(np.sqrt(n)))))
+
+
+class IVFIndex:
+    def __init__(self, centroids, trained_size=0):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.trained_size = trained_size
+        nlist, dim = self.centroids.shape
+        self.list_ids = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.list_vectors = [np.empty((0, dim), dtype=np.float32) for _ in range(nlist)]
+        # id -> bucket, only built once something is inserted or deleted (loaded indexes stay lean)
+        self._where = None
+
+    @classmethod
+    def train(cls, vectors, nlist=None, iterations=10, seed=0):
+        """Spherical k-means on a sample of the vectors"""
+        vectors = _normalize(vectors)
+        nlist = min(nlist or default_nlist(len(vectors)), len(vectors))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), nlist * TRAIN_SAMPLE_PER_LIST)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            # Reseed empty buckets with random sample points so no centroid goes to waste
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = _normalize(sums)
+        return cls(centroids, trained_size=len(vectors))
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.list_ids)
+
+    def _locations(self):
+        if self._where is None:
+            self._where = {}
+            for bucket, ids in enumerate(self.list_ids):
+                self._where.update((i, bucket) for i in ids.tolist())
+        return self._where
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def assign(self, vectors):
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), BLOCK_ROWS):
+            block = vectors[start:start + BLOCK_ROWS]
+            assignment[start:start + BLOCK_ROWS] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignment
+
+    def insert(self, ids, vectors):
+        """Add (or replace) vectors under integer ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = _normalize(vectors)
+        where = self._locations()
+        if any(i in where for i in ids.tolist()):
+            self.delete(ids)
+        assignment = self.assign(vectors)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+        for bucket in np.flatnonzero(np.diff(bounds)):
+            rows = order[bounds[bucket]:bounds[bucket + 1]]
+            self.list_ids[bucket] = np.concatenate([self.list_ids[bucket], ids[rows]])
+            self.list_vectors[bucket] = np.concatenate([self.list_vectors[bucket], vectors[rows]])
+        where.update(zip(ids.tolist(), assignment.tolist()))
+
+    def delete(self, ids):
+        """Remove ids; unknown ids are ignored. Returns how many were removed"""
+        where = self._locations()
+        by_bucket = {}
+        for i in np.asarray(ids, dtype=np.int64).tolist():
+            bucket = where.pop(i, None)
+            if bucket is not None:
+                by_bucket.setdefault(bucket, []).append(i)
+        for bucket, removed in by_bucket.items():
+            keep = ~np.isin(self.list_ids[bucket], removed)
+            self.list_ids[bucket] = self.list_ids[bucket][keep]
+            self.list_vectors[bucket] = self.list_vectors[bucket][keep]
+        return sum(len(removed) for removed in by_bucket.values())
+
+    def needs_retrain(self):
+        return len(self) > RETRAIN_GROWTH * max(self.trained_size, 1)
+
+    def search(self, query, k=5, nprobe=NPROBE):
+        """(ids, scores) of the approximate top-k by cosine similarity, best first"""
+        query = _normalize(query)[0]
+        probe = np.argsort(-(self.centroids @ query))[:min(nprobe, self.nlist)]
+        ids = np.concatenate([self.list_ids[b] for b in probe])
+        if len(ids) == 0:
+            return ids, np.empty(0, dtype=np.float32)
+        scores = np.concatenate([self.list_vectors[b] @ query for b in probe])
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return ids[top], scores[top]
+
+    def save(self, path):
+        """Buckets are stored back to back with an offsets array (CSR layout)"""
+        os.makedirs(path, exist_ok=True)
+        sizes = [len(ids) for ids in self.list_ids]
+        np.save(os.path.join(path, 'centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'offsets.npy'), np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64))
+        np.save(os.path.join(path, 'ids.npy'), np.concatenate(self.list_ids))
+        np.save(os.path.join(path, 'vectors.npy'), np.concatenate(self.list_vectors))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'trained_size': self.trained_size}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Buckets stay memory-mapped until an insert or delete copies the ones it touches"""
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        index = cls(np.load(os.path.join(path, 'centroids.npy')), meta['trained_size'])
+        offsets = np.load(os.path.join(path, 'offsets.npy'))
+        ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode=mmap_mode)
+        vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode=mmap_mode)
+        for bucket in range(index.nlist):
+            start, end = int(offsets[bucket]), int(offsets[bucket + 1])
+            index.list_ids[bucket] = ids[start:end]
+            index.list_vectors[bucket] = vectors[start:end]
+        return index
+
+
+def build(vectors, previous=None):
+    """Index rows 0..n-1, reusing `previous`'s centroids unless the corpus outgrew them"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if previous is not None and previous.centroids.shape[1] == vectors.shape[1] \
+            and len(vectors) <= RETRAIN_GROWTH * max(previous.trained_size, 1):
+        index = IVFIndex(previous.centroids, previous.trained_size)
+    else:
+        index = IVFIndex.train(vectors)
+    index.insert(np.arange(len(vectors)), vectors)
+    return index
+
+
+def synthetic_embeddings(n, dim=384, clusters=2000, seed=0):
+    """Clustered unit vectors; real embeddings are clumpy, uniform noise would understate IVF"""
+    rng = np.random.default_rng(seed)
+    centers = _normalize(rng.standard_normal((clusters, dim), dtype=np.float32))
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, BLOCK_ROWS):
+        rows = min(BLOCK_ROWS, n - start)
+        vectors[start:start + rows] = centers[rng.integers(clusters, size=rows)] \
+            + 0.05 * rng.standard_normal((rows, dim), dtype=np.float32)
+    return _normalize(vectors)
+
+
+def benchmark(sizes, dim=384, queries=200, k=10, nprobes=(1, 4, 8, 16, 32)):
+    for n in sizes:
+        vectors = synthetic_embeddings(n + queries, dim)
+        corpus, probes = vectors[:n], vectors[n:]
+
+        start = time.perf_counter()
+        index = build(corpus)
+        build_seconds = time.perf_counter() - start
+
+        exact, exact_ms = [], []
+        for query in probes:
+            start = time.perf_counter()
+            scores = corpus @ query
+            top = np.argpartition(-scores, k - 1)[:k]
+            exact_ms.append((time.perf_counter() - start) * 1000)
+            exact.append(set(top.tolist()))
+
+        print(f"\nn={n:,} dim={dim} nlist={index.nlist} build={build_seconds:.1f}s "
+              f"exact p50={np.percentile(exact_ms, 50):.2f}ms")
+        print(f"{'nprobe':>8} {'recall@' + str(k):>10} {'p50 ms':>8} {'p95 ms':>8} {'speedup':>8}")
+        for nprobe in nprobes:
+            recalls, latencies = [], []
+            for query, truth in zip(probes, exact):
+                start = time.perf_counter()
+                ids, _ = index.search(query, k, nprobe)
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(truth & set(ids.tolist())) / k)
+            print(f"{nprobe:>8} {np.mean(recalls):>10.3f} {np.percentile(latencies, 50):>8.2f} "
+                  f"{np.percentile(latencies, 95):>8.2f} {np.percentile(exact_ms, 50) / np.percentile(latencies, 50):>7.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IVF index for the RAG corpus")
+    parser.add_argument("--benchmark", action="store_true", help="Recall and latency against exact search")
+    parser.add_argument("--n", type=int, nargs="+", default=[100000, 1000000], help="Corpus sizes to benchmark")
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.n, args.dim)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""
+Read-only local snapshots of the RAG corpora
+Embeddings and records are memory-mapped files, so every worker process shares one copy
+through the page cache instead of holding its own
+
+Each named corpus (see CORPORA) has its own directory; "default" uses CORPUS_DIR itself:
+    <dir>/CURRENT                  name of the live version
+    <dir>/<version>/embeddings.npy float32, L2-normalized, one row per chunk
+    <dir>/<version>/records.bin    concatenated UTF-8 JSON records {id, content, metadata}
+    <dir>/<version>/offsets.npy    int64 byte offsets into records.bin (n + 1 entries)
+    <dir>/<version>/sources.json   per-source partitions: rows are grouped by source, so each
+                                   source is a contiguous [start, end) slice (plus the rows of
+                                   deduplicated chunks it shares with another source)
+    <dir>/<version>/ivf/           ANN index over the embeddings (large corpora only, see ann.py)
+
+Corpora load on first use and the least recently used ones are dropped once the loaded
+total passes CORPUS_MEMORY_BUDGET_MB.
+
+To run: python3 -m RAG.corpus --sync [--corpus NAME]
+"""
+import argparse
+import json
+import mmap
+import os
+import re
+import shutil
+import signal
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import requests
+
+import metrics
+from .ann import IVFIndex, NPROBE, build as build_ann
+
+CORPUS_DIR = os.environ.get('CORPUS_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'corpus'))
+RELOAD_CHECK_SECONDS = 10
+PAGE_SIZE = 1000
+# Below this many chunks an exact scan is fast enough that an ANN index only costs recall
+ANN_MIN_VECTORS = int(os.environ.get('ANN_MIN_VECTORS', 50000))
+
+CORPUS_MEMORY_BUDGET = int(os.environ.get('CORPUS_MEMORY_BUDGET_MB', 512)) * 1024 * 1024
+
+# File names too generic for a question that mentions them to be about that one file
+GENERIC_SOURCE_NAMES = {'readme', 'index', 'notes', 'about', 'data', 'docs', 'main', 'overview'}
+
+DEFAULT_CORPUS = 'default'
+
+# Knowledge bases this backend serves: where their documents come from, which Supabase table
+# and match function hold them, and which site origins use them by default
+CORPORA = {
+    DEFAULT_CORPUS: {
+        'data_path': 'Shirly8/ShirleyHuang-Data',
+        'table': 'documents',
+        'match_function': 'match_documents',
+        'origins': [],
+    },
+}
+if os.environ.get('CORPORA_CONFIG'):
+    with open(os.environ['CORPORA_CONFIG']) as f:
+        CORPORA.update(json.load(f))
+
+# name -> Corpus, least recently used first
+_loaded = OrderedDict()
+_checked_at = {}
+_lock = threading.Lock()
+
+
+def corpus_config(name):
+    """Settings for a named corpus; raises KeyError for unknown names"""
+    return CORPORA[name]
+
+
+def corpus_for_origin(origin):
+    for name, config in CORPORA.items():
+        if origin and origin in config.get('origins', []):
+            return name
+    return DEFAULT_CORPUS
+
+
+def source_keyword(source):
+    """'RAG/QueryIQ.md' -> 'queryiq': the name a question has to mention to be about a source"""
+    stem = os.path.splitext(os.path.basename(source or ''))[0]
+    return re.sub(r'[^a-z0-9]', '', stem.lower())
+
+
+def record_sources(record):
+    """Every source a chunk belongs to (deduplicated chunks keep all of theirs)"""
+    metadata = record.get('metadata') or {}
+    return list(dict.fromkeys(s for s in [metadata.get('source')] + list(metadata.get('sources') or []) if s))
+
+
+def corpus_root(name=DEFAULT_CORPUS):
+    if name not in CORPORA:
+        raise KeyError(name)
+    return CORPUS_DIR if name == DEFAULT_CORPUS else os.path.join(CORPUS_DIR, 'corpora', name)
+
+
+class Corpus:
+    """Memory-mapped corpus version; cosine search is exact unless the version has an IVF index"""
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self._file = open(os.path.join(path, 'records.bin'), 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._records = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        ann_path = os.path.join(path, 'ivf')
+        self.ann = IVFIndex.load(ann_path) if os.path.isdir(ann_path) else None
+        self._partitions = None
+        self._keywords = None
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    @property
+    def nbytes(self):
+        """Size of everything this version maps, which is what it costs once it's warm"""
+        size = self.embeddings.nbytes + self.offsets.nbytes + len(self._records)
+        if self.ann is not None:
+            size += sum(ids.nbytes + vectors.nbytes for ids, vectors in zip(self.ann.list_ids, self.ann.list_vectors))
+        return size
+
+    def record(self, index):
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return json.loads(self._records[start:end].decode('utf-8'))
+
+    @property
+    def partitions(self):
+        """source -> (start, end, extra rows); built from the records for snapshots without sources.json"""
+        if self._partitions is None:
+            try:
+                with open(os.path.join(self.path, 'sources.json')) as f:
+                    self._partitions = {source: (p['start'], p['end'], np.asarray(p['extra'], dtype=np.int64))
+                                        for source, p in json.load(f).items()}
+            except FileNotFoundError:
+                rows = {}
+                for i in range(len(self)):
+                    for source in record_sources(self.record(i)):
+                        rows.setdefault(source, []).append(i)
+                self._partitions = {source: (0, 0, np.asarray(ids, dtype=np.int64)) for source, ids in rows.items()}
+        return self._partitions
+
+    def resolve_sources(self, names):
+        """Sources matching a filter; each name is a full source path or its keyword ('Wisest')"""
+        wanted = {source_keyword(name) for name in names}
+        return sorted(source for source in self.partitions
+                      if source in names or source_keyword(source) in wanted)
+
+    def infer_sources(self, query_text):
+        """Sources whose name the question mentions, e.g. 'How does QueryIQ work?' -> RAG/QueryIQ.md"""
+        if self._keywords is None:
+            keywords = {}
+            for source in self.partitions:
+                keyword = source_keyword(source)
+                if len(keyword) >= 3 and keyword not in GENERIC_SOURCE_NAMES:
+                    keywords.setdefault(keyword, []).append(source)
+            self._keywords = keywords
+        words = re.findall(r'[a-z0-9]+', query_text.lower())
+        # Names written as several words ("query iq", "shirley huang data") match too
+        candidates = {''.join(words[i:i + n]) for n in (1, 2, 3) for i in range(len(words) - n + 1)}
+        return sorted(source for keyword in candidates & set(self._keywords) for source in self._keywords[keyword])
+
+    def _search_partitions(self, query, k, sources):
+        parts = [self.partitions[source] for source in sources if source in self.partitions]
+        if not parts:
+            return []
+        with metrics.timed('wisest_stage_seconds', stage='partition_search'):
+            ids = np.concatenate([np.arange(start, end) for start, end, _ in parts] + [extra for _, _, extra in parts])
+            scores = np.concatenate([self.embeddings[start:end] @ query for start, end, _ in parts]
+                                    + [self.embeddings[extra] @ query for _, _, extra in parts if len(extra)])
+            # A chunk shared by two of the requested sources is only scored once
+            ids, first = np.unique(ids, return_index=True)
+            scores = scores[first]
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        return [dict(self.record(int(ids[i])), similarity=float(scores[i])) for i in top]
+
+    def search(self, query_embedding, k=5, exact=None, sources=None):
+        """Top-k chunks by cosine similarity, shaped like match_documents rows
+
+        With `sources` only those sources' partitions are scanned (always exactly; a partition
+        is a small slice of the corpus).
+        """
+        if len(self) == 0:
+            return []
+        if sources is not None:
+            query = np.array(query_embedding, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            return self._search_partitions(query, k, sources)
+        if self.ann is not None and not exact:
+            with metrics.timed('wisest_stage_seconds', stage='ann_search'):
+                top, top_scores = self.ann.search(query_embedding, k, NPROBE)
+            return [dict(self.record(int(i)), similarity=float(s)) for i, s in zip(top, top_scores)]
+
+        query = np.array(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with metrics.timed('wisest_stage_seconds', stage='local_search'):
+            scores = self.embeddings @ query
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        return [dict(self.record(int(i)), similarity=float(scores[i])) for i in top]
+
+    def search_batch(self, query_embeddings, k=5, sources=None):
+        """search() for many queries at once: one matrix multiply, each record decoded once
+
+        `sources` optionally holds a filter per query (None for unfiltered); filtered queries
+        search their partitions one by one.
+        """
+        if len(self) == 0:
+            return [[] for _ in query_embeddings]
+        if sources is not None and any(f is not None for f in sources):
+            results = [None] * len(query_embeddings)
+            unfiltered = [i for i, f in enumerate(sources) if f is None]
+            for i, f in enumerate(sources):
+                if f is not None:
+                    results[i] = self.search(query_embeddings[i], k, sources=f)
+            if unfiltered:
+                for i, hits in zip(unfiltered, self.search_batch([query_embeddings[i] for i in unfiltered], k)):
+                    results[i] = hits
+            return results
+        queries = np.array(query_embeddings, dtype=np.float32, ndmin=2)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries /= np.where(norms == 0, 1.0, norms)
+        k = min(k, len(self))
+        with metrics.timed('wisest_stage_seconds', stage='local_search_batch'):
+            if self.ann is not None:
+                hits = [self.ann.search(query, k, NPROBE) for query in queries]
+            else:
+                scores = queries @ self.embeddings.T
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                hits = []
+                for row, candidates in enumerate(top):
+                    ranked = candidates[np.argsort(-scores[row, candidates])]
+                    hits.append((ranked, scores[row, ranked]))
+        records = {}
+        results = []
+        for ids, top_scores in hits:
+            for i in ids:
+                if int(i) not in records:
+                    records[int(i)] = self.record(int(i))
+            results.append([dict(records[int(i)], similarity=float(s)) for i, s in zip(ids, top_scores)])
+        return results
+
+    def close(self):
+        if self._records:
+            self._records.close()
+        self._file.close()
+
+
+def current_version(corpus_dir=CORPUS_DIR):
+    try:
+        with open(os.path.join(corpus_dir, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_corpus(corpus_dir=CORPUS_DIR, version=None):
+    version = version or current_version(corpus_dir)
+    if not version:
+        return None
+    return Corpus(os.path.join(corpus_dir, version), version)
+
+
+def _evict(keep):
+    """Drop least recently used corpora until the loaded total fits the memory budget"""
+    total = sum(corpus.nbytes for corpus in _loaded.values())
+    while total > CORPUS_MEMORY_BUDGET and len(_loaded) > 1:
+        name = next(iter(_loaded))
+        if name == keep:
+            _loaded.move_to_end(name)
+            continue
+        total -= _loaded.pop(name).nbytes
+        _checked_at.pop(name, None)
+        metrics.inc('wisest_corpus_evictions_total', corpus=name)
+        print(f"Evicted corpus {name} to stay under the memory budget")
+    metrics.set_gauge('wisest_corpus_loaded_bytes', total)
+
+
+def get_corpus(name=DEFAULT_CORPUS):
+    """Live snapshot of a named corpus for this process, or None when it has no snapshot
+
+    Loads on first use and checks CURRENT every few seconds, so workers pick up a new version
+    without a restart. Evicted or replaced versions stay mapped until their last reference is
+    dropped, so in-flight searches are never cut off.
+    """
+    now = time.monotonic()
+    corpus = _loaded.get(name)
+    if now - _checked_at.get(name, -RELOAD_CHECK_SECONDS) < RELOAD_CHECK_SECONDS:
+        if corpus is not None:
+            with _lock:
+                if name in _loaded:
+                    _loaded.move_to_end(name)
+        return corpus
+    with _lock:
+        if now - _checked_at.get(name, -RELOAD_CHECK_SECONDS) >= RELOAD_CHECK_SECONDS:
+            version = current_version(corpus_root(name))
+            corpus = _loaded.get(name)
+            if version and (corpus is None or corpus.version != version):
+                try:
+                    _loaded[name] = load_corpus(corpus_root(name), version)
+                    print(f"Loaded corpus {name} version {version} ({len(_loaded[name])} chunks)")
+                except Exception as e:
+                    print(f"[WARN] Failed to load corpus {name} {version}: {e}")
+            # Only marked checked once loaded, so concurrent first callers wait here instead of
+            # taking the fast path and seeing no corpus yet
+            _checked_at[name] = now
+        corpus = _loaded.get(name)
+        if corpus is not None:
+            _loaded.move_to_end(name)
+            _evict(keep=name)
+    return corpus
+
+
+def write_snapshot(records, embeddings, corpus_dir=CORPUS_DIR, keep=2):
+    """Write a new version next to the live one, then atomically point CURRENT at it
+
+    Large corpora also get an IVF index, reusing the previous version's centroids when they still fit.
+    """
+    version = time.strftime('%Y%m%d%H%M%S') + f'{int(time.time() * 1000) % 1000:03d}'
+    os.makedirs(corpus_dir, exist_ok=True)
+    tmp = os.path.join(corpus_dir, f'.{version}.tmp')
+    os.makedirs(tmp, exist_ok=True)
+
+    matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(records), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+
+    # Group rows by source so a filtered search scans one contiguous slice per source
+    order = sorted(range(len(records)), key=lambda i: (record_sources(records[i]) or [''])[0])
+    records = [records[i] for i in order]
+    matrix = matrix[order] if len(records) else matrix
+    partitions = {}
+    for row, record in enumerate(records):
+        sources = record_sources(record)
+        for position, source in enumerate(sources):
+            partition = partitions.setdefault(source, {'start': None, 'end': 0, 'extra': []})
+            if position == 0:
+                if partition['start'] is None:
+                    partition['start'] = row
+                partition['end'] = row + 1
+            else:
+                partition['extra'].append(row)
+    for partition in partitions.values():
+        # Sources that only hold deduplicated chunks have no slice of their own
+        if partition['start'] is None:
+            partition['start'] = 0
+    with open(os.path.join(tmp, 'sources.json'), 'w') as f:
+        json.dump(partitions, f)
+    np.save(os.path.join(tmp, 'embeddings.npy'), matrix)
+
+    offsets = [0]
+    with open(os.path.join(tmp, 'records.bin'), 'wb') as f:
+        for record in records:
+            blob = json.dumps(record, ensure_ascii=False).encode('utf-8')
+            f.write(blob)
+            offsets.append(offsets[-1] + len(blob))
+    np.save(os.path.join(tmp, 'offsets.npy'), np.asarray(offsets, dtype=np.int64))
+
+    if len(records) >= ANN_MIN_VECTORS:
+        previous_path = os.path.join(corpus_dir, current_version(corpus_dir) or '', 'ivf')
+        previous = IVFIndex.load(previous_path) if os.path.isdir(previous_path) else None
+        build_ann(matrix, previous).save(os.path.join(tmp, 'ivf'))
+
+    os.replace(tmp, os.path.join(corpus_dir, version))
+    pointer = os.path.join(corpus_dir, '.CURRENT.tmp')
+    with open(pointer, 'w') as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(corpus_dir, 'CURRENT'))
+
+    # Old versions may still be mapped by workers, so keep the most recent few around
+    versions = sorted(d for d in os.listdir(corpus_dir) if d.isdigit())
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(corpus_dir, old), ignore_errors=True)
+    return version
+
+
+def fetch_documents(table='documents'):
+    """All rows of a Supabase documents table, paged"""
+    supabase_url = os.environ.get('SUPABASE_URL')
+    supabase_key = os.environ.get('SUPABASE_SERVICE_KEY')
+    headers = {
+        "apikey": supabase_key,
+        "Authorization": f"Bearer {supabase_key}",
+    }
+    rows = []
+    while True:
+        response = requests.get(
+            f"{supabase_url}/rest/v1/{table}",
+            headers={**headers, "Range": f"{len(rows)}-{len(rows) + PAGE_SIZE - 1}"},
+            params={"select": "id,content,metadata,embedding", "order": "id"},
+            timeout=30
+        )
+        response.raise_for_status()
+        page = response.json()
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+
+
+def sync_corpus(name=DEFAULT_CORPUS):
+    """Snapshot a corpus's Supabase table into a new local version"""
+    rows = [row for row in fetch_documents(corpus_config(name)['table']) if row.get('embedding')]
+    records, embeddings = [], []
+    for row in rows:
+        embedding = row['embedding']
+        # pgvector columns come back from PostgREST as a '[...]' string
+        if isinstance(embedding, str):
+            embedding = json.loads(embedding)
+        records.append({'id': row['id'], 'content': row['content'], 'metadata': row['metadata']})
+        embeddings.append(embedding)
+    version = write_snapshot(records, embeddings, corpus_root(name))
+    print(f"✅ Corpus {name} version {version}: {len(records)} chunks")
+    return version
+
+
+def notify_workers(pidfile):
+    """SIGHUP the gunicorn master so workers are gracefully replaced"""
+    try:
+        with open(pidfile) as f:
+            os.kill(int(f.read().strip()), signal.SIGHUP)
+        print(f"🔄 Sent reload to gunicorn ({pidfile})")
+    except (FileNotFoundError, ValueError, ProcessLookupError) as e:
+        print(f"No running server to reload: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local RAG corpus snapshot")
+    parser.add_argument("--sync", action="store_true", help="Snapshot the corpus's Supabase table")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, choices=sorted(CORPORA))
+    parser.add_argument("--reload", action="store_true", help="Gracefully reload gunicorn workers afterwards")
+    parser.add_argument("--pidfile", default=os.environ.get('GUNICORN_PIDFILE', '/tmp/wisest-gunicorn.pid'))
+    args = parser.parse_args()
+
+    if args.sync:
+        sync_corpus(args.corpus)
+    if args.reload:
+        notify_workers(args.pidfile)
+
+
+if __name__ == "__main__":
+    main()
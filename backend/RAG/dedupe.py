@@ -0,0 +1,90 @@
+"""
+Near-duplicate chunk detection for ingestion
+MinHash signatures over word shingles, LSH banding to find candidate pairs in roughly linear
+time, then one canonical chunk per group that keeps every source it appeared in
+"""
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+# 16 bands x 8 rows puts the LSH candidate threshold around 0.7 Jaccard; pairs are then
+# confirmed against THRESHOLD using the full signature
+BANDS = 16
+THRESHOLD = 0.8
+_PRIME = 4294967311  # smallest prime above 2**32
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    """32-bit hashes of overlapping word n-grams (the whole text if it's shorter than one)"""
+    words = re.findall(r'[a-z0-9]+', text.lower())
+    grams = {' '.join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def minhash(texts, num_perm=NUM_PERM, seed=1):
+    """(len(texts), num_perm) signature matrix; row agreement estimates Jaccard similarity"""
+    rng = np.random.default_rng(seed)
+    # Below 2**31 so a * x + b stays inside uint64 for 32-bit x
+    a = rng.integers(1, 2 ** 31, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 31, num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        hashes = shingles(text)
+        signatures[row] = ((hashes[:, None] * a + b) % _PRIME).min(axis=0)
+    return signatures
+
+
+def near_duplicate_groups(signatures, bands=BANDS, threshold=THRESHOLD):
+    """Groups (lists of row indexes, 2+ members) of rows whose estimated Jaccard >= threshold"""
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for i, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+            buckets[key].append(i)
+        for members in buckets.values():
+            for other in members[1:]:
+                first, second = find(members[0]), find(other)
+                if first != second and np.mean(signatures[members[0]] == signatures[other]) >= threshold:
+                    parent[second] = first
+
+    groups = defaultdict(list)
+    for i in range(n):
+        groups[find(i)].append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def dedupe_chunks(chunks, threshold=THRESHOLD):
+    """Keep one chunk per near-duplicate group (the longest) with the group's sources merged
+
+    Works on anything with `page_content` and a `metadata` dict (langchain Documents).
+    The canonical chunk's metadata gains `sources` (every source it appeared in) and
+    `duplicate_ids` (the chunk ids that were dropped in its favour).
+    """
+    if len(chunks) < 2:
+        return list(chunks)
+    signatures = minhash([chunk.page_content for chunk in chunks])
+    dropped = set()
+    for members in near_duplicate_groups(signatures, threshold=threshold):
+        canonical = max(members, key=lambda i: (len(chunks[i].page_content), -i))
+        metadata = chunks[canonical].metadata
+        sources = [chunks[i].metadata.get('source') for i in sorted(members)]
+        metadata['sources'] = list(dict.fromkeys(s for s in sources if s))
+        metadata['duplicate_ids'] = [chunks[i].metadata.get('id') for i in sorted(members) if i != canonical]
+        dropped.update(i for i in members if i != canonical)
+
+    if dropped:
+        print(f"🧹 Dropped {len(dropped)} near-duplicate chunks ({len(dropped) / len(chunks):.0%} of {len(chunks)})")
+    return [chunk for i, chunk in enumerate(chunks) if i not in dropped]
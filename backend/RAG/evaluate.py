@@ -0,0 +1,354 @@
+"""
+Offline retrieval evaluation for the RAG pipeline
+Scores retrieval configurations against a labelled question -> expected-source set using
+cached embeddings and local corpus snapshots, so comparing them makes no live API calls
+
+Question set (JSONL): {"question": "...", "expected_sources": ["RAG/projects.md", ...]}
+A configuration is METHOD or METHOD@VARIANT, e.g. exact, ann, hybrid, filtered, exact@chunk400
+(ANN_NPROBE sets how many IVF buckets `ann` scans)
+
+To run:
+    python3 -m RAG.evaluate seed --limit 50             # questions from chat_logs, label by hand
+    python3 -m RAG.evaluate build-variant --chunk-size 400
+    python3 -m RAG.evaluate embed                       # cache question embeddings (live, once)
+    python3 -m RAG.evaluate run --config exact --config hybrid --config exact@chunk400
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+
+import numpy as np
+import requests
+
+import providers
+from prompts import count_tokens
+from singleflight import normalize_query
+from .ann import build as build_ann
+from .dedupe import dedupe_chunks
+from .corpus import CORPORA, CORPUS_DIR, DEFAULT_CORPUS, corpus_root, load_corpus, write_snapshot
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval_questions.jsonl')
+EMBEDDINGS_PATH = os.path.join(CORPUS_DIR, 'eval_embeddings.json')
+VARIANTS_DIR = os.path.join(CORPUS_DIR, 'variants')
+K_VALUES = (1, 3, 5)
+EMBED_BATCH = 96
+RRF_K = 60
+
+
+def tokenize(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+class EmbeddingCache:
+    """Embeddings keyed by (input_type, text) in one JSON file"""
+
+    def __init__(self, path=EMBEDDINGS_PATH):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.vectors = json.load(f)
+        except FileNotFoundError:
+            self.vectors = {}
+
+    @staticmethod
+    def key(text, input_type):
+        return hashlib.sha256(f'{input_type}\n{text}'.encode('utf-8')).hexdigest()
+
+    def get(self, text, input_type):
+        return self.vectors.get(self.key(text, input_type))
+
+    def fill(self, texts, input_type):
+        """Embed every text not cached yet; the only step that calls Cohere"""
+        missing = list(dict.fromkeys(t for t in texts if self.get(t, input_type) is None))
+        for start in range(0, len(missing), EMBED_BATCH):
+            batch = missing[start:start + EMBED_BATCH]
+            for text, vector in zip(batch, providers.embed(batch, input_type=input_type, timeout=60)):
+                self.vectors[self.key(text, input_type)] = vector
+            print(f"  ✓ Embedded {min(start + EMBED_BATCH, len(missing))}/{len(missing)}")
+        if missing:
+            self.save()
+        return len(missing)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.vectors, f)
+        os.replace(tmp, self.path)
+
+
+class BM25:
+    """Okapi BM25 over a fixed set of texts"""
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.n = len(texts)
+        postings = {}
+        lengths = np.zeros(self.n, dtype=np.float32)
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc, tf))
+        self.norm = k1 * (1 - b + b * lengths / (lengths.mean() if self.n else 1.0))
+        self.postings = {
+            term: (np.array([d for d, _ in docs]), np.array([tf for _, tf in docs], dtype=np.float32))
+            for term, docs in postings.items()
+        }
+
+    def scores(self, query):
+        scores = np.zeros(self.n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs, tf = self.postings[term]
+            idf = math.log(1 + (self.n - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self.norm[docs])
+        return scores
+
+
+def _top(scores, k):
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def search_exact(corpus, question, embedding, k):
+    return corpus.search(embedding, k, exact=True)
+
+
+def search_ann(corpus, question, embedding, k):
+    return corpus.search(embedding, k)
+
+
+def search_filtered(corpus, question, embedding, k):
+    """Per-source partitions for questions that name a source, like serving does"""
+    sources = corpus.infer_sources(question)
+    return (corpus.search(embedding, k, sources=sources) if sources else []) or corpus.search(embedding, k)
+
+
+def search_hybrid(corpus, question, embedding, k, candidates=50):
+    """Dense and BM25 rankings fused with reciprocal rank fusion"""
+    query = np.asarray(embedding, dtype=np.float32)
+    query /= np.linalg.norm(query) or 1.0
+    fused = {}
+    for ranking in (_top(corpus.embeddings @ query, candidates), _top(corpus.bm25.scores(question), candidates)):
+        for rank, index in enumerate(ranking):
+            fused[int(index)] = fused.get(int(index), 0.0) + 1.0 / (RRF_K + rank + 1)
+    best = sorted(fused, key=fused.get, reverse=True)[:k]
+    return [dict(corpus.record(i), similarity=fused[i]) for i in best]
+
+
+METHODS = {
+    'exact': search_exact,
+    'ann': search_ann,
+    'hybrid': search_hybrid,
+    'filtered': search_filtered,
+}
+
+
+def load_questions(path=QUESTIONS_PATH):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_variant(variant):
+    """'live' is the default serving snapshot, a corpus name is that corpus's serving snapshot,
+    anything else is a snapshot built by build-variant"""
+    if variant == 'live':
+        corpus_dir = corpus_root(DEFAULT_CORPUS)
+    elif variant in CORPORA:
+        corpus_dir = corpus_root(variant)
+    else:
+        corpus_dir = os.path.join(VARIANTS_DIR, variant)
+    corpus = load_corpus(corpus_dir)
+    if corpus is None:
+        raise SystemExit(f"No corpus snapshot for variant '{variant}' in {corpus_dir}")
+    # Built up front so index construction doesn't count as query latency
+    corpus.bm25 = BM25([corpus.record(i)['content'] for i in range(len(corpus))])
+    if corpus.ann is None:
+        # Small snapshots aren't indexed when written; build one so `ann` can still be compared
+        corpus.ann = build_ann(corpus.embeddings)
+    return corpus
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def evaluate(config, corpus, questions, embeddings, k=max(K_VALUES)):
+    """recall@k, MRR, context tokens and retrieval latency for one configuration"""
+    method = METHODS[config.split('@')[0]]
+    hits = {cutoff: [] for cutoff in K_VALUES if cutoff <= k}
+    reciprocal_ranks, tokens, latencies = [], [], []
+
+    for item in questions:
+        expected = set(item['expected_sources'])
+        start = time.perf_counter()
+        results = method(corpus, item['question'], embeddings.get(item['question'], 'search_query'), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        # A deduplicated chunk counts for every source it was merged from
+        sources = [set(doc['metadata'].get('sources') or [doc['metadata'].get('source')]) for doc in results]
+        for cutoff in hits:
+            hits[cutoff].append(len(expected & set().union(*sources[:cutoff])) / len(expected))
+        first = next((rank for rank, found in enumerate(sources, 1) if found & expected), None)
+        reciprocal_ranks.append(1.0 / first if first else 0.0)
+        # Same context string Query.py sends to the generator
+        tokens.append(count_tokens("\n\n".join(f"Source: {doc['metadata']['source']}\n{doc['content']}" for doc in results)))
+
+    report = {'config': config, 'questions': len(questions), 'chunks': len(corpus)}
+    for cutoff, values in hits.items():
+        report[f'recall@{cutoff}'] = float(np.mean(values))
+    report['mrr'] = float(np.mean(reciprocal_ranks))
+    report['context_tokens'] = float(np.mean(tokens))
+    report['latency_p50_ms'] = _percentile(latencies, 50)
+    report['latency_p95_ms'] = _percentile(latencies, 95)
+    return report
+
+
+def print_reports(reports):
+    columns = [c for c in reports[0] if c not in ('questions',)]
+    widths = [max(len(c), 10) for c in columns]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for report in reports:
+        cells = [f'{report[c]:.3f}' if isinstance(report[c], float) else str(report[c]) for c in columns]
+        print('  '.join(cell.ljust(w) for cell, w in zip(cells, widths)))
+
+
+def top_logged_queries(window=5000):
+    """(normalized query, original text, count) for the last `window` answered chat_logs rows,
+    most frequent first"""
+    supabase_url = os.environ.get('SUPABASE_URL')
+    supabase_key = os.environ.get('SUPABASE_SERVICE_KEY')
+    response = requests.get(
+        f"{supabase_url}/rest/v1/chat_logs",
+        headers={"apikey": supabase_key, "Authorization": f"Bearer {supabase_key}"},
+        params={"select": "query", "found_results": "eq.true", "order": "id.desc", "limit": window},
+        timeout=30
+    )
+    response.raise_for_status()
+
+    counts, originals = Counter(), {}
+    for row in response.json():
+        key = normalize_query(row.get('query') or '')
+        if key:
+            counts[key] += 1
+            originals.setdefault(key, row['query'].strip())
+    return [(key, originals[key], count) for key, count in counts.most_common()]
+
+
+def seed_from_chat_logs(limit=50, path=QUESTIONS_PATH):
+    """Most frequent answered questions from chat_logs, with empty labels to fill in by hand"""
+    existing = {normalize_query(q['question']) for q in load_questions(path)} if os.path.exists(path) else set()
+    added = 0
+    with open(path, 'a') as f:
+        for key, question, count in top_logged_queries():
+            if added >= limit:
+                break
+            if key in existing:
+                continue
+            f.write(json.dumps({'question': question, 'expected_sources': [], 'asked': count}) + '\n')
+            added += 1
+    print(f"✅ Added {added} questions to {path}; fill in expected_sources before running")
+
+
+def build_variant(chunk_size, chunk_overlap=None, embeddings=None, keep_duplicates=False):
+    """Re-chunk the source documents and snapshot them as an evaluation variant"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from .RAG import load_documents
+
+    chunk_overlap = int(chunk_size * 0.1) if chunk_overlap is None else chunk_overlap
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+    )
+    chunks = splitter.split_documents(load_documents())
+
+    counts = Counter()
+    for chunk in chunks:
+        page_id = f"{chunk.metadata.get('source')}:{chunk.metadata.get('page')}"
+        chunk.metadata['id'] = f"{page_id}:{counts[page_id]}"
+        counts[page_id] += 1
+    if not keep_duplicates:
+        chunks = dedupe_chunks(chunks)
+
+    embeddings = embeddings or EmbeddingCache()
+    texts = [chunk.page_content for chunk in chunks]
+    embeddings.fill(texts, 'search_document')
+    records = [{'id': index, 'content': chunk.page_content, 'metadata': chunk.metadata} for index, chunk in enumerate(chunks)]
+
+    name = f'chunk{chunk_size}' + ('-dups' if keep_duplicates else '')
+    version = write_snapshot(records, [embeddings.get(t, 'search_document') for t in texts],
+                             os.path.join(VARIANTS_DIR, name), keep=1)
+    print(f"✅ Variant {name} ({len(records)} chunks, overlap {chunk_overlap}) version {version}")
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval evaluation")
+    parser.add_argument("--questions", default=QUESTIONS_PATH, help="Labelled question set (JSONL)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed = commands.add_parser("seed", help="Append unlabelled questions mined from chat_logs")
+    seed.add_argument("--limit", type=int, default=50)
+
+    variant = commands.add_parser("build-variant", help="Snapshot a re-chunked corpus to compare against")
+    variant.add_argument("--chunk-size", type=int, required=True)
+    variant.add_argument("--chunk-overlap", type=int)
+    variant.add_argument("--keep-duplicates", action="store_true", help="Skip near-duplicate removal (snapshot named chunkN-dups)")
+
+    commands.add_parser("embed", help="Cache embeddings for every question (calls Cohere)")
+
+    run = commands.add_parser("run", help="Evaluate configurations offline")
+    run.add_argument("--config", action="append", help="METHOD[@VARIANT]; defaults to every method on the live snapshot")
+    run.add_argument("-k", type=int, default=max(K_VALUES), help="Chunks retrieved per question")
+    run.add_argument("--json", help="Also write the reports to this file")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        seed_from_chat_logs(args.limit, args.questions)
+        return
+    if args.command == "build-variant":
+        build_variant(args.chunk_size, args.chunk_overlap, keep_duplicates=args.keep_duplicates)
+        return
+
+    questions = [q for q in load_questions(args.questions) if q.get('expected_sources')]
+    embeddings = EmbeddingCache()
+    if args.command == "embed":
+        added = embeddings.fill([q['question'] for q in questions], 'search_query')
+        print(f"✅ {added} new question embeddings cached")
+        return
+
+    missing = [q['question'] for q in questions if embeddings.get(q['question'], 'search_query') is None]
+    if missing:
+        raise SystemExit(f"{len(missing)} questions have no cached embedding; run `python3 -m RAG.evaluate embed` first")
+
+    configs = args.config or list(METHODS)
+    corpora = {}
+    reports = []
+    for config in configs:
+        method, _, variant = config.partition('@')
+        if method not in METHODS:
+            raise SystemExit(f"Unknown method '{method}' (choose from {', '.join(METHODS)})")
+        variant = variant or 'live'
+        if variant not in corpora:
+            corpora[variant] = load_variant(variant)
+        reports.append(evaluate(config, corpora[variant], questions, embeddings, args.k))
+
+    print_reports(reports)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Precompute answers for the most asked chat questions
+Mines chat_logs for the most frequent normalized queries, folds near-duplicates into them,
+and writes embeddings, retrieved chunks and answers for the current corpus version to
+warm.json next to it. Workers load that file at boot and whenever the corpus changes.
+
+To run (e.g. hourly from cron, and automatically after each re-ingestion):
+    python3 -m RAG.warm_cache --top 100 [--corpus NAME]
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import providers
+from deadline import Deadline
+from .corpus import CORPORA, DEFAULT_CORPUS, get_corpus
+from .evaluate import top_logged_queries
+from .Query import build_messages, retrieve, source_filter, warm_file_path
+
+LOG_WINDOW = 5000
+EMBED_BATCH = 96
+# Queries this close to a more frequent one share its answer
+NEAR_DUPLICATE_SIMILARITY = 0.95
+
+
+def embed_all(texts):
+    vectors = []
+    for start in range(0, len(texts), EMBED_BATCH):
+        vectors.extend(providers.embed(texts[start:start + EMBED_BATCH], input_type="search_query", timeout=60))
+    return vectors
+
+
+def group_near_duplicates(queries, vectors, top):
+    """Greedy clustering: each query joins the most frequent earlier query it nearly matches"""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+
+    groups, heads = [], []
+    for index, (key, text, count) in enumerate(queries):
+        if heads:
+            similarity = matrix[heads] @ matrix[index]
+            best = int(np.argmax(similarity))
+            if similarity[best] >= NEAR_DUPLICATE_SIMILARITY:
+                groups[best]['aliases'].append(key)
+                groups[best]['count'] += count
+                continue
+        if len(groups) < top:
+            heads.append(index)
+            groups.append({'query': key, 'text': text, 'count': count, 'aliases': [], 'embedding': vectors[index]})
+    return groups
+
+
+def answer(text, embedding, corpus_name=DEFAULT_CORPUS):
+    """Embedding -> retrieval -> generation, without logging or touching the serving caches"""
+    deadline = Deadline(60)
+    # Same source inference as serving, so the warm answer matches what a live request would give
+    filtered = source_filter(text, get_corpus(corpus_name))
+    results = retrieve(embedding, deadline, corpus_name=corpus_name, sources=filtered)
+    if not results and filtered:
+        results = retrieve(embedding, deadline, corpus_name=corpus_name)
+    if not results:
+        return [], None
+    response_text = providers.generate('chat', build_messages(text, results, corpus_name), timeout=deadline.timeout(cap=30))
+    return results, response_text or None
+
+
+def warm(top=100, corpus_name=DEFAULT_CORPUS):
+    corpus = get_corpus(corpus_name)
+    version = corpus.version if corpus is not None else None
+    queries = top_logged_queries(LOG_WINDOW)[:top * 3]
+    if not queries:
+        print("No chat history to warm from")
+        return 0
+
+    groups = group_near_duplicates(queries, embed_all([text for _, text, _ in queries]), top)
+    entries = []
+    for group in groups:
+        try:
+            results, response_text = answer(group['text'], group['embedding'], corpus_name)
+        except Exception as e:
+            print(f"  ✗ {group['text']}: {e}")
+            continue
+        # The embedding is still worth serving even when no answer could be generated
+        entries.append(dict(group, answer=response_text, sources=[doc['metadata'].get('id') for doc in results]))
+        print(f"  ✓ ({group['count']}x, {len(group['aliases'])} variants) {group['text']}")
+
+    path = warm_file_path(corpus, corpus_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'version': version, 'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'entries': entries}, f)
+    os.replace(tmp, path)
+    print(f"✅ Warmed {sum(1 for e in entries if e['answer'])}/{len(entries)} answers for corpus {corpus_name} version {version}")
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute answers for the most asked questions")
+    parser.add_argument("--top", type=int, default=100, help="Distinct questions to warm")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, choices=sorted(CORPORA))
+    args = parser.parse_args()
+    warm(args.top, args.corpus)
+
+
+if __name__ == "__main__":
+    main()
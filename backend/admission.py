@@ -0,0 +1,177 @@
+"""
+Admission control for the API
+Each endpoint class gets its own bounded concurrency pool with a short wait queue, so slow
+LLM calls can't starve cheap tracking calls (and vice versa). Saturated pools shed load with
+503 + Retry-After, and a per-client token bucket protects provider quotas with 429
+
+Everything here is per worker process. Pools protect the worker's own threads, so
+gunicorn.conf.py sizes `threads` from them (THREADS_NEEDED): a request holds a thread while it
+runs or waits in a pool queue, and anything past a full queue is shed at once, so one class
+can never take the threads another class needs. Rate limits are meant per client across the
+deployment, so they're divided by the worker count (WEB_CONCURRENCY, set by gunicorn.conf.py)
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Routes not listed here (/health, /metrics, /test, ...) are never queued or shed
+ENDPOINT_CLASSES = {
+    '/chat': 'llm',
+    '/chat/batch': 'llm',
+    '/wisest': 'llm',
+    '/affirmations': 'llm',
+    '/score': 'compute',
+    '/sensitivity': 'compute',
+    '/track-visit': 'tracking',
+    '/update-visit': 'tracking',
+}
+
+
+def _env(name, default):
+    return type(default)(os.environ.get(name, default))
+
+
+class Pool:
+    """Bounded concurrency with a bounded, time-limited wait queue"""
+
+    def __init__(self, name, concurrency, max_queue, max_wait):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """True once a slot is held; False if the queue is full or the wait ran out"""
+        with self._cond:
+            if self.active < self.concurrency:
+                self.active += 1
+                self._report()
+                return True
+            if self.waiting >= self.max_queue:
+                return False
+
+            self.waiting += 1
+            self._report()
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+                self._report()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._report()
+            self._cond.notify()
+
+    def _report(self):
+        metrics.set_gauge('wisest_admission_active', self.active, pool=self.name)
+        metrics.set_gauge('wisest_admission_queue_depth', self.waiting, pool=self.name)
+
+
+class TokenBuckets:
+    """Per-client token buckets; least recently seen clients are dropped past max_clients"""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client, cost=1):
+        """0 if `cost` tokens were taken, otherwise seconds until they are available
+
+        A cost above the burst size is charged as a full burst, so it can still succeed.
+        """
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+pools = {
+    'llm': Pool('llm', _env('LLM_CONCURRENCY', 8), _env('LLM_QUEUE', 8), _env('LLM_MAX_WAIT_S', 2.0)),
+    'compute': Pool('compute', _env('COMPUTE_CONCURRENCY', 4), _env('COMPUTE_QUEUE', 4), _env('COMPUTE_MAX_WAIT_S', 1.0)),
+    'tracking': Pool('tracking', _env('TRACKING_CONCURRENCY', 8), _env('TRACKING_QUEUE', 8), _env('TRACKING_MAX_WAIT_S', 0.5)),
+}
+
+# Threads for routes outside every pool (/health, /ready, /metrics, decisions, ...)
+UNPOOLED_THREADS = _env('UNPOOLED_THREADS', 4)
+# Worker threads needed so every pool can be full (running + queued) at the same time
+THREADS_NEEDED = sum(pool.concurrency + pool.max_queue for pool in pools.values()) + UNPOOLED_THREADS
+
+WORKERS = max(1, _env('WEB_CONCURRENCY', 1))
+
+# Provider quota protection: a client gets a burst of LLM calls, then a steady trickle.
+# LLM_RATE_PER_S / LLM_BURST are per client for the whole deployment; each worker enforces
+# its 1/WORKERS share. That adds up to the full quota only when a client's requests spread
+# over the workers; a keep-alive connection pins a client to one worker, which then gets just
+# its share. So the split can be stricter than configured, never looser
+rate_limits = {
+    'llm': TokenBuckets(rate=_env('LLM_RATE_PER_S', 0.2) / WORKERS, burst=max(1.0, _env('LLM_BURST', 6.0) / WORKERS)),
+}
+
+
+def admit(endpoint, client):
+    """Try to admit a request; returns (pool, None) on success or (None, (status, retry_after))"""
+    endpoint_class = ENDPOINT_CLASSES.get(endpoint)
+    if endpoint_class is None:
+        return None, None
+
+    buckets = rate_limits.get(endpoint_class)
+    if buckets is not None:
+        wait = buckets.take(client)
+        if wait > 0:
+            metrics.inc('wisest_admission_rejected_total', pool=endpoint_class, reason='rate_limited')
+            return None, (429, math.ceil(wait))
+
+    pool = pools[endpoint_class]
+    if not pool.acquire():
+        metrics.inc('wisest_admission_rejected_total', pool=endpoint_class, reason='saturated')
+        return None, (503, max(1, math.ceil(pool.max_wait)))
+    return pool, None
+
+
+def charge(endpoint, client, units):
+    """Charge a request that does `units` of work (e.g. one /chat/batch call answering many
+    questions) for the units beyond the one admit() already took; returns (status, retry_after)
+    or None
+
+    The whole request is capped at one burst, so a full batch from a fresh client always fits.
+    """
+    buckets = rate_limits.get(ENDPOINT_CLASSES.get(endpoint))
+    if buckets is None:
+        return None
+    cost = min(units, int(buckets.burst)) - 1
+    if cost <= 0:
+        return None
+    wait = buckets.take(client, cost)
+    if wait > 0:
+        metrics.inc('wisest_admission_rejected_total', pool=ENDPOINT_CLASSES[endpoint], reason='rate_limited')
+        return 429, math.ceil(wait)
+    return None
@@ -0,0 +1,232 @@
+"""
+Affirmly affirmation generation
+Personalized results are cached per (title, description, mood), and a background-refilled
+pool of generic affirmations per mood answers instantly when Gemini is slow or rate-limited
+"""
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import metrics
+from cache import TTLCache, canonical_key
+from prompts import Prompt
+from singleflight import Group
+
+AFFIRMATION_COUNT = 10
+
+# How long a request waits for the personalized set before serving the mood pool
+WAIT_SECONDS = float(os.environ.get('AFFIRMATIONS_WAIT_S', 4))
+
+POOL_TARGET = 40       # generic affirmations kept per mood
+POOL_LOW_WATER = 20    # refill when a pool drops below this
+MAX_POOLS = 16
+REFILL_INTERVAL = 60
+
+# Last resort when a pool is still empty and Gemini is unavailable
+STATIC_AFFIRMATIONS = [
+    "You don't have to have it all figured out today. Showing up is enough.",
+    "What you're feeling is valid, and it won't last forever.",
+    "Small steps still move you forward. Take the next one.",
+    "You've handled hard days before, and you'll handle this one too.",
+    "Be as patient with yourself as you would be with a good friend.",
+    "Rest is productive. Your worth isn't measured by your output.",
+    "You are allowed to change your mind and start again.",
+    "Progress is rarely a straight line, and that's okay.",
+    "Notice one good thing today, however small. It counts.",
+    "You are more resilient than this moment makes you feel.",
+]
+
+personal_cache = TTLCache('affirmations', maxsize=1024, ttl=24 * 3600)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='affirmations')
+_flight = Group('affirmations')
+_pools = {}
+_pools_lock = threading.Lock()
+_refill_wakeup = threading.Event()
+_refill_lock = threading.Lock()
+_refill_thread = None
+_generate = None
+
+
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', (text or '').strip().lower())
+
+
+def normalize_mood(mood):
+    mood = normalize_text(mood)
+    return mood if re.fullmatch(r'[a-z][a-z -]{0,23}', mood) else 'neutral'
+
+
+LIST_FORMAT = """Generate them in a list like this:
+1. [affirmation]
+2. [affirmation]
+...
+10. [affirmation]
+
+Do not generate anything else. Just the list of 10 affirmations in this exact format."""
+
+# Instructions are sent first and identically every time; only the entry itself varies
+PERSONAL_PROMPT = Prompt('affirmations', {'role': 'system', 'content': f"""You are an affirmation generator. Generate a list of 10 affirmations based on the user's journal entry.
+
+Based on the title and description, generate realistic but meaningful affirmations, encouraging yet realistic quotes or advice to uplift, motivate or help the individual who wrote this.
+Each response MUST be 1-3 sentences.
+These quotes or affirmations should be unique to the title and description and address the specific feelings and situation mentioned.
+
+{LIST_FORMAT}"""})
+
+POOL_PROMPT = Prompt('affirmations', {'role': 'system', 'content': f"""You are an affirmation generator. Generate a list of 10 affirmations for someone in the mood the user gives.
+
+They should be encouraging yet realistic, 1-3 sentences each, and fit anyone feeling this way.
+
+{LIST_FORMAT}"""})
+
+
+def build_prompt(title, description, mood):
+    # A long description is cut to the budget before the title or mood are
+    return PERSONAL_PROMPT.render('Title: "{title}"\nMood: {mood}\nDescription: "{description}"',
+                                  fit='description', title=title, mood=mood, description=description)
+
+
+def build_pool_prompt(mood):
+    return POOL_PROMPT.render('Current mood: {mood}', mood=mood)
+
+
+def parse_affirmations(text):
+    """Parse a numbered list from the model into at most 10 affirmations"""
+    affirmations_text = (text or '').strip()
+    affirmations = []
+
+    for line in affirmations_text.split('\n'):
+        line = line.strip()
+        if line and not line[0].isdigit():  # Skip numbered lines, get actual content
+            affirmations.append(line)
+        elif line and line[0].isdigit():
+            # Extract affirmation after number
+            parts = line.split('.', 1)
+            if len(parts) > 1:
+                affirmation = parts[1].strip()
+                if affirmation:
+                    affirmations.append(affirmation)
+
+    # Ensure we have 10 affirmations
+    if len(affirmations) > AFFIRMATION_COUNT:
+        affirmations = affirmations[:AFFIRMATION_COUNT]
+    elif len(affirmations) < AFFIRMATION_COUNT:
+        # If parsing didn't work perfectly, return raw lines
+        affirmations = [line.strip() for line in affirmations_text.split('\n') if line.strip()][:AFFIRMATION_COUNT]
+    return affirmations
+
+
+def _pool(mood):
+    with _pools_lock:
+        pool = _pools.get(mood)
+        if pool is None:
+            if len(_pools) >= MAX_POOLS:
+                mood = 'neutral'
+                pool = _pools.setdefault(mood, deque(maxlen=POOL_TARGET * 2))
+            else:
+                pool = _pools[mood] = deque(maxlen=POOL_TARGET * 2)
+        return pool
+
+
+def _refill_once():
+    with _pools_lock:
+        moods = [mood for mood, pool in _pools.items() if len(pool) < POOL_LOW_WATER]
+    for mood in moods:
+        pool = _pool(mood)
+        # Bounded attempts so a model that keeps repeating itself can't loop forever
+        for _ in range(POOL_TARGET // AFFIRMATION_COUNT + 2):
+            if len(pool) >= POOL_TARGET:
+                break
+            with metrics.timed('wisest_stage_seconds', stage='affirmation_pool_refill'):
+                batch = parse_affirmations(_generate(build_pool_prompt(mood)))
+            seen = set(pool)
+            pool.extend(a for a in batch if a not in seen)
+        metrics.set_gauge('wisest_affirmation_pool_size', len(pool), mood=mood)
+
+
+def _refill_loop():
+    backoff = REFILL_INTERVAL
+    while True:
+        _refill_wakeup.wait(backoff)
+        _refill_wakeup.clear()
+        try:
+            _refill_once()
+            backoff = REFILL_INTERVAL
+        except Exception as e:
+            # Usually a rate limit - back off instead of hammering Gemini
+            print(f"[WARN] Affirmation pool refill failed: {e}")
+            backoff = min(backoff * 2, 15 * 60)
+
+
+def set_generator(generate):
+    """Register the text generator; the pool refill starts on the first affirmations request"""
+    global _generate
+    _generate = generate
+
+
+def _wake_refill():
+    """Ask for a pool refill, starting the refill thread if this worker hasn't yet
+
+    Started lazily so only workers that actually serve affirmations spend Gemini quota on pools.
+    """
+    global _refill_thread
+    if _refill_thread is None:
+        with _refill_lock:
+            if _refill_thread is None:
+                _pool('neutral')
+                _refill_thread = threading.Thread(target=_refill_loop, name='affirmation-refill', daemon=True)
+                _refill_thread.start()
+    _refill_wakeup.set()
+
+
+def _from_pool(mood):
+    pool = list(dict.fromkeys(_pool(mood)))
+    if len(pool) < AFFIRMATION_COUNT:
+        pool += [a for a in STATIC_AFFIRMATIONS if a not in pool]
+    _wake_refill()
+    return random.sample(pool, AFFIRMATION_COUNT)
+
+
+def _generate_personal(key, title, description, mood):
+    with metrics.timed('wisest_stage_seconds', stage='affirmation_generate'):
+        affirmations = parse_affirmations(_generate(build_prompt(title, description, mood)))
+    if affirmations:
+        personal_cache.set(key, affirmations)
+    return affirmations
+
+
+def get_affirmations(title, description, mood, deadline=None):
+    """Return (affirmations, source) where source is 'cache', 'personalized' or 'pool'
+
+    The personalized set keeps generating in the background after a pool answer,
+    so the same entry is served from cache next time.
+    """
+    key = canonical_key(normalize_text(title), normalize_text(description), normalize_mood(mood))
+    if _refill_thread is None or len(_pool(normalize_mood(mood))) < POOL_LOW_WATER:
+        _wake_refill()
+
+    cached = personal_cache.get(key)
+    if cached is not None:
+        return cached, 'cache'
+
+    start_time = time.perf_counter()
+    future = _flight.submit(key, lambda: _generate_personal(key, title, description, mood), _executor)
+    try:
+        wait = WAIT_SECONDS if deadline is None else min(WAIT_SECONDS, deadline.remaining())
+        affirmations = future.result(timeout=wait)
+        if affirmations:
+            return affirmations, 'personalized'
+    except FutureTimeout:
+        metrics.inc('wisest_affirmation_fallbacks_total', reason='timeout')
+    except Exception as e:
+        print(f"Error generating affirmations: {str(e)}")
+        metrics.inc('wisest_affirmation_fallbacks_total', reason='error')
+
+    affirmations = _from_pool(normalize_mood(mood))
+    metrics.observe('wisest_stage_seconds', time.perf_counter() - start_time, stage='affirmation_pool_serve')
+    return affirmations, 'pool'
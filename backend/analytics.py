@@ -0,0 +1,293 @@
+"""
+Incremental hourly and daily rollups of the analytics tables
+Reads only the `logs` and `chat_logs` rows added since a stored watermark and folds them into
+SQLite rollups: visit counts per page, device and location, chat volume and no-result rate,
+and response_time_ms percentiles from mergeable sketches. Each page of rows and its watermark
+commit together, so a crash never double-counts or skips rows. Rows are only read once they
+are a little old, so one committed late (after a row with a higher id) isn't skipped either.
+
+To run (e.g. every 5 minutes from cron):
+    python3 analytics.py              # roll up new rows
+    python3 analytics.py --report day --last 7
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_PATH = os.environ.get('ANALYTICS_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analytics.db'))
+PAGE_SIZE = 1000
+# Visit rows keep getting page/duration updates for a while (see visit_buffer.py), so they're
+# only rolled up once they've settled
+LOGS_SETTLE_SECONDS = int(os.environ.get('ANALYTICS_LOGS_SETTLE_S', 30 * 60))
+# Ids are handed out before commit, so a row can become visible after one with a higher id.
+# Chat rows aren't updated, but still wait a little so the watermark doesn't skip past one
+CHAT_LOGS_SETTLE_SECONDS = int(os.environ.get('ANALYTICS_CHAT_LOGS_SETTLE_S', 60))
+VISIT_DIMENSIONS = ('page', 'device', 'location')
+GRANULARITIES = {'hour': '%Y-%m-%dT%H:00', 'day': '%Y-%m-%d'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS visit_rollups (
+    granularity TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (granularity, bucket, dimension, value)
+);
+CREATE TABLE IF NOT EXISTS chat_rollups (
+    granularity TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    queries INTEGER NOT NULL,
+    no_results INTEGER NOT NULL,
+    latency_sketch TEXT NOT NULL,
+    PRIMARY KEY (granularity, bucket)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    source TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+UPSERT_VISITS_SQL = """
+INSERT INTO visit_rollups (granularity, bucket, dimension, value, count) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (granularity, bucket, dimension, value) DO UPDATE SET count = count + excluded.count
+"""
+GET_CHAT_SQL = "SELECT queries, no_results, latency_sketch FROM chat_rollups WHERE granularity = ? AND bucket = ?"
+PUT_CHAT_SQL = "INSERT OR REPLACE INTO chat_rollups (granularity, bucket, queries, no_results, latency_sketch) VALUES (?, ?, ?, ?, ?)"
+GET_WATERMARK_SQL = "SELECT last_id FROM watermarks WHERE source = ?"
+PUT_WATERMARK_SQL = "INSERT OR REPLACE INTO watermarks (source, last_id, updated_at) VALUES (?, ?, ?)"
+
+
+class QuantileSketch:
+    """Log-bucketed histogram (DDSketch style) with bounded relative error
+
+    Any quantile is within `accuracy` of the true value, and two sketches merge exactly by
+    adding bucket counts, so hourly sketches add up to a correct daily one.
+    """
+
+    def __init__(self, accuracy=0.01, counts=None, zeros=0):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.counts = dict(counts or {})
+        self.zeros = zeros
+
+    @property
+    def count(self):
+        return self.zeros + sum(self.counts.values())
+
+    def add(self, value):
+        if value <= 0:
+            self.zeros += 1
+            return
+        key = math.ceil(math.log(value) / math.log(self.gamma))
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.zeros += other.zeros
+        return self
+
+    def quantile(self, q):
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.counts) / (self.gamma + 1)
+
+    def to_json(self):
+        return json.dumps({'accuracy': self.accuracy, 'zeros': self.zeros,
+                           'counts': {str(k): v for k, v in self.counts.items()}}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(data['accuracy'], {int(k): v for k, v in data['counts'].items()}, data['zeros'])
+
+
+def _parse_time(value):
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00').replace(' ', 'T', 1))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _buckets(created_at):
+    at = _parse_time(created_at).astimezone(timezone.utc)
+    return [(granularity, at.strftime(fmt)) for granularity, fmt in GRANULARITIES.items()]
+
+
+class RollupStore:
+    """Rollups and watermarks in SQLite; one connection per thread, like DecisionStore"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, cached_statements=64)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA busy_timeout=10000')
+            self._local.conn = conn
+        return conn
+
+    def watermark(self, source):
+        row = self._conn().execute(GET_WATERMARK_SQL, (source,)).fetchone()
+        return row[0] if row else 0
+
+    def apply_visits(self, rows):
+        """Fold a page of `logs` rows in and advance the watermark, atomically"""
+        counts = {}
+        for row in rows:
+            for granularity, bucket in _buckets(row['created_at']):
+                for dimension in VISIT_DIMENSIONS:
+                    key = (granularity, bucket, dimension, row.get(dimension) or 'unknown')
+                    counts[key] = counts.get(key, 0) + 1
+        with self._conn() as conn:
+            conn.executemany(UPSERT_VISITS_SQL, [key + (count,) for key, count in counts.items()])
+            self._advance(conn, 'logs', rows)
+
+    def apply_chats(self, rows):
+        """Fold a page of `chat_logs` rows in and advance the watermark, atomically"""
+        partial = {}
+        for row in rows:
+            for key in _buckets(row['created_at']):
+                entry = partial.setdefault(key, [0, 0, QuantileSketch()])
+                entry[0] += 1
+                if not row.get('found_results'):
+                    entry[1] += 1
+                if row.get('response_time_ms') is not None:
+                    entry[2].add(row['response_time_ms'])
+        with self._conn() as conn:
+            for (granularity, bucket), (queries, no_results, sketch) in partial.items():
+                existing = conn.execute(GET_CHAT_SQL, (granularity, bucket)).fetchone()
+                if existing:
+                    queries += existing[0]
+                    no_results += existing[1]
+                    sketch.merge(QuantileSketch.from_json(existing[2]))
+                conn.execute(PUT_CHAT_SQL, (granularity, bucket, queries, no_results, sketch.to_json()))
+            self._advance(conn, 'chat_logs', rows)
+
+    @staticmethod
+    def _advance(conn, source, rows):
+        conn.execute(PUT_WATERMARK_SQL, (source, max(row['id'] for row in rows), datetime.now().isoformat()))
+
+    def visits(self, granularity, since):
+        return self._conn().execute(
+            "SELECT bucket, dimension, value, count FROM visit_rollups WHERE granularity = ? AND bucket >= ? "
+            "ORDER BY bucket, dimension, count DESC", (granularity, since)).fetchall()
+
+    def chats(self, granularity, since):
+        rows = self._conn().execute(
+            "SELECT bucket, queries, no_results, latency_sketch FROM chat_rollups WHERE granularity = ? AND bucket >= ? "
+            "ORDER BY bucket", (granularity, since)).fetchall()
+        return [(bucket, queries, no_results, QuantileSketch.from_json(sketch)) for bucket, queries, no_results, sketch in rows]
+
+
+def fetch_new_rows(table, after_id, select, before=None):
+    """Rows of a Supabase table with id > after_id (optionally created before `before`), a page at a time"""
+    supabase_url = os.environ.get('SUPABASE_URL')
+    supabase_key = os.environ.get('SUPABASE_SERVICE_KEY')
+    params = {"select": select, "id": f"gt.{after_id}", "order": "id", "limit": PAGE_SIZE}
+    if before is not None:
+        params["created_at"] = f"lt.{before.isoformat()}"
+    response = requests.get(
+        f"{supabase_url}/rest/v1/{table}",
+        headers={"apikey": supabase_key, "Authorization": f"Bearer {supabase_key}"},
+        params=params,
+        timeout=30
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def roll_up(store=None):
+    """Process every row past each watermark; returns rows processed per table"""
+    store = store or RollupStore()
+    processed = {}
+    now = datetime.now(timezone.utc)
+    jobs = [
+        ('logs', 'id,created_at,page,device,location',
+         now - timedelta(seconds=LOGS_SETTLE_SECONDS), store.apply_visits),
+        ('chat_logs', 'id,created_at,found_results,response_time_ms',
+         now - timedelta(seconds=CHAT_LOGS_SETTLE_SECONDS), store.apply_chats),
+    ]
+    for table, select, before, apply in jobs:
+        processed[table] = 0
+        while True:
+            rows = fetch_new_rows(table, store.watermark(table), select, before)
+            if not rows:
+                break
+            apply(rows)
+            processed[table] += len(rows)
+            if len(rows) < PAGE_SIZE:
+                break
+    return processed
+
+
+def print_report(store, granularity, last):
+    start = datetime.now(timezone.utc) - (timedelta(days=last) if granularity == 'day' else timedelta(hours=last))
+    since = start.strftime(GRANULARITIES[granularity])
+
+    print(f"{'bucket':<17} {'chats':>6} {'no-result':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    total = None
+    for bucket, queries, no_results, sketch in store.chats(granularity, since):
+        p50, p95 = sketch.quantile(0.5), sketch.quantile(0.95)
+        print(f"{bucket:<17} {queries:>6} {no_results / queries:>9.1%} "
+              f"{p50 or 0:>8.0f} {p95 or 0:>8.0f}")
+        total = sketch if total is None else total.merge(sketch)
+    if total is not None and total.count:
+        print(f"{'all':<17} {'':>6} {'':>9} {total.quantile(0.5):>8.0f} {total.quantile(0.95):>8.0f}")
+
+    totals = {}
+    for _, dimension, value, count in store.visits(granularity, since):
+        totals.setdefault(dimension, {})
+        totals[dimension][value] = totals[dimension].get(value, 0) + count
+    for dimension in VISIT_DIMENSIONS:
+        top = sorted(totals.get(dimension, {}).items(), key=lambda item: -item[1])[:10]
+        print(f"\nTop {dimension}s: " + ', '.join(f"{value} ({count})" for value, count in top))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental analytics rollups")
+    parser.add_argument("--report", choices=sorted(GRANULARITIES), help="Print rollups instead of updating them")
+    parser.add_argument("--last", type=int, default=7, help="How many days/hours to report")
+    parser.add_argument("--loop", type=float, help="Keep rolling up every N seconds")
+    args = parser.parse_args()
+
+    store = RollupStore()
+    if args.report:
+        print_report(store, args.report, args.last)
+        return
+    while True:
+        start = time.perf_counter()
+        processed = roll_up(store)
+        print(f"✅ Rolled up {processed['logs']} visit rows and {processed['chat_logs']} chat rows "
+              f"in {time.perf_counter() - start:.1f}s")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
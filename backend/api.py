@@ -1,16 +1,35 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
+import time
 from dotenv import load_dotenv
 import google.generativeai as genai
 import json
 from datetime import datetime
-import requests as http_requests
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import metrics
+import providers
+import prompts
+import scoring
+import sensitivity
+from cache import TieredCache, canonical_key
+import affirmations as affirmations_service
+from singleflight import Group, normalize_query
+from deadline import Deadline
+import admission
+import prewarm
+import decision_history
+from decision_store import DecisionStore
+from visit_buffer import WriteBehindBuffer, supabase_update
 
 # Load environment variables from .env file (for local development)
 load_dotenv()
 
 app = Flask(__name__)
+# Render's proxy appends the caller's address to X-Forwarded-For; earlier entries come from the
+# client and can't be trusted, so only the hops our own proxies added are used
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get('TRUSTED_PROXY_HOPS', 1)))
 
 # CORS configuration for production and development
 allowed_origins = [
@@ -35,7 +54,13 @@ if not API_KEY:
     raise ValueError("GEMINI_API_KEY environment variable is required")
 
 genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel('gemini-2.5-flash')
+
+def generate_text(prompt, endpoint='affirmations', timeout=30):
+    # Gemini first, with Groq as hedge/failover (see providers.GENERATOR_CHAINS)
+    messages = prompt if isinstance(prompt, list) else [{'role': 'user', 'content': prompt}]
+    return providers.generate(endpoint, messages, timeout=timeout)
+
+affirmations_service.set_generator(generate_text)
 
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_SERVICE_KEY = os.environ.get('SUPABASE_SERVICE_KEY')
@@ -45,15 +70,57 @@ SUPABASE_HEADERS = {
     "Content-Type": "application/json"
 }
 
-# Simple in-memory storage for decisions (in production, use a database)
-decisions = {}
+# Latest duration/page per visit row, flushed to Supabase in the background
+visit_buffer = WriteBehindBuffer(supabase_update(SUPABASE_URL, SUPABASE_HEADERS))
+visit_buffer.start()
+
+# Saved decisions live in SQLite so they survive restarts and work across workers
+decision_store = DecisionStore()
+
+# Analytics writes that shouldn't hold up a response
+log_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='log')
+
+# Load the corpus and open provider connections in the background; /ready gates traffic on it
+def probe_decision_store():
+    decision_store.get('prewarm-probe')
+    return decision_store.path
+
+prewarm.start({'decisions': probe_decision_store})
+
+# Identical concurrent requests share one upstream call
+chat_flight = Group('chat')
+wisest_flight = Group('wisest')
+
+# Coaching instructions are identical for every decision, so they're compiled once and sent first
+WISEST_PROMPT = prompts.Prompt('wisest', {'role': 'system', 'content': """You are a supportive life coach helping someone make a decision. Be warm, direct, and encouraging.
+
+**YOUR RESPONSE (keep it SHORT - under 250 words):**
+
+**My Take:** [1-2 sentences on whether you agree with the top-scoring option or recommend something different]
+
+**Why [top-scoring option] works:** [2-3 bullet points, max 10 words each]
+
+**Watch out for:** [1 brief sentence on the main risk]
+
+**Your next move:** [1 specific action to take TODAY]
+
+**TONE:** Speak like a trusted friend giving advice over coffee. Be real, not corporate. Use "you" language. End with something encouraging."""})
+
+# Gemini feedback for decisions we've already seen (frontend re-requests on every view),
+# shared across replicas when CACHE_REDIS_URL is set
+feedback_cache = TieredCache(
+    'wisest_feedback',
+    maxsize=int(os.environ.get('WISEST_CACHE_SIZE', 512)),
+    ttl=int(os.environ.get('WISEST_CACHE_TTL', 6 * 3600)),
+)
 
 def get_location(ip):
     try:
         # Strip IPv6 localhost
         if ip in ('127.0.0.1', '::1', 'localhost'):
             return 'Local'
-        res = http_requests.get(f'http://ip-api.com/json/{ip}', timeout=3)
+        with metrics.upstream('ip-api', 'lookup'):
+            res = providers.sessions['ip-api'].get(f'http://ip-api.com/json/{ip}', timeout=3)
         data = res.json()
         if data.get('status') == 'success':
             return f"{data.get('city', '')}, {data.get('regionName', '')}, {data.get('country', '')}"
@@ -84,27 +151,26 @@ def get_device(user_agent):
     return f"{device_type} - {browser}"
 
 def get_client_ip():
-    forwarded = request.headers.get('X-Forwarded-For')
-    if forwarded:
-        return forwarded.split(',')[0].strip()
+    # ProxyFix has already replaced remote_addr with the address our proxy saw
     return request.remote_addr
 
-def log_entry(page, query_text=None, response_text=None):
+def _insert_log(ip, user_agent, page, query_text, response_text):
     try:
-        ip = get_client_ip()
-        res = http_requests.post(
-            f"{SUPABASE_URL}/rest/v1/logs",
-            headers={**SUPABASE_HEADERS, 'Prefer': 'return=representation'},
-            json={
-                'ip_address': ip,
-                'location': get_location(ip),
-                'device': get_device(request.headers.get('User-Agent')),
-                'page': page,
-                'query_text': query_text,
-                'response_text': response_text,
-            },
-            timeout=5
-        )
+        location = get_location(ip)
+        with metrics.upstream('supabase', 'log_insert'):
+            res = providers.sessions['supabase'].post(
+                f"{SUPABASE_URL}/rest/v1/logs",
+                headers={**SUPABASE_HEADERS, 'Prefer': 'return=representation'},
+                json={
+                    'ip_address': ip,
+                    'location': location,
+                    'device': get_device(user_agent),
+                    'page': page,
+                    'query_text': query_text,
+                    'response_text': response_text,
+                },
+                timeout=5
+            )
         rows = res.json()
         if isinstance(rows, list) and rows:
             return rows[0].get('id')
@@ -112,6 +178,55 @@ def log_entry(page, query_text=None, response_text=None):
         pass
     return None
 
+def log_entry(page, query_text=None, response_text=None, background=False):
+    """Log a request to Supabase; background=True keeps the insert off the request's deadline"""
+    args = (get_client_ip(), request.headers.get('User-Agent'), page, query_text, response_text)
+    if background:
+        log_executor.submit(_insert_log, *args)
+        return None
+    return _insert_log(*args)
+
+def endpoint_label():
+    # Use the route pattern so /delete-decision/<id> stays one series
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.endpoint_label = endpoint_label()
+    metrics.add_gauge('wisest_requests_in_flight', 1, endpoint=g.endpoint_label)
+
+@app.before_request
+def admit_request():
+    # CORS preflights are cheap and must never be shed
+    if request.method == 'OPTIONS':
+        return None
+    pool, rejection = admission.admit(g.endpoint_label, get_client_ip())
+    if rejection:
+        status, retry_after = rejection
+        message = 'Too many requests' if status == 429 else 'Server is busy'
+        return jsonify({'error': f'{message}, please retry shortly'}), status, {'Retry-After': str(retry_after)}
+    g.admission_pool = pool
+
+@app.after_request
+def record_request_latency(response):
+    if 'request_start' in g:
+        metrics.observe(
+            'wisest_request_seconds',
+            time.perf_counter() - g.request_start,
+            endpoint=g.endpoint_label,
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
+
+@app.teardown_request
+def finish_request(exc):
+    if g.get('admission_pool') is not None:
+        g.admission_pool.release()
+    if 'endpoint_label' in g:
+        metrics.add_gauge('wisest_requests_in_flight', -1, endpoint=g.endpoint_label)
+
 @app.route('/test', methods=['GET'])
 def test():
     return jsonify({'message': 'API is working!', 'project_number': PROJECT_NUMBER})
@@ -121,18 +236,10 @@ def save_decision():
     try:
         data = request.get_json()
         decision_data = json.loads(data.get('body', '{}'))
-        
-        # Generate a simple ID (in production, use UUID)
-        decision_id = str(len(decisions) + 1)
-        
-        # Store the decision with timestamp
-        decisions[decision_id] = {
-            'id': decision_id,
-            'data': decision_data,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        return jsonify({'message': 'Decision saved successfully', 'id': decision_id})
+
+        saved = decision_store.save(decision_data)
+
+        return jsonify({'message': 'Decision saved successfully', 'id': saved['id']})
     except Exception as e:
         print("Error saving decision:", str(e))
         return jsonify({'error': 'Failed to save decision'}), 500
@@ -140,8 +247,7 @@ def save_decision():
 @app.route('/delete-decision/<decision_id>', methods=['DELETE'])
 def delete_decision(decision_id):
     try:
-        if decision_id in decisions:
-            del decisions[decision_id]
+        if decision_store.delete(decision_id):
             return jsonify({'message': 'Decision deleted successfully'})
         else:
             return jsonify({'error': 'Decision not found'}), 404
@@ -149,6 +255,67 @@ def delete_decision(decision_id):
         print("Error deleting decision:", str(e))
         return jsonify({'error': 'Failed to delete decision'}), 500
 
+# Anonymous decisions have no owner, so there's no listing: the random id handed back by
+# /save-decision is what lets its caller read the decision back (signed-in users: /history)
+@app.route('/decisions/<decision_id>', methods=['GET'])
+def get_decision(decision_id):
+    decision = decision_store.get(decision_id)
+    if decision is None:
+        return jsonify({'error': 'Decision not found'}), 404
+    return jsonify(decision)
+
+# Signed-in users' saved decisions (Supabase): one round trip per page, save or delete
+def access_token():
+    header = request.headers.get('Authorization', '')
+    return header[len('Bearer '):].strip() if header.startswith('Bearer ') else None
+
+def history_call(fn, *args):
+    token = access_token()
+    if not token:
+        return jsonify({'error': 'Not signed in'}), 401
+    try:
+        return jsonify(fn(token, *args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except decision_history.HistoryError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        print("Error in decision history:", str(e))
+        return jsonify({'error': 'Decision history is unavailable'}), 502
+
+@app.route('/history', methods=['GET'])
+def decision_history_page():
+    return history_call(decision_history.load, request.args.get('limit', 20), request.args.get('cursor'))
+
+@app.route('/history', methods=['POST'])
+def save_decision_history():
+    def save(token, data):
+        return {'id': decision_history.save(token, decision_history.decision_graph(data))}
+    return history_call(save, request.get_json(silent=True) or {})
+
+@app.route('/history/<decision_id>', methods=['DELETE'])
+def delete_decision_history(decision_id):
+    def delete(token, decision_id):
+        if not decision_history.delete(token, decision_id):
+            raise decision_history.HistoryError('Decision not found', 404)
+        return {'message': 'Decision deleted successfully'}
+    return history_call(delete, decision_id)
+
+def degraded_feedback(best_decision, scores, robustness_summary=""):
+    """Feedback built from the scores alone, used when Gemini can't answer in time"""
+    ranked = sorted(scores, key=lambda sd: sd.get('score', 0), reverse=True)
+    runner_up = ranked[1]['option'] if len(ranked) > 1 else None
+    take = f"Based on your priorities, {best_decision} comes out on top"
+    if runner_up:
+        gap = ranked[0].get('score', 0) - ranked[1].get('score', 0)
+        take += f", ahead of {runner_up} by {gap:.1f} points"
+    lines = [f"**My Take:** {take}."]
+    if robustness_summary:
+        lines.append(f"**How solid is it:** {robustness_summary}")
+    lines.append("**Your next move:** Look at the category that separates your top two options and ask if you weighted it the way you really feel.")
+    lines.append("(The oracle is busy right now, so this one comes straight from your numbers.)")
+    return '\n\n'.join(lines)
+
 @app.route('/wisest', methods=['POST'])
 def wisestfeedback():
     data = request.get_json()
@@ -159,6 +326,39 @@ def wisestfeedback():
     best_decision = data.get("best_decision", "")
     main_consideration = data.get("main_Consideration", "")
     choice_consideration = data.get("choice_Considerations", [])
+    deadline = Deadline.for_endpoint('wisest')
+
+    # Same decision -> same feedback; "fresh" forces a new generation
+    fresh = bool(data.get("fresh")) or request.args.get("fresh") in ('1', 'true')
+    cache_key = canonical_key(
+        options,
+        [[c.get('title'), c.get('metrics'), c.get('importance')] for c in categories if isinstance(c, dict)],
+        data.get("metric_types"),
+        [[sd.get('option'), round(float(sd.get('score', 0)), 2)] for sd in scores if isinstance(sd, dict)],
+        best_decision,
+        main_consideration,
+        choice_consideration,
+    )
+    if not fresh:
+        cached = feedback_cache.get(cache_key)
+        if cached is not None:
+            log_entry('/wisest', query_text=f"{main_consideration} | Options: {', '.join(options)}", response_text=cached, background=True)
+            return jsonify({'feedback': cached, 'cached': True})
+
+    # Score server-side when the client sends metric types instead of trusting its math
+    robustness = ""
+    robustness_summary = ""
+    if data.get("metric_types") is not None:
+        try:
+            scored = scoring.score_decision(data)
+            # Fixed seed keeps the prompt identical for identical decisions
+            analysis = sensitivity.analyze(data, samples=2000, seed=0)
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({'error': f'Invalid decision: {e}'}), 400
+        scores = scored['scores']
+        best_decision = scored['best_decision']
+        robustness_summary = sensitivity.summary_for_prompt(analysis)
+        robustness = f"\n**HOW SOLID IS IT:** {robustness_summary}\n"
 
     # Format scores for analysis
     score_analysis = ""
@@ -166,43 +366,81 @@ def wisestfeedback():
         score_analysis += f"{score_data['option']}: {score_data['score']:.1f}, "
     score_analysis = score_analysis.rstrip(", ")
 
-    prompt = f'''
-You are a supportive life coach helping someone make a decision. Be warm, direct, and encouraging.
-
-**THE DECISION:**
-Options: {', '.join(options)}
-Goal: {main_consideration}
-Their thoughts: {choice_consideration}
-
-**DATA SAYS:** {best_decision} scored highest ({score_analysis})
-
-**YOUR RESPONSE (keep it SHORT - under 250 words):**
-
-**My Take:** [1-2 sentences on whether you agree with {best_decision} or recommend something different]
-
-**Why {best_decision} works:** [2-3 bullet points, max 10 words each]
-
-**Watch out for:** [1 brief sentence on the main risk]
-
-**Your next move:** [1 specific action to take TODAY]
-
-**TONE:** Speak like a trusted friend giving advice over coffee. Be real, not corporate. Use "you" language. End with something encouraging.
-'''
+    prompt = WISEST_PROMPT.render(
+        "**THE DECISION:**\nOptions: {options}\nGoal: {goal}\n\n"
+        "**DATA SAYS:** {best} scored highest ({scores})\n{robustness}\n"
+        "Their thoughts: {thoughts}",
+        fit='thoughts',
+        options=', '.join(options),
+        goal=main_consideration,
+        best=best_decision,
+        scores=score_analysis,
+        robustness=robustness,
+        thoughts=str(choice_consideration),
+    )
 
     try:
-        response = model.generate_content(prompt)
-        if response and response.text:
-            feedback = response.text
-            print("Generated feedback:", feedback)
-            log_entry('/wisest', query_text=f"{main_consideration} | Options: {', '.join(options)}", response_text=feedback)
-            return jsonify({'feedback': feedback})
-        else:
-            print("Failed to generate feedback")
-            return jsonify({'error': 'Failed to generate feedback'}), 500
+        feedback = wisest_flight.do(
+            cache_key,
+            lambda: generate_text(prompt, endpoint='wisest', timeout=deadline.timeout(reserve=0.1)),
+            timeout=deadline.remaining() + 1,
+        )
+    except (TimeoutError, FutureTimeout, providers.ProviderUnavailable) as e:
+        # Out of budget or no generator available: answer from the numbers alone
+        print("Degraded feedback:", type(e).__name__, str(e))
+        metrics.inc('wisest_degraded_responses_total', endpoint='/wisest', reason=type(e).__name__)
+        return jsonify({'feedback': degraded_feedback(best_decision, scores, robustness_summary), 'degraded': True})
     except Exception as e:
         print("Error:", str(e))
         return jsonify({'error': str(e)}), 500
 
+    if feedback:
+        print("Generated feedback:", feedback)
+        feedback_cache.set(cache_key, feedback)
+        log_entry('/wisest', query_text=f"{main_consideration} | Options: {', '.join(options)}", response_text=feedback, background=True)
+        return jsonify({'feedback': feedback})
+    else:
+        print("Failed to generate feedback")
+        return jsonify({'error': 'Failed to generate feedback'}), 500
+
+# Batch decision scoring - accepts one decision or {"decisions": [...]}
+@app.route('/score', methods=['POST'])
+def score():
+    data = request.get_json() or {}
+    batch = data.get('decisions')
+    if batch is None:
+        try:
+            return jsonify(scoring.score_decision(data))
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({'error': str(e)}), 400
+
+    if not isinstance(batch, list) or not batch:
+        return jsonify({'error': 'decisions must be a non-empty list'}), 400
+    if len(batch) > scoring.MAX_DECISIONS_PER_REQUEST:
+        return jsonify({'error': f'At most {scoring.MAX_DECISIONS_PER_REQUEST} decisions per request'}), 400
+
+    with metrics.timed('wisest_stage_seconds', stage='score_batch'):
+        results = scoring.score_batch(batch)
+    return jsonify({'results': results})
+
+# Monte Carlo sensitivity analysis - how fragile is the winning option?
+@app.route('/sensitivity', methods=['POST'])
+def sensitivity_analysis():
+    data = request.get_json() or {}
+    try:
+        with metrics.timed('wisest_stage_seconds', stage='sensitivity'):
+            result = sensitivity.analyze(
+                data,
+                samples=data.get('samples', sensitivity.DEFAULT_SAMPLES),
+                weight_noise=float(data.get('weight_noise', sensitivity.DEFAULT_WEIGHT_NOISE)),
+                metric_noise=float(data.get('metric_noise', sensitivity.DEFAULT_METRIC_NOISE)),
+                seed=data.get('seed'),
+            )
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'error': str(e)}), 400
+    result['summary'] = sensitivity.summary_for_prompt(result)
+    return jsonify(result)
+
 # Affirmly - Generate affirmations endpoint
 @app.route('/affirmations', methods=['POST'])
 def generate_affirmations():
@@ -218,66 +456,40 @@ def generate_affirmations():
         if not title or not description:
             return jsonify({'error': 'Title and description are required'}), 400
 
-        prompt = f'''
-You are an affirmation generator. Generate a list of 10 affirmations based on the following journal entry.
-
-Title: "{title}"
-Description: "{description}"
-Mood: {mood}
-
-Based on the title and description, generate realistic but meaningful affirmations, encouraging yet realistic quotes or advice to uplift, motivate or help the individual who wrote this.
-Each response MUST be 1-3 sentences.
-These quotes or affirmations should be unique to the title and description and address the specific feelings and situation mentioned.
-
-Now generate 10 unique affirmations, quotes, or advice in a list like this:
-1. [affirmation]
-2. [affirmation]
-...
-10. [affirmation]
-
-Do not generate anything else. Just the list of 10 affirmations in this exact format.
-'''
-
-        response = model.generate_content(prompt)
-
-        if not response or not response.text:
+        deadline = Deadline.for_endpoint('affirmations')
+        affirmations, source = affirmations_service.get_affirmations(title, description, mood, deadline)
+        if not affirmations:
             return jsonify({'error': 'Failed to generate affirmations'}), 500
 
-        # Parse the response into a list of affirmations
-        affirmations_text = response.text.strip()
-        affirmations = []
-
-        for line in affirmations_text.split('\n'):
-            line = line.strip()
-            if line and not line[0].isdigit():  # Skip numbered lines, get actual content
-                affirmations.append(line)
-            elif line and line[0].isdigit():
-                # Extract affirmation after number
-                parts = line.split('.', 1)
-                if len(parts) > 1:
-                    affirmation = parts[1].strip()
-                    if affirmation:
-                        affirmations.append(affirmation)
-
-        # Ensure we have 10 affirmations
-        if len(affirmations) > 10:
-            affirmations = affirmations[:10]
-        elif len(affirmations) < 10:
-            # If parsing didn't work perfectly, return raw lines
-            affirmations = [line.strip() for line in affirmations_text.split('\n') if line.strip()][:10]
-
-        log_entry('/affirmations', query_text=f"{title}: {description}", response_text='\n'.join(affirmations))
-        return jsonify(affirmations), 200
+        log_entry('/affirmations', query_text=f"{title}: {description}", response_text='\n'.join(affirmations), background=True)
+        return jsonify(affirmations), 200, {'X-Affirmations-Source': source}
 
     except Exception as e:
         print(f"Error generating affirmations: {str(e)}")
         return jsonify({'error': f'Failed to generate affirmations: {str(e)}'}), 500
 
+def select_corpus(data):
+    # Explicit corpus in the body or query string, otherwise whichever one this site uses
+    from RAG.corpus import corpus_for_origin
+    return data.get('corpus') or request.args.get('corpus') or corpus_for_origin(request.headers.get('Origin'))
+
+def select_sources(data):
+    """Optional retrieval filter: a source path/name or a list of them; ValueError if malformed"""
+    sources = data.get('sources', data.get('source'))
+    if sources is None:
+        return None
+    if isinstance(sources, str):
+        sources = [sources]
+    if not isinstance(sources, list) or not all(isinstance(s, str) and s.strip() for s in sources):
+        raise ValueError('sources must be a string or a list of strings')
+    return sorted({s.strip() for s in sources}) or None
+
 # RAG Chat endpoint for ShirleyProject
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
         from RAG import query_rag
+        from RAG.corpus import CORPORA
 
         data = request.get_json()
         message = data.get('message', '')
@@ -285,8 +497,28 @@ def chat():
         if not message:
             return jsonify({'error': 'Message is required'}), 400
 
-        response = query_rag(message)
-        log_entry('/chat', query_text=message, response_text=response)
+        corpus_name = select_corpus(data)
+        if corpus_name not in CORPORA:
+            return jsonify({'error': f'Unknown corpus: {corpus_name}'}), 400
+        try:
+            sources = select_sources(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        deadline = Deadline.for_endpoint('chat')
+        try:
+            # Followers wait on the leader's result, but never past their own budget
+            response = chat_flight.do(
+                (corpus_name, tuple(sources or ()), normalize_query(message)),
+                lambda: query_rag(message, deadline, corpus_name, sources),
+                timeout=deadline.remaining() + 1,
+            )
+        except (TimeoutError, FutureTimeout):
+            # FutureTimeout: a coalesced wait ran out; TimeoutError (incl. DeadlineExceeded): our
+            # own budget ran out (on 3.9 the two aren't the same class)
+            metrics.inc('wisest_degraded_responses_total', endpoint='/chat', reason='coalesced_timeout')
+            response = "I'm taking longer than usual to think about that. Please try again in a moment!"
+        log_entry('/chat', query_text=message, response_text=response, background=True)
         return jsonify({'answer': response})
     except Exception as e:
         import traceback
@@ -301,6 +533,47 @@ def chat():
             'answer': "I'm having trouble accessing my knowledge base right now. Please try again later!"
         }), 500
 
+MAX_BATCH_QUESTIONS = 10
+
+# Several questions in one call (e.g. prefetching suggested questions): one embedding request,
+# one retrieval pass, generations in parallel, and an answer or error per question
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    try:
+        from RAG import query_rag_batch
+        from RAG.corpus import CORPORA
+
+        data = request.get_json() or {}
+        questions = data.get('questions')
+        if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+            return jsonify({'error': 'questions must be a non-empty list of strings'}), 400
+        if len(questions) > MAX_BATCH_QUESTIONS:
+            return jsonify({'error': f'At most {MAX_BATCH_QUESTIONS} questions per batch'}), 400
+
+        corpus_name = select_corpus(data)
+        if corpus_name not in CORPORA:
+            return jsonify({'error': f'Unknown corpus: {corpus_name}'}), 400
+        try:
+            sources = select_sources(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Each distinct question costs a rate-limit token, up to one burst per batch (repeats are
+        # answered once, see query_rag_batch)
+        distinct = len({normalize_query(question) for question in questions})
+        rejection = admission.charge('/chat/batch', get_client_ip(), distinct)
+        if rejection:
+            status, retry_after = rejection
+            return jsonify({'error': 'Too many requests, please retry shortly'}), status, {'Retry-After': str(retry_after)}
+
+        results = query_rag_batch(questions, Deadline.for_endpoint('chat'), corpus_name, sources)
+        for result in results:
+            log_entry('/chat', query_text=result['question'], response_text=result.get('answer') or result.get('error'), background=True)
+        return jsonify({'results': results})
+    except Exception as e:
+        print(f"Error in chat batch endpoint: {e}")
+        return jsonify({'error': "I'm having trouble accessing my knowledge base right now. Please try again later!"}), 500
+
 @app.route('/track-visit', methods=['POST'])
 def track_visit():
     try:
@@ -318,20 +591,23 @@ def update_visit():
         row_id = data.get('id')
         duration = data.get('duration')
         page = data.get('page')
-        if not row_id:
-            return jsonify({'ok': False}), 400
+        # logs ids are integers; anything else would only fail later in the bulk flush
+        if isinstance(row_id, str) and row_id.strip().isdigit():
+            row_id = int(row_id)
+        if not isinstance(row_id, int) or isinstance(row_id, bool) or row_id <= 0:
+            return jsonify({'ok': False, 'error': 'id must be a positive integer'}), 400
+        if duration is not None and (not isinstance(duration, (int, float)) or isinstance(duration, bool)):
+            return jsonify({'ok': False, 'error': 'duration must be a number'}), 400
+        if page is not None and not isinstance(page, str):
+            return jsonify({'ok': False, 'error': 'page must be a string'}), 400
         payload = {}
         if duration is not None:
             payload['duration'] = duration
         if page:
             payload['page'] = page
         if payload:
-            http_requests.patch(
-                f"{SUPABASE_URL}/rest/v1/logs?id=eq.{row_id}",
-                headers=SUPABASE_HEADERS,
-                json=payload,
-                timeout=5
-            )
+            # Heartbeats are merged in memory and flushed in bulk (see visit_buffer.py)
+            visit_buffer.put(row_id, payload)
         return jsonify({'ok': True})
     except Exception as e:
         print(f"Update visit error: {e}")
@@ -342,47 +618,29 @@ def update_visit():
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'Backend is running!'})
 
-# Warmup endpoint to prevent cold starts on Supabase
+# Readiness probe: 503 until this worker has loaded the corpus (see prewarm.py)
+@app.route('/ready', methods=['GET'])
+def ready():
+    is_ready, components = prewarm.status()
+    body = {'status': 'ready' if is_ready else 'starting', 'components': components,
+            'timestamp': datetime.now().isoformat()}
+    return jsonify(body), 200 if is_ready else 503
+
+# Keep-alive ping for existing uptime monitors; always 200 (workers warm themselves at boot,
+# and readiness for routing is /ready's job)
 @app.route('/warmup', methods=['GET'])
 def warmup():
-    """
-    Lightweight endpoint to keep the RAG system warm.
-    Initializes the Supabase connection without making expensive API calls.
-    Call this every 5-10 minutes via UptimeRobot to prevent cold starts.
-    """
-    try:
-        from RAG.RAG import initialize_chroma
-        import time
-
-        start_time = time.time()
-
-        # Initialize Supabase connection (this is what takes time on cold start)
-        db = initialize_chroma()
-
-        # Quick validation that the connection works
-        db.table('documents').select('id').limit(1).execute()
-
-        elapsed_ms = int((time.time() - start_time) * 1000)
-
-        return jsonify({
-            'status': 'warm',
-            'message': 'RAG system initialized successfully',
-            'response_time_ms': elapsed_ms,
-            'timestamp': datetime.now().isoformat()
-        })
-    except Exception as e:
-        import traceback
-        print("=" * 60)
-        print("ERROR in warmup endpoint:")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error message: {str(e)}")
-        print("Traceback:")
-        traceback.print_exc()
-        print("=" * 60)
-        return jsonify({
-            'status': 'error',
-            'message': str(e)
-        }), 500
+    is_ready, _ = prewarm.status()
+    return jsonify({
+        'status': 'warm' if is_ready else 'warming',
+        'message': 'RAG system initialized successfully' if is_ready else 'RAG system is still loading',
+        'timestamp': datetime.now().isoformat()
+    })
+
+# Prometheus scrape endpoint for per-stage latency
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     print(f"Starting Flask app with project number: {PROJECT_NUMBER}")
@@ -0,0 +1,295 @@
+"""
+Bounded in-process caches with TTL expiry and LRU eviction, optionally backed by a shared
+tier on any Redis-protocol server (CACHE_REDIS_URL) so replicas warm each other
+"""
+import hashlib
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import numpy as np
+
+import metrics
+
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+# Bump to orphan every shared entry after a serialization change
+CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'wisest:v1')
+SHARED_TIMEOUT = float(os.environ.get('CACHE_REDIS_TIMEOUT_S', 0.1))
+# After a shared-tier error, stay local-only this long instead of paying the timeout per call
+SHARED_RETRY_SECONDS = 30
+LOCK_TTL_MS = 30000
+LOCK_POLL_SECONDS = 0.05
+
+
+def canonical_key(*parts):
+    """Stable hash of JSON-serializable parts; dict key order and whitespace don't matter"""
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, name, maxsize=512, ttl=3600):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._data[key]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        metrics.record_cache(self.name, entry is not None)
+        return entry[1] if entry is not None else None
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            size = len(self._data)
+        metrics.set_gauge('wisest_cache_entries', size, cache=self.name)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        metrics.set_gauge('wisest_cache_entries', 0, cache=self.name)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RespError(Exception):
+    pass
+
+
+class RespClient:
+    """Just enough of the Redis protocol (RESP2) for GET / SET / DEL, with a small socket pool"""
+
+    def __init__(self, url, timeout=SHARED_TIMEOUT, pool_size=8):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or 'localhost', parsed.port or 6379)
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile('rb'))
+        if self.password:
+            self._call(conn, 'AUTH', self.password)
+        if self.db:
+            self._call(conn, 'SELECT', self.db)
+        return conn
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    def _read(self, rfile):
+        line = rfile.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('connection closed by cache server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RespError(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            if size < 0:
+                return None
+            data = rfile.read(size + 2)
+            if len(data) != size + 2:
+                raise ConnectionError('connection closed by cache server')
+            return data[:-2]
+        if kind == b'*':
+            size = int(rest)
+            return None if size < 0 else [self._read(rfile) for _ in range(size)]
+        raise RespError(f'unexpected reply {line!r}')
+
+    def _call(self, conn, *args):
+        conn[0].sendall(self._encode(args))
+        return self._read(conn[1])
+
+    def execute(self, *args):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            reply = self._call(conn, *args)
+        except RespError:
+            self._release(conn)
+            raise
+        except Exception:
+            conn[0].close()
+            raise
+        self._release(conn)
+        return reply
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn[0].close()
+
+
+def encode_value(value):
+    """Tagged bytes; float vectors (embeddings) go as raw float32, 4 bytes per dimension"""
+    if isinstance(value, str):
+        return b's' + value.encode('utf-8')
+    if isinstance(value, np.ndarray) or (isinstance(value, list) and value and all(isinstance(x, float) for x in value)):
+        return b'f' + np.asarray(value, dtype='<f4').tobytes()
+    return b'j' + json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def decode_value(data):
+    kind, body = data[:1], data[1:]
+    if kind == b's':
+        return body.decode('utf-8')
+    if kind == b'f':
+        return np.frombuffer(body, dtype='<f4').tolist()
+    return json.loads(body)
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+# Shared-tier writes never hold up a response
+_write_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-write')
+
+
+def shared_client():
+    """The process-wide RESP client, or None when no shared tier is configured"""
+    global _shared_client
+    if CACHE_REDIS_URL and _shared_client is None:
+        with _shared_lock:
+            if _shared_client is None:
+                _shared_client = RespClient(CACHE_REDIS_URL)
+    return _shared_client
+
+
+class TieredCache(TTLCache):
+    """TTLCache in front of the shared tier: local hits stay in-process, local misses check the
+    shared tier, and writes go to both. Without CACHE_REDIS_URL it is just a TTLCache.
+
+    Tuple keys become readable namespaces, e.g. (corpus, version, query) is stored under
+    `wisest:v1:chat_answers:default:<version>:<hash of query>`, so a new corpus version never
+    reads the previous version's entries.
+    """
+
+    def __init__(self, name, maxsize=512, ttl=3600, client=None):
+        super().__init__(name, maxsize=maxsize, ttl=ttl)
+        self.client = client if client is not None else shared_client()
+        self._down_until = 0.0
+        self._locks = {}
+
+    def shared_key(self, key):
+        parts = list(key) if isinstance(key, tuple) else [key]
+        digest = hashlib.sha256(str(parts[-1]).encode('utf-8')).hexdigest()[:32]
+        return ':'.join([CACHE_PREFIX, self.name] + [str(p) for p in parts[:-1]] + [digest])
+
+    def _shared(self, *args):
+        """One command against the shared tier; None (and a back-off) when it's unavailable"""
+        if self.client is None or time.monotonic() < self._down_until:
+            return None
+        try:
+            with metrics.upstream('cache', args[0].lower()):
+                return self.client.execute(*args)
+        except (OSError, RespError) as e:
+            self._down_until = time.monotonic() + SHARED_RETRY_SECONDS
+            metrics.inc('wisest_shared_cache_errors_total', cache=self.name)
+            print(f"[WARN] Shared cache unavailable, using local only for {SHARED_RETRY_SECONDS}s: {e}")
+            return None
+
+    def _get_shared(self, key):
+        data = self._shared('GET', self.shared_key(key))
+        metrics.record_cache(f'{self.name}_shared', data is not None)
+        if data is None:
+            return None
+        try:
+            return decode_value(data)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def get(self, key, wait=0):
+        """Local tier, then shared tier. With `wait`, a miss takes a cross-replica fill lock:
+        if another replica holds it, poll for its result for up to `wait` seconds; if we get
+        it, the caller computes and set() or release() hands the key back.
+        """
+        value = super().get(key)
+        if value is not None or self.client is None:
+            return value
+        value = self._get_shared(key)
+        if value is not None:
+            super().set(key, value)
+            return value
+        if not wait:
+            return None
+
+        token = uuid.uuid4().hex
+        if self._shared('SET', self.shared_key(key) + ':lock', token, 'NX', 'PX', LOCK_TTL_MS) is not None:
+            self._locks[key] = token
+            return None
+        if time.monotonic() < self._down_until:
+            return None
+        metrics.inc('wisest_cache_stampede_waits_total', cache=self.name)
+        stop = time.monotonic() + wait
+        while time.monotonic() < stop:
+            time.sleep(LOCK_POLL_SECONDS)
+            value = self._get_shared(key)
+            if value is not None:
+                super().set(key, value)
+                return value
+            if time.monotonic() < self._down_until:
+                break
+        return None
+
+    def set(self, key, value, ttl=None, shared=True):
+        super().set(key, value, ttl=ttl)
+        if self.client is not None and shared:
+            ttl_ms = int((self.ttl if ttl is None else ttl) * 1000)
+            _write_executor.submit(self._write, key, encode_value(value), ttl_ms, self._locks.pop(key, None) is not None)
+
+    def _write(self, key, data, ttl_ms, unlock):
+        # The value lands before the lock goes, so waiters never see neither
+        self._shared('SET', self.shared_key(key), data, 'PX', ttl_ms)
+        if unlock:
+            self._shared('DEL', self.shared_key(key) + ':lock')
+
+    def release(self, key):
+        """Give up a fill lock taken by get(wait=...) without storing anything"""
+        # Only deletes a lock this process took; if it expired and another replica re-took it
+        # in between, deleting theirs just lets one more caller compute
+        if self._locks.pop(key, None) is not None:
+            _write_executor.submit(self._shared, 'DEL', self.shared_key(key) + ':lock')
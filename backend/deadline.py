@@ -0,0 +1,49 @@
+"""
+Per-request deadline budgets
+An endpoint sets one budget and every stage below it only gets the time that's left
+"""
+import os
+import time
+
+# Total seconds each endpoint may spend before it must answer (degraded if need be)
+ENDPOINT_BUDGETS = {
+    'chat': float(os.environ.get('CHAT_BUDGET_S', 12)),
+    'wisest': float(os.environ.get('WISEST_BUDGET_S', 20)),
+    'affirmations': float(os.environ.get('AFFIRMATIONS_BUDGET_S', 8)),
+}
+
+# Below this there is no point starting another network call
+MIN_USEFUL_SECONDS = 0.2
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage is asked to start without enough budget left"""
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.budget = seconds
+        self.expires = time.monotonic() + seconds
+
+    @classmethod
+    def for_endpoint(cls, endpoint):
+        return cls(ENDPOINT_BUDGETS.get(endpoint, 15.0))
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= MIN_USEFUL_SECONDS
+
+    def timeout(self, cap=None, reserve=0.0):
+        """Timeout for the next stage: what's left minus `reserve`, capped at `cap`
+
+        `reserve` keeps time back for work that must still happen afterwards,
+        like building a degraded answer.
+        """
+        seconds = self.remaining() - reserve
+        if cap is not None:
+            seconds = min(seconds, cap)
+        if seconds <= MIN_USEFUL_SECONDS:
+            raise DeadlineExceeded(f'{self.budget:.1f}s request budget exhausted')
+        return seconds
@@ -0,0 +1,189 @@
+"""
+Signed-in users' decision history in Supabase, one round trip per operation
+A page of history is one PostgREST request that embeds each decision's options, categories
+and values; saving or deleting a whole decision is one call to a SQL function
+(decision_history.sql) that does it in a single transaction. Requests carry the user's own
+access token, so Supabase checks it and row-level security still applies
+"""
+import base64
+import json
+import os
+import re
+import uuid
+
+import metrics
+import providers
+
+MAX_PAGE_SIZE = 50
+MAX_OPTIONS = 50
+MAX_CATEGORIES = 50
+TIMEOUT = 10
+_TIMESTAMP = re.compile(r'^[0-9T:. +-]+$')
+
+HISTORY_SELECT = (
+    "id,title,description,ai_feedback,created_at,updated_at,"
+    "options:decision_options(id,name,note),"
+    "categories:decision_categories(id,name,importance,higher_is_better),"
+    "values:decision_values(option_id,category_id,value)"
+)
+
+
+class HistoryError(Exception):
+    """A request Supabase turned down, with the HTTP status to pass back to the client"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def _headers(access_token):
+    return {
+        "apikey": os.environ.get('SUPABASE_ANON_KEY') or os.environ.get('SUPABASE_SERVICE_KEY'),
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json",
+    }
+
+
+def user_id(access_token):
+    """The `sub` claim of a Supabase access token, or None if it doesn't look like one
+
+    Only used to narrow queries; the signature is checked by Supabase on every request.
+    """
+    try:
+        payload = access_token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return claims.get('sub') or None
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+def _check(response):
+    if response.status_code in (401, 403):
+        raise HistoryError('Not signed in', 401)
+    if response.status_code == 404:
+        raise HistoryError('Decision not found', 404)
+    if response.status_code == 400:
+        try:
+            message = response.json().get('message')
+        except ValueError:
+            message = None
+        raise HistoryError(message or 'Invalid decision', 400)
+    response.raise_for_status()
+    return response.json()
+
+
+def _cursor_filter(cursor):
+    """Keyset filter for rows after a (created_at, id) cursor from the previous page"""
+    created_at, _, decision_id = cursor.partition('|')
+    if not _TIMESTAMP.match(created_at):
+        raise ValueError('cursor is malformed')
+    decision_id = uuid.UUID(decision_id)
+    return f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{decision_id}))'
+
+
+def load(access_token, limit=20, cursor=None):
+    """Newest first, each decision with its options, categories and values; pass next_cursor for more"""
+    owner = user_id(access_token)
+    if owner is None:
+        raise HistoryError('Not signed in', 401)
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    params = {
+        "select": HISTORY_SELECT,
+        "user_id": f"eq.{owner}",
+        "order": "created_at.desc,id.desc",
+        "limit": limit + 1,
+    }
+    if cursor:
+        params["or"] = _cursor_filter(cursor)
+
+    with metrics.upstream('supabase', 'history_load'):
+        response = providers.sessions['supabase'].get(
+            f"{os.environ.get('SUPABASE_URL')}/rest/v1/decisions",
+            headers=_headers(access_token),
+            params=params,
+            timeout=TIMEOUT
+        )
+    rows = _check(response)
+
+    decisions = []
+    for row in rows[:limit]:
+        feedback = row.get('ai_feedback')
+        row['best_choice'] = feedback.get('best_choice') if isinstance(feedback, dict) else None
+        decisions.append(row)
+    next_cursor = f"{rows[limit - 1]['created_at']}|{rows[limit - 1]['id']}" if len(rows) > limit else None
+    return {'decisions': decisions, 'next_cursor': next_cursor}
+
+
+def decision_graph(data):
+    """Validated save_decision_graph payload from a request body; ValueError if malformed
+
+    Options are names (or {name, note}); each category has one value per option.
+    """
+    title = str(data.get('title') or '').strip()
+    if not title:
+        raise ValueError('title is required')
+    options = data.get('options')
+    categories = data.get('categories') or []
+    if not isinstance(options, list) or not options:
+        raise ValueError('options must be a non-empty list')
+    if not isinstance(categories, list):
+        raise ValueError('categories must be a list')
+    if len(options) > MAX_OPTIONS or len(categories) > MAX_CATEGORIES:
+        raise ValueError(f'At most {MAX_OPTIONS} options and {MAX_CATEGORIES} categories')
+
+    graph_options = []
+    for option in options:
+        if isinstance(option, str):
+            option = {'name': option}
+        if not isinstance(option, dict) or not str(option.get('name') or '').strip():
+            raise ValueError('every option needs a name')
+        graph_options.append({'name': str(option['name']).strip(), 'note': option.get('note') or None})
+
+    graph_categories = []
+    for category in categories:
+        if not isinstance(category, dict) or not str(category.get('name') or '').strip():
+            raise ValueError('every category needs a name')
+        values = category.get('values') or []
+        if not isinstance(values, list) or len(values) != len(graph_options):
+            raise ValueError(f"category {category['name']!r} needs one value per option")
+        try:
+            importance = float(category.get('importance', 1))
+            values = [None if value is None else float(value) for value in values]
+        except (TypeError, ValueError):
+            raise ValueError(f"category {category['name']!r} has a non-numeric importance or value")
+        graph_categories.append({
+            'name': str(category['name']).strip(),
+            'importance': importance,
+            'higher_is_better': bool(category.get('higher_is_better', True)),
+            'values': values,
+        })
+
+    return {
+        'id': data.get('id') or None,
+        'title': title,
+        'description': data.get('description'),
+        'ai_feedback': data.get('ai_feedback'),
+        'options': graph_options,
+        'categories': graph_categories,
+    }
+
+
+def _rpc(access_token, function, body):
+    with metrics.upstream('supabase', function):
+        response = providers.sessions['supabase'].post(
+            f"{os.environ.get('SUPABASE_URL')}/rest/v1/rpc/{function}",
+            headers=_headers(access_token),
+            json=body,
+            timeout=TIMEOUT
+        )
+    return _check(response)
+
+
+def save(access_token, graph):
+    """Insert or replace a decision graph in one transaction; returns the decision id"""
+    return _rpc(access_token, 'save_decision_graph', {'p_decision': graph})
+
+
+def delete(access_token, decision_id):
+    """Delete a decision graph in one transaction; False if the user has no such decision"""
+    return bool(_rpc(access_token, 'delete_decision_graph', {'p_decision_id': decision_id}))
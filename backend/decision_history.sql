@@ -0,0 +1,104 @@
+-- Decision graph functions behind decision_history.py
+-- Run once in the Supabase SQL editor. Both functions run as the calling user (security invoker),
+-- so the existing row-level security policies on the decision tables still apply, and each call
+-- is a single transaction: a failed save or delete leaves the decision exactly as it was.
+
+-- Save a decision with its options, categories and values in one call.
+-- p_decision: {"id"?, "title", "description"?, "ai_feedback"?,
+--              "options": [{"name", "note"?}],
+--              "categories": [{"name", "importance", "higher_is_better", "values": [one number per option]}]}
+-- Updates the decision with that id, or the user's decision with the same title, or inserts a
+-- new one; its options, categories and values are replaced. Returns the decision id.
+create or replace function save_decision_graph(p_decision jsonb)
+returns uuid
+language plpgsql
+security invoker
+as $$
+declare
+    v_user uuid := auth.uid();
+    v_id uuid := nullif(p_decision->>'id', '')::uuid;
+    v_option_ids uuid[] := '{}';
+    v_option uuid;
+    v_category uuid;
+    v_item jsonb;
+begin
+    if v_user is null then
+        raise exception 'not authenticated' using errcode = '28000';
+    end if;
+
+    if v_id is null then
+        select id into v_id from decisions
+        where user_id = v_user and title = p_decision->>'title'
+        order by created_at desc
+        limit 1;
+    end if;
+
+    if v_id is null then
+        insert into decisions (user_id, title, description, ai_feedback)
+        values (v_user, p_decision->>'title', p_decision->>'description', p_decision->'ai_feedback')
+        returning id into v_id;
+    else
+        update decisions
+        set title = coalesce(p_decision->>'title', title),
+            description = p_decision->>'description',
+            ai_feedback = p_decision->'ai_feedback',
+            updated_at = now()
+        where id = v_id and user_id = v_user;
+        if not found then
+            raise exception 'decision % not found', v_id using errcode = 'P0002';
+        end if;
+
+        delete from decision_values where decision_id = v_id;
+        delete from decision_categories where decision_id = v_id;
+        delete from decision_options where decision_id = v_id;
+    end if;
+
+    for v_item in select value from jsonb_array_elements(coalesce(p_decision->'options', '[]'::jsonb)) loop
+        insert into decision_options (decision_id, name, note)
+        values (v_id, v_item->>'name', v_item->>'note')
+        returning id into v_option;
+        v_option_ids := v_option_ids || v_option;
+    end loop;
+
+    for v_item in select value from jsonb_array_elements(coalesce(p_decision->'categories', '[]'::jsonb)) loop
+        insert into decision_categories (decision_id, name, importance, higher_is_better)
+        values (v_id, v_item->>'name', (v_item->>'importance')::numeric, coalesce((v_item->>'higher_is_better')::boolean, true))
+        returning id into v_category;
+
+        insert into decision_values (decision_id, category_id, option_id, value)
+        select v_id, v_category, v_option_ids[ordinality::int], (value #>> '{}')::numeric
+        from jsonb_array_elements(coalesce(v_item->'values', '[]'::jsonb)) with ordinality
+        where ordinality <= array_length(v_option_ids, 1);
+    end loop;
+
+    return v_id;
+end;
+$$;
+
+-- Delete a decision and everything hanging off it in one call; false if it wasn't the user's
+create or replace function delete_decision_graph(p_decision_id uuid)
+returns boolean
+language plpgsql
+security invoker
+as $$
+begin
+    if auth.uid() is null then
+        raise exception 'not authenticated' using errcode = '28000';
+    end if;
+    if not exists (select 1 from decisions where id = p_decision_id and user_id = auth.uid()) then
+        return false;
+    end if;
+
+    delete from decision_values where decision_id = p_decision_id;
+    delete from decision_categories where decision_id = p_decision_id;
+    delete from decision_options where decision_id = p_decision_id;
+    delete from decisions where id = p_decision_id;
+    return true;
+end;
+$$;
+
+-- History pages are read newest first per user
+create index if not exists decisions_user_created_idx on decisions (user_id, created_at desc, id desc);
+create index if not exists decision_options_decision_idx on decision_options (decision_id);
+create index if not exists decision_categories_decision_idx on decision_categories (decision_id);
+create index if not exists decision_values_decision_idx on decision_values (decision_id);
@@ -0,0 +1,72 @@
+"""
+Persistent decision storage behind /save-decision and /delete-decision
+Embedded SQLite in WAL mode: durable, safe across worker processes, collision-free IDs
+"""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+import metrics
+
+DB_PATH = os.environ.get('DECISIONS_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'decisions.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decisions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+)
+"""
+
+# Parameterized SQL kept as constants so sqlite3's per-connection statement cache reuses them
+INSERT_SQL = "INSERT INTO decisions (id, data, timestamp) VALUES (?, ?, ?)"
+GET_SQL = "SELECT seq, id, data, timestamp FROM decisions WHERE id = ?"
+DELETE_SQL = "DELETE FROM decisions WHERE id = ?"
+
+
+class DecisionStore:
+    """One SQLite connection per thread; SQLite's file locking handles other processes"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, cached_statements=64)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # FULL fsyncs every commit so a saved decision survives a crash
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.execute('PRAGMA busy_timeout=10000')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(row):
+        seq, decision_id, data, timestamp = row
+        return {'id': decision_id, 'data': json.loads(data), 'timestamp': timestamp}
+
+    def save(self, data):
+        decision_id = uuid.uuid4().hex
+        timestamp = datetime.now().isoformat()
+        with metrics.timed('wisest_stage_seconds', stage='decision_store_save'):
+            with self._conn() as conn:
+                conn.execute(INSERT_SQL, (decision_id, json.dumps(data), timestamp))
+        return {'id': decision_id, 'data': data, 'timestamp': timestamp}
+
+    def get(self, decision_id):
+        row = self._conn().execute(GET_SQL, (decision_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def delete(self, decision_id):
+        """True if a decision was deleted"""
+        with metrics.timed('wisest_stage_seconds', stage='decision_store_delete'):
+            with self._conn() as conn:
+                return conn.execute(DELETE_SQL, (decision_id,)).rowcount > 0
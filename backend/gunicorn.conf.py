@@ -0,0 +1,63 @@
+"""
+Production serving mode: N pre-forked workers behind one gunicorn master
+
+    gunicorn -c gunicorn.conf.py api:app
+
+Workers import the app themselves (no preload) so each gets its own background threads
+and executors; the RAG corpus is shared anyway because every worker memory-maps the same
+snapshot files (see RAG/corpus.py). After `python3 -m RAG.corpus --sync` workers pick up the
+new version on their own, or `--reload` sends SIGHUP for a graceful worker replacement.
+Each worker prewarms in the background after boot; point the platform's readiness / health
+check at /ready so traffic only reaches workers that have finished (see prewarm.py).
+
+Admission pools and rate limits (admission.py) live in each worker: pool sizes are per worker
+(so total LLM concurrency is workers x LLM_CONCURRENCY), while per-client rate limits are
+split across workers to keep the configured deployment-wide quota. That split assumes a
+client's requests reach every worker; a keep-alive connection pins a client to one worker,
+so such a client gets that worker's share of the quota rather than all of it.
+
+Metrics live in each worker too: /metrics reports the worker that answered, labelled with its
+pid, so dashboards should sum over pid (see metrics.py).
+"""
+import os
+
+# Each worker holds its own copy of the app, caches and model clients, so size by memory,
+# not by the host's cores (which on a shared container host is far more than we're given)
+DEFAULT_WORKERS = 2
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', DEFAULT_WORKERS))
+# admission.py divides the rate limits by this when it's imported. That has to happen after
+# it's set: workers are forked from this process and reuse the module it already imported
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+import admission  # noqa: E402
+
+# LLM calls spend most of their time waiting on the network, so each worker also runs threads:
+# enough for every admission pool to be full at once, so a burst in one class (say /chat)
+# can't hold the threads another class (say /track-visit) needs
+worker_class = 'gthread'
+threads = max(int(os.environ.get('WORKER_THREADS', 0)), admission.THREADS_NEEDED)
+
+# Supervision: a worker that misses its heartbeat for `timeout` seconds is killed and replaced,
+# and workers are recycled after a jittered number of requests to bound any slow leak
+timeout = 60
+graceful_timeout = 30
+max_requests = 2000
+max_requests_jitter = 200
+
+pidfile = os.environ.get('GUNICORN_PIDFILE', '/tmp/wisest-gunicorn.pid')
+accesslog = '-'
+
+
+def when_ready(server):
+    from RAG.corpus import current_version
+    version = current_version()
+    if version:
+        server.log.info(f"Serving corpus version {version}")
+    else:
+        server.log.warning("No local corpus snapshot; retrieval falls back to the match_documents RPC")
+
+
+def worker_abort(worker):
+    worker.log.warning(f"Worker {worker.pid} timed out and is being replaced")
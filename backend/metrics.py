@@ -0,0 +1,225 @@
+"""
+In-process latency metrics for the backend
+Histograms, counters and gauges kept in memory and rendered in Prometheus text format.
+Under gunicorn every worker keeps its own registry and /metrics answers from whichever worker
+took the request, so each series carries a `pid` label; sum over it to get deployment totals.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds (5 ms up to 60 s covers a cache hit through a slow LLM call)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Histograms that aren't latencies get their own buckets
+TOKEN_BUCKETS = (50, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000)
+BUCKETS = {
+    'wisest_llm_input_tokens': TOKEN_BUCKETS,
+    'wisest_llm_output_tokens': TOKEN_BUCKETS,
+}
+
+HELP = {
+    'wisest_request_seconds': 'Endpoint latency in seconds',
+    'wisest_requests_in_flight': 'Requests currently being handled per endpoint',
+    'wisest_upstream_seconds': 'External call latency in seconds',
+    'wisest_upstream_errors_total': 'External calls that raised an error',
+    'wisest_stage_seconds': 'In-process stage latency in seconds',
+    'wisest_cache_requests_total': 'Cache lookups by result',
+    'wisest_cache_hit_ratio': 'Cache hits divided by lookups',
+    'wisest_cache_entries': 'Entries currently held per cache',
+    'wisest_admission_active': 'Requests holding a slot per admission pool',
+    'wisest_admission_queue_depth': 'Requests waiting for a slot per admission pool',
+    'wisest_admission_rejected_total': 'Requests shed by admission control',
+    'wisest_singleflight_total': 'Calls per single-flight group, as leader or coalesced follower',
+    'wisest_provider_abandoned_total': 'Provider calls still running when the caller gave up',
+    'wisest_visit_buffer_rows': 'Visit rows with a pending duration/page update',
+    'wisest_visit_updates_coalesced_total': 'Visit heartbeats merged into an already pending update',
+    'wisest_visit_rows_flushed_total': 'Visit rows written to Supabase by the write-behind flush',
+    'wisest_visit_rows_dropped_total': 'Visit updates Supabase rejected, dropped instead of retried',
+    'wisest_warm_answers': 'Precomputed chat answers loaded for the current corpus version',
+    'wisest_corpus_loaded_bytes': 'Bytes of corpus snapshots currently mapped by this process',
+    'wisest_corpus_evictions_total': 'Corpora dropped to stay under CORPUS_MEMORY_BUDGET_MB',
+    'wisest_component_ready': 'Whether a prewarm component (corpus, provider connection) is ready',
+    'wisest_shared_cache_errors_total': 'Shared cache tier calls that failed (the cache then runs local-only for a while)',
+    'wisest_cache_stampede_waits_total': 'Cache misses that waited for another replica to fill the key',
+    'wisest_llm_input_tokens': 'Prompt tokens per LLM call (local cl100k_base tokenizer, or a heuristic if it failed to load)',
+    'wisest_llm_output_tokens': 'Reply tokens per LLM call (local cl100k_base tokenizer, or a heuristic if it failed to load)',
+    'wisest_llm_tokens_total': 'LLM tokens sent and received, including hedged duplicate calls',
+    'wisest_prompt_trimmed_total': 'Prompts whose variable parts were cut to fit the endpoint token budget',
+    'wisest_retrieval_filtered_total': 'Retrievals restricted to source partitions, by explicit filter or inferred from the query',
+}
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+
+
+class Histogram:
+    """Cumulative bucket histogram; one lock-protected increment per observation"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the matching bucket"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return None
+
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for index, bucket_count in enumerate(counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if seen + bucket_count >= rank and bucket_count:
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = upper
+        return self.buckets[-1]
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def histogram(name, **labels):
+    key = _key(name, labels)
+    hist = _histograms.get(key)
+    if hist is None:
+        with _lock:
+            hist = _histograms.setdefault(key, Histogram(BUCKETS.get(name, DEFAULT_BUCKETS)))
+    return hist
+
+
+def observe(name, seconds, **labels):
+    histogram(name, **labels).observe(seconds)
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def add_gauge(name, delta, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + delta
+
+
+@contextmanager
+def timed(name, **labels):
+    """Time the enclosed block into histogram `name`; exceptions are counted and re-raised"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if name == 'wisest_upstream_seconds':
+            inc('wisest_upstream_errors_total', **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def upstream(provider, op):
+    """Shorthand for timing one external call"""
+    return timed('wisest_upstream_seconds', provider=provider, op=op)
+
+
+def record_cache(cache, hit):
+    inc('wisest_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def _escape_label(value):
+    # Text exposition format: backslash, double quote and newline are escaped in label values
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join(f'{k}="{_escape_label(v)}"' for k, v in pairs)
+    return '{' + body + '}'
+
+
+def _cache_ratios():
+    totals = {}
+    hits = {}
+    for (name, labels), value in _counters.items():
+        if name != 'wisest_cache_requests_total':
+            continue
+        label_map = dict(labels)
+        cache = label_map.get('cache')
+        totals[cache] = totals.get(cache, 0) + value
+        if label_map.get('result') == 'hit':
+            hits[cache] = hits.get(cache, 0) + value
+    return {cache: hits.get(cache, 0) / total for cache, total in totals.items() if total}
+
+
+def render():
+    """Render every metric in Prometheus text exposition format, labelled with this worker's pid"""
+    lines = []
+    declared = set()
+    worker = [('pid', os.getpid())]
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            if name in HELP:
+                lines.append(f'# HELP {name} {HELP[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        ratios = _cache_ratios()
+
+    for (name, labels), hist in histograms:
+        declare(name, 'histogram')
+        with hist._lock:
+            counts = list(hist.counts)
+            total_sum = hist.sum
+            total_count = hist.count
+        cumulative = 0
+        for bound, bucket_count in zip(hist.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_format_labels(labels, worker + [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labels, worker + [("le", "+Inf")])} {total_count}')
+        lines.append(f'{name}_sum{_format_labels(labels, worker)} {total_sum}')
+        lines.append(f'{name}_count{_format_labels(labels, worker)} {total_count}')
+
+    for (name, labels), value in counters:
+        declare(name, 'counter')
+        lines.append(f'{name}{_format_labels(labels, worker)} {value}')
+
+    for (name, labels), value in gauges:
+        declare(name, 'gauge')
+        lines.append(f'{name}{_format_labels(labels, worker)} {value}')
+
+    for cache, ratio in sorted(ratios.items()):
+        declare('wisest_cache_hit_ratio', 'gauge')
+        lines.append(f'wisest_cache_hit_ratio{_format_labels([("cache", cache)], worker)} {ratio:.4f}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,160 @@
+"""
+Boot-time prewarm and readiness
+Each worker loads the RAG corpus and warm answers, opens its pooled connection to every
+provider and probes it with a cheap call, all in the background; /ready reports how far
+that got so the load balancer only routes traffic to workers that are actually warm
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import metrics
+import prompts
+import providers
+
+PROBE_TIMEOUT = float(os.environ.get('PREWARM_PROBE_TIMEOUT_S', 10))
+# Components that must be up before the worker reports ready; provider probes are advisory
+# because every provider has a fallback (or a degraded answer)
+REQUIRED = ('rag',)
+# Required steps are retried until they succeed, backing off up to this many seconds
+RETRY_MAX_DELAY = float(os.environ.get('PREWARM_RETRY_MAX_S', 60))
+
+_lock = threading.Lock()
+_components = {}
+_started = None
+
+
+def _probe_get(provider, url, headers):
+    with metrics.upstream(provider, 'probe'):
+        response = providers.sessions[provider].get(url, headers=headers, timeout=PROBE_TIMEOUT)
+    response.raise_for_status()
+    return f"HTTP {response.status_code}"
+
+
+def _rag():
+    # Importing RAG pulls in langchain, so it happens here rather than on the boot path
+    from RAG.corpus import DEFAULT_CORPUS, get_corpus
+    from RAG.Query import refresh_warm_answers
+
+    corpus = get_corpus(DEFAULT_CORPUS)
+    refresh_warm_answers(force=True)
+    if corpus is None:
+        return "no local snapshot, retrieval uses the match_documents RPC"
+    return f"corpus {corpus.version}, {len(corpus)} chunks"
+
+
+def _supabase():
+    url = os.environ.get('SUPABASE_URL')
+    key = os.environ.get('SUPABASE_SERVICE_KEY')
+    return _probe_get('supabase', f"{url}/rest/v1/documents?select=id&limit=1",
+                      {"apikey": key, "Authorization": f"Bearer {key}"})
+
+
+def _cohere():
+    # Same host and pooled session as embed() in providers.py, so this opens the connection serving reuses
+    return _probe_get('cohere', "https://api.cohere.ai/v1/models?page_size=1",
+                      {"Authorization": f"Bearer {providers.COHERE_API_KEY}"})
+
+
+def _groq():
+    return _probe_get('groq', "https://api.groq.com/openai/v1/models",
+                      {"Authorization": f"Bearer {providers.GROQ_API_KEY}"})
+
+
+def _gemini():
+    import google.generativeai as genai
+
+    providers.gemini_model()
+    # get_model takes no timeout in the pinned SDK, so the wait is bounded here instead
+    probe = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prewarm-gemini')
+    try:
+        with metrics.upstream('gemini', 'probe'):
+            probe.submit(genai.get_model, f"models/{providers.GEMINI_MODEL}").result(timeout=PROBE_TIMEOUT)
+    except FutureTimeout:
+        raise TimeoutError(f"no answer within {PROBE_TIMEOUT:.0f}s")
+    finally:
+        probe.shutdown(wait=False)
+    return providers.GEMINI_MODEL
+
+
+# name -> (step, whether it is configured)
+STEPS = {
+    'rag': (_rag, lambda: True),
+    'tokenizer': (prompts.tokenizer_name, lambda: True),
+    'supabase': (_supabase, lambda: bool(os.environ.get('SUPABASE_URL') and os.environ.get('SUPABASE_SERVICE_KEY'))),
+    'cohere': (_cohere, lambda: bool(providers.COHERE_API_KEY)),
+    'groq': (_groq, lambda: bool(providers.GROQ_API_KEY)),
+    'gemini': (_gemini, lambda: bool(providers.GEMINI_API_KEY)),
+}
+
+
+def _set(name, **state):
+    with _lock:
+        _components[name] = state
+    metrics.set_gauge('wisest_component_ready', 1 if state['status'] in ('ready', 'skipped') else 0, component=name)
+
+
+def _run(name, step):
+    start = time.monotonic()
+    delay = 1.0
+    attempt = 1
+    while True:
+        try:
+            detail = step()
+            _set(name, status='ready', detail=detail, seconds=round(time.monotonic() - start, 3))
+            return
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if name not in REQUIRED:
+                _set(name, status='error', detail=error, seconds=round(time.monotonic() - start, 3))
+                print(f"[WARN] Prewarm {name} failed: {e}")
+                return
+        # A required step failing (e.g. a storage blip) would otherwise keep the worker unready
+        # until it restarts
+        _set(name, status='retrying', detail=f"attempt {attempt}: {error}", seconds=round(time.monotonic() - start, 3))
+        print(f"[WARN] Prewarm {name} failed (attempt {attempt}), retrying in {delay:.0f}s: {error}")
+        time.sleep(delay)
+        delay = min(delay * 2, RETRY_MAX_DELAY)
+        attempt += 1
+
+
+def _prewarm(steps):
+    with ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix='prewarm') as pool:
+        for name, step in steps.items():
+            pool.submit(_run, name, step)
+    print(f"Prewarm finished in {time.monotonic() - _started:.1f}s: "
+          + ", ".join(f"{name}={state['status']}" for name, state in sorted(_components.items())))
+
+
+def start(extra_steps=None):
+    """Kick off the prewarm in a background thread; safe to call more than once
+
+    `extra_steps` maps more component names to callables (run like the built-in probes).
+    """
+    global _started
+    with _lock:
+        if _started is not None:
+            return
+        _started = time.monotonic()
+
+    candidates = dict(STEPS)
+    for name, step in (extra_steps or {}).items():
+        candidates[name] = (step, lambda: True)
+
+    steps = {}
+    for name, (step, configured) in candidates.items():
+        if configured():
+            steps[name] = step
+            _set(name, status='pending', detail=None, seconds=None)
+        else:
+            _set(name, status='skipped', detail='not configured', seconds=None)
+    threading.Thread(target=_prewarm, args=(steps,), name='prewarm', daemon=True).start()
+
+
+def status():
+    """(ready, per-component state); ready once every required component has finished warming"""
+    with _lock:
+        components = {name: dict(state) for name, state in _components.items()}
+    ready = _started is not None and all(components.get(name, {}).get('status') == 'ready' for name in REQUIRED)
+    return ready, components
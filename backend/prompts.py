@@ -0,0 +1,144 @@
+"""
+Prompt building and token accounting for the LLM endpoints
+Static instructions are compiled into a Prompt once per process with their token count; each
+request only adds (and counts) its own part, trimmed to the endpoint's input token budget.
+providers.generate records input/output tokens per call next to the call latency.
+
+Tokens are counted with tiktoken's cl100k_base encoding (TOKENIZER_ENCODING). Llama 3 (Groq)
+extends that vocabulary, so counts match closely; Gemini tokenizes differently, so its counts
+are an estimate. If tiktoken or its encoding file can't be loaded, a regex heuristic that
+lands within ~10-15% for English prose is used instead
+"""
+import math
+import os
+import re
+import threading
+
+import metrics
+
+# Input tokens we're willing to send per call, per endpoint
+TOKEN_BUDGETS = {
+    'chat': int(os.environ.get('CHAT_TOKEN_BUDGET', 1500)),
+    'wisest': int(os.environ.get('WISEST_TOKEN_BUDGET', 1000)),
+    'affirmations': int(os.environ.get('AFFIRMATIONS_TOKEN_BUDGET', 600)),
+}
+# Reply caps, sent where the provider supports one (see providers.groq_generate)
+OUTPUT_BUDGETS = {'chat': 300, 'wisest': 500, 'affirmations': 700}
+
+# Role markers and separators each chat message adds on the wire
+MESSAGE_OVERHEAD = 4
+
+TOKENIZER_ENCODING = os.environ.get('TOKENIZER_ENCODING', 'cl100k_base')
+
+# Roughly the pre-tokenizer split BPE tokenizers (cl100k, Llama 3) use before merging
+_PIECES = re.compile(r"'(?:s|t|re|ve|m|ll|d)|[^\W\d_]+|\d{1,3}|[^\s\w]+|\s+", re.IGNORECASE)
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """The tiktoken encoding, loaded once; None if it isn't available (heuristic fallback)"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    print(f"[WARN] Tokenizer {TOKENIZER_ENCODING} unavailable, estimating token counts: {e}")
+                _encoding_loaded = True
+    return _encoding
+
+
+def tokenizer_name():
+    return TOKENIZER_ENCODING if _get_encoding() is not None else 'heuristic'
+
+
+def _piece_tokens(piece):
+    if piece.isspace():
+        # A single space merges into the next word; newlines and indentation don't
+        return 0 if piece == ' ' else 1
+    if not piece.isascii():
+        return len(piece)
+    if piece[0].isalpha() or piece[0] == "'":
+        # Common words are one token; long or rare ones split into pieces of ~6 characters
+        return math.ceil(len(piece) / 6)
+    if piece[0].isdigit():
+        return 1
+    return math.ceil(len(piece) / 3)
+
+
+def count_tokens(text):
+    """Token count with the local tokenizer (the heuristic estimate if it couldn't load)"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text or '', disallowed_special=()))
+    return sum(_piece_tokens(piece) for piece in _PIECES.findall(text or ''))
+
+
+def count_messages(messages):
+    tokens = getattr(messages, 'tokens', None)
+    if tokens is not None:
+        return tokens
+    return sum(count_tokens(message['content']) + MESSAGE_OVERHEAD for message in messages)
+
+
+def truncate(text, max_tokens):
+    """The longest prefix of text that fits in max_tokens, cut on a word boundary"""
+    if max_tokens <= 0:
+        return ''
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        prefix = encoding.decode(tokens[:max_tokens])
+        # Drop the word the cut landed in; decoding can't add tokens back, so this still fits
+        return (prefix.rsplit(None, 1)[0] if prefix[-1:].strip() else prefix).rstrip()
+    used = 0
+    for match in _PIECES.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+class Messages(list):
+    """Rendered messages that already know their token count"""
+
+    def __init__(self, messages, tokens):
+        super().__init__(messages)
+        self.tokens = tokens
+
+
+class Prompt:
+    """Static leading messages compiled once; render() appends the per-request user message"""
+
+    def __init__(self, endpoint, *prefix):
+        self.endpoint = endpoint
+        self.prefix = [dict(message) for message in prefix]
+        self.prefix_tokens = count_messages(self.prefix)
+
+    @property
+    def budget(self):
+        return TOKEN_BUDGETS.get(self.endpoint)
+
+    def render(self, template, fit=None, **fields):
+        """prefix + template.format(**fields) as a user message
+
+        If the result would go over the endpoint's budget, the `fit` field is cut down to
+        what's left (so put the least important text last in it, e.g. lowest-ranked passages).
+        """
+        content = template.format(**fields)
+        tokens = self.prefix_tokens + count_tokens(content) + MESSAGE_OVERHEAD
+        if fit is not None and self.budget is not None and tokens > self.budget:
+            fixed = count_tokens(template.format(**dict(fields, **{fit: ''})))
+            available = self.budget - self.prefix_tokens - MESSAGE_OVERHEAD - fixed
+            fields[fit] = truncate(fields[fit], available)
+            content = template.format(**fields)
+            tokens = self.prefix_tokens + count_tokens(content) + MESSAGE_OVERHEAD
+            metrics.inc('wisest_prompt_trimmed_total', endpoint=self.endpoint)
+        return Messages(self.prefix + [{'role': 'user', 'content': content}], tokens)
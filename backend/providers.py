@@ -0,0 +1,352 @@
+"""
+Provider-call layer for LLM and embedding APIs
+Per-provider circuit breakers, hedged backup requests after a p95-based delay,
+and failover between configured generators (Groq <-> Gemini) per endpoint
+"""
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FutureTimeout, wait
+
+import requests
+
+import metrics
+import prompts
+
+COHERE_API_KEY = os.environ.get('COHERE_API_KEY')
+GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+
+GROQ_MODEL = 'llama-3.1-8b-instant'
+GEMINI_MODEL = 'gemini-2.5-flash'
+EMBED_MODEL = 'embed-english-light-v3.0'
+
+# Generator order per endpoint; the first healthy one is primary, the next is hedge/failover
+GENERATOR_CHAINS = {
+    'chat': os.environ.get('CHAT_GENERATORS', 'groq,gemini').split(','),
+    'wisest': os.environ.get('WISEST_GENERATORS', 'gemini,groq').split(','),
+    'affirmations': os.environ.get('AFFIRMATIONS_GENERATORS', 'gemini,groq').split(','),
+}
+
+# Hedge delay before enough samples exist to trust a p95, per operation
+DEFAULT_HEDGE_DELAY = {'embed': 0.5, 'match_documents': 0.5, 'generate': 4.0}
+MIN_HEDGE_SAMPLES = 20
+MIN_HEDGE_DELAY = 0.05
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='provider')
+# The Gemini SDK call runs here under a bounded wait, so a hung call ties up one of these
+# threads rather than a provider thread
+_gemini_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='gemini')
+_gemini_model = None
+_gemini_lock = threading.Lock()
+
+
+def _pooled_session(pool_size=32):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# One keep-alive connection pool per upstream, so calls reuse warm TLS connections
+# instead of handshaking every time (prewarm.py opens them at boot)
+sessions = {name: _pooled_session() for name in ('groq', 'cohere', 'supabase', 'ip-api')}
+
+
+class ProviderUnavailable(Exception):
+    """Raised when a provider's circuit is open or every configured generator failed"""
+
+
+class CircuitBreaker:
+    """Opens when too many recent calls failed or were slow, then lets one trial call through after a cooldown"""
+
+    def __init__(self, name, window=20, min_calls=5, failure_ratio=0.5, slow_seconds=20.0, cooldown=30.0):
+        self.name = name
+        self.window = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, ok, seconds):
+        # A call slower than slow_seconds counts against the provider even if it succeeded
+        failed = not ok or seconds > self.slow_seconds
+        with self._lock:
+            if self.state == 'half_open':
+                if failed:
+                    self._open()
+                else:
+                    self.state = 'closed'
+                    self.window.clear()
+            else:
+                self.window.append(failed)
+                if (self.state == 'closed' and len(self.window) >= self.min_calls
+                        and sum(self.window) / len(self.window) >= self.failure_ratio):
+                    self._open()
+        metrics.set_gauge('wisest_circuit_open', 0 if self.state == 'closed' else 1, provider=self.name)
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        metrics.inc('wisest_circuit_opened_total', provider=self.name)
+
+
+breakers = {
+    'cohere': CircuitBreaker('cohere', slow_seconds=5.0),
+    'supabase': CircuitBreaker('supabase', slow_seconds=5.0),
+    'groq': CircuitBreaker('groq'),
+    'gemini': CircuitBreaker('gemini'),
+}
+
+
+def hedge_delay(provider, op):
+    """p95 latency of this provider/op, or a default until enough calls have been seen"""
+    hist = metrics.histogram('wisest_upstream_seconds', provider=provider, op=op)
+    if hist.count >= MIN_HEDGE_SAMPLES:
+        return max(MIN_HEDGE_DELAY, hist.quantile(0.95))
+    return DEFAULT_HEDGE_DELAY.get(op, 1.0)
+
+
+class _Outcome:
+    """Reports one attempt to its provider's breaker exactly once, whoever gets there first"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.start = time.perf_counter()
+        self._reported = False
+        self._lock = threading.Lock()
+
+    def report(self, ok):
+        with self._lock:
+            if self._reported:
+                return
+            self._reported = True
+        breakers[self.provider].record(ok, time.perf_counter() - self.start)
+
+    def abandon(self):
+        """The caller stopped waiting: count it now only if the breaker would anyway
+
+        An attempt already past the slow threshold is a failure whatever happens next, and a
+        half-open breaker can't wait on a trial that may never return. Otherwise the attempt
+        reports itself when it finishes, so a healthy provider losing a race isn't penalised.
+        """
+        breaker = breakers[self.provider]
+        if breaker.state == 'half_open' or time.perf_counter() - self.start > breaker.slow_seconds:
+            self.report(False)
+
+
+def _attempt(outcome, op, fn):
+    """Run one call against a provider, feeding its breaker and the latency histogram"""
+    try:
+        with metrics.upstream(outcome.provider, op):
+            result = fn()
+    except Exception:
+        outcome.report(False)
+        raise
+    outcome.report(True)
+    return result
+
+
+def _first_success(attempts, timeout):
+    """Start attempts one after another and return the first successful result
+
+    Each attempt is (provider, op, fn, hedge_after): if it hasn't answered within
+    hedge_after seconds the next attempt starts alongside it (a hedge), and once every
+    running attempt has failed the next one starts immediately (failover).
+    """
+    deadline = time.monotonic() + timeout
+    queue = list(attempts)
+    pending = set()
+    outcomes = {}
+    errors = []
+    hedge_at = deadline
+
+    def launch():
+        nonlocal hedge_at
+        provider, op, fn, hedge_after = queue.pop(0)
+        if not breakers[provider].allow():
+            errors.append(ProviderUnavailable(f'{provider} circuit is open'))
+            metrics.inc('wisest_provider_skipped_total', provider=provider, op=op)
+            return
+        if pending:
+            metrics.inc('wisest_hedged_requests_total', provider=provider, op=op)
+        outcome = _Outcome(provider)
+        future = _executor.submit(_attempt, outcome, op, fn)
+        outcomes[future] = (outcome, op)
+        pending.add(future)
+        hedge_at = time.monotonic() + hedge_after
+
+    while queue and not pending:
+        launch()
+
+    while pending:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        wait_for = min(deadline, hedge_at) - now if queue else deadline - now
+        done, pending = wait(pending, timeout=max(0.0, wait_for), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                errors.append(e)
+
+        if queue and (not pending or time.monotonic() >= hedge_at):
+            launch()
+            while queue and not pending:
+                launch()
+
+    if pending:
+        for future in pending:
+            outcome, op = outcomes[future]
+            outcome.abandon()
+            metrics.inc('wisest_provider_abandoned_total', provider=outcome.provider, op=op)
+        raise TimeoutError(f'No provider answered within {timeout:.1f}s')
+    raise ProviderUnavailable('; '.join(str(e) for e in errors) or 'no provider configured')
+
+
+def call(provider, op, fn, timeout, hedge=False):
+    """Call one provider with its circuit breaker; idempotent calls may send one hedged duplicate"""
+    attempts = [(provider, op, fn, hedge_delay(provider, op))]
+    if hedge:
+        attempts.append((provider, op, fn, timeout))
+    return _first_success(attempts, timeout)
+
+
+# Generators: take OpenAI-style messages and return the reply text
+
+def groq_generate(messages, timeout, temperature=0.6, max_tokens=None):
+    body = {
+        "messages": messages,
+        "model": GROQ_MODEL,
+        "temperature": temperature
+    }
+    if max_tokens:
+        body["max_tokens"] = max_tokens
+    response = sessions['groq'].post(
+        "https://api.groq.com/openai/v1/chat/completions",
+        headers={"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"},
+        json=body,
+        timeout=timeout
+    )
+    response.raise_for_status()
+    data = response.json()
+    if not data or not data.get("choices"):
+        raise ValueError('Groq returned no choices')
+    return data["choices"][0]["message"]["content"]
+
+
+def _messages_to_prompt(messages):
+    if len(messages) == 1:
+        return messages[0]['content']
+    lines = []
+    for message in messages:
+        role = {'system': 'Instructions', 'user': 'User', 'assistant': 'You'}.get(message['role'], message['role'])
+        lines.append(f"{role}: {message['content']}")
+    lines.append('You:')
+    return '\n\n'.join(lines)
+
+
+def gemini_model():
+    """The Gemini client, built once per process"""
+    global _gemini_model
+    if _gemini_model is None:
+        with _gemini_lock:
+            if _gemini_model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+                _gemini_model = genai.GenerativeModel(GEMINI_MODEL)
+    return _gemini_model
+
+
+def _gemini_request_options(model, timeout):
+    # request_options only exists in newer SDKs; older ones rely on the bounded wait alone
+    if 'request_options' in inspect.signature(model.generate_content).parameters:
+        return {'request_options': {'timeout': timeout}}
+    return {}
+
+
+def gemini_generate(messages, timeout, temperature=None, max_tokens=None):
+    # No output cap: Gemini 2.5 counts its thinking tokens against it and can come back empty
+    model = gemini_model()
+    future = _gemini_executor.submit(model.generate_content, _messages_to_prompt(messages),
+                                     **_gemini_request_options(model, timeout))
+    try:
+        response = future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise TimeoutError(f'Gemini did not answer within {timeout:.1f}s')
+    if not response or not response.text:
+        raise ValueError('Gemini returned an empty response')
+    return response.text
+
+
+GENERATORS = {
+    'groq': (groq_generate, lambda: bool(GROQ_API_KEY)),
+    'gemini': (gemini_generate, lambda: bool(GEMINI_API_KEY)),
+}
+
+
+def _counted_generate(endpoint, provider, fn, messages, input_tokens, timeout):
+    """One generator attempt with its tokens recorded; hedged duplicates cost tokens too"""
+    metrics.inc('wisest_llm_tokens_total', input_tokens, endpoint=endpoint, provider=provider, direction='input')
+    metrics.observe('wisest_llm_input_tokens', input_tokens, endpoint=endpoint, provider=provider)
+    text = fn(messages, timeout, max_tokens=prompts.OUTPUT_BUDGETS.get(endpoint))
+    output_tokens = prompts.count_tokens(text)
+    metrics.inc('wisest_llm_tokens_total', output_tokens, endpoint=endpoint, provider=provider, direction='output')
+    metrics.observe('wisest_llm_output_tokens', output_tokens, endpoint=endpoint, provider=provider)
+    return text
+
+
+def generate(endpoint, messages, timeout=30.0):
+    """Generate a reply for `endpoint`, hedging to and failing over along its generator chain"""
+    input_tokens = prompts.count_messages(messages)
+    attempts = []
+    for name in GENERATOR_CHAINS.get(endpoint, ['gemini']):
+        name = name.strip()
+        if name not in GENERATORS or not GENERATORS[name][1]():
+            continue
+        fn = GENERATORS[name][0]
+        attempts.append((name, 'generate', lambda fn=fn, name=name: _counted_generate(endpoint, name, fn, messages, input_tokens, timeout),
+                         hedge_delay(name, 'generate')))
+    if not attempts:
+        raise ProviderUnavailable(f'No generator configured for {endpoint}')
+    return _first_success(attempts, timeout)
+
+
+def embed(texts, input_type='search_query', timeout=10.0):
+    """Cohere embeddings (384 dims for embed-english-light-v3.0), hedged"""
+    def request_embeddings():
+        response = sessions['cohere'].post(
+            "https://api.cohere.ai/v1/embed",
+            headers={"Authorization": f"Bearer {COHERE_API_KEY}", "Content-Type": "application/json"},
+            json={
+                "texts": texts,
+                "model": EMBED_MODEL,
+                "input_type": input_type
+            },
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()["embeddings"]
+    return call('cohere', 'embed', request_embeddings, timeout, hedge=True)
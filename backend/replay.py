@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Replay real traffic from exported logs / chat_logs against a local instance
+Keeps the recorded arrival pattern (scaled by --speed) and reports per-endpoint latency
+percentiles, error and shed rates, and the speed at which the server saturates
+
+Start a local server with every upstream provider stubbed (realistic latencies, no API keys),
+under gunicorn with the production gunicorn.conf.py (workers, gthread threads, admission pools):
+    python3 replay.py serve --port 5055
+Replay exports (CSV, JSON or JSONL from the Supabase table editor) at several speeds:
+    python3 replay.py run --logs logs.csv --chat-logs chat_logs.csv --speeds 1 10 50 100
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import requests
+
+# Median seconds per stubbed upstream call, roughly what production sees
+STUB_LATENCY = {
+    'groq': 0.8,
+    'gemini': 1.5,
+    'cohere': 0.15,
+    'supabase': 0.05,
+    'ip-api': 0.1,
+}
+STUB_HOSTS = {
+    'api.groq.com': 'groq',
+    'api.cohere.ai': 'cohere',
+    'supabase.stub': 'supabase',
+    'ip-api.com': 'ip-api',
+}
+STUB_ANSWER = '\n'.join(f"{i}. This is stubbed sentence number {i} for load testing." for i in range(1, 11))
+
+
+# --- serve: the API with stubbed upstreams ---
+
+def _stub_sleep(provider, scale, jitter=0.5):
+    time.sleep(STUB_LATENCY[provider] * scale * random.lognormvariate(0, jitter))
+
+
+def _stub_embedding(text, dim=384):
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _stub_body(provider, method, url, payload):
+    if provider == 'groq':
+        return {'choices': [{'message': {'content': STUB_ANSWER}}]}
+    if provider == 'cohere':
+        return {'embeddings': [_stub_embedding(text) for text in payload.get('texts', [])]}
+    if provider == 'ip-api':
+        return {'status': 'success', 'city': 'Replay', 'regionName': 'Local', 'country': 'Test'}
+    if '/rpc/' in url:
+        return [{'id': i, 'content': f'Stub passage {i}. ' * 20, 'metadata': {'source': f'RAG/stub{i}.md'}, 'similarity': 0.8}
+                for i in range(5)]
+    if method == 'POST' and url.split('?')[0].endswith('/logs'):
+        return [{'id': random.randint(1, 10 ** 9)}]
+    return []
+
+
+def install_stubs(scale=1.0, error_rate=0.0):
+    """Route every outbound HTTP call (and the Gemini SDK) to in-process fakes"""
+    def fake_request(session, method, url, **kwargs):
+        host = re.sub(r'^https?://([^/:]+).*$', r'\1', url)
+        provider = STUB_HOSTS.get(host)
+        if provider is None:
+            raise requests.ConnectionError(f'Replay stub has no fake for {host}')
+        _stub_sleep(provider, scale)
+        if random.random() < error_rate:
+            raise requests.ConnectionError(f'Injected {provider} failure')
+        response = requests.models.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(_stub_body(provider, method.upper(), url, kwargs.get('json') or {})).encode('utf-8')
+        return response
+
+    requests.Session.request = fake_request
+
+    import providers
+
+    def fake_gemini(messages, timeout, temperature=None, max_tokens=None):
+        _stub_sleep('gemini', scale)
+        if random.random() < error_rate:
+            raise ConnectionError('Injected gemini failure')
+        return STUB_ANSWER
+
+    providers.GENERATORS['gemini'] = (fake_gemini, lambda: True)
+
+
+def serve(port, scale, error_rate, dev_server=False):
+    # Fake credentials so every provider counts as configured; nothing leaves the process
+    for name in ('GEMINI_API_KEY', 'GROQ_API_KEY', 'COHERE_API_KEY', 'SUPABASE_SERVICE_KEY'):
+        os.environ[name] = 'replay-stub'
+    os.environ['SUPABASE_URL'] = 'http://supabase.stub'
+    os.environ.setdefault('DECISIONS_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='replay-'), 'decisions.db'))
+    os.environ.setdefault('GUNICORN_PIDFILE', os.path.join(tempfile.mkdtemp(prefix='replay-'), 'gunicorn.pid'))
+
+    if dev_server:
+        install_stubs(scale, error_rate)
+        import api
+        print(f"🧪 Stubbed API on http://127.0.0.1:{port} (Flask dev server: latency and saturation "
+              f"numbers won't match production; upstream latency x{scale}, error rate {error_rate:.0%})")
+        api.app.run(host='127.0.0.1', port=port, threaded=True, use_reloader=False)
+        return
+
+    from gunicorn.app.base import Application
+
+    class StubbedServer(Application):
+        """gunicorn with the production config; each worker installs the stubs before importing the app"""
+
+        def init(self, parser, opts, args):
+            return {}
+
+        def load_config(self):
+            self.load_config_from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py'))
+            self.cfg.set('bind', [f'127.0.0.1:{port}'])
+
+        def load(self):
+            install_stubs(scale, error_rate)
+            import api
+            return api.app
+
+    print(f"🧪 Stubbed API on http://127.0.0.1:{port} under gunicorn (upstream latency x{scale}, error rate {error_rate:.0%})")
+    StubbedServer().run()
+
+
+# --- run: replay recorded traffic ---
+
+def load_rows(path):
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            return list(csv.DictReader(f))
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def _timestamp(row):
+    value = row.get('created_at') or row.get('timestamp')
+    if not value:
+        return None
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00').replace(' ', 'T', 1)).timestamp()
+
+
+def _wisest_body(query_text):
+    """Plausible decision for a logged "main | Options: a, b" query"""
+    main, _, options = (query_text or '').partition(' | Options: ')
+    options = [o.strip() for o in options.split(',') if o.strip()] or ['Option A', 'Option B']
+    categories = [
+        {'title': 'Cost', 'metrics': [str(random.randint(100, 900)) for _ in options], 'importance': random.randint(1, 10)},
+        {'title': 'Quality', 'metrics': [str(random.randint(1, 10)) for _ in options], 'importance': random.randint(1, 10)},
+    ]
+    return {
+        'options': options,
+        'categories': categories,
+        'metric_types': [1, 4],
+        'scores': [{'option': o, 'score': random.uniform(0, 100)} for o in options],
+        'best_decision': options[0],
+        'main_Consideration': main or 'Which one should I pick?',
+        'choice_Considerations': [],
+    }
+
+
+def build_events(logs=(), chat_logs=(), clients=200):
+    """(timestamp, client ip, endpoint, body) in arrival order"""
+    events = []
+    for row in chat_logs:
+        if row.get('query') and _timestamp(row) is not None:
+            events.append((_timestamp(row), None, '/chat', {'message': row['query']}))
+
+    for row in logs:
+        at = _timestamp(row)
+        if at is None:
+            continue
+        page, query_text = row.get('page') or '/', row.get('query_text') or ''
+        if page == '/chat':
+            if not chat_logs and query_text:
+                events.append((at, row.get('ip_address'), '/chat', {'message': query_text}))
+        elif page == '/wisest':
+            events.append((at, row.get('ip_address'), '/wisest', _wisest_body(query_text)))
+        elif page == '/affirmations':
+            title, _, description = query_text.partition(': ')
+            events.append((at, row.get('ip_address'), '/affirmations', {'title': title, 'description': description, 'mood': 'neutral'}))
+        else:
+            events.append((at, row.get('ip_address'), '/track-visit', {'page': page}))
+
+    # Rows without an IP are spread over synthetic clients, so per-client rate limits see real-ish fan-in
+    events = [(at, ip or f'10.0.{n % clients // 250}.{n % clients % 250}', endpoint, body)
+              for n, (at, ip, endpoint, body) in enumerate(sorted(events, key=lambda e: e[0]))]
+    return events
+
+
+def _send(target, endpoint, body, ip, timeout):
+    """[(endpoint, status, seconds)] for one replayed event (a page view is track + heartbeat)"""
+    headers = {'X-Forwarded-For': ip}
+    results = []
+    start = time.perf_counter()
+    try:
+        response = requests.post(f"{target}{endpoint}", json=body, headers=headers, timeout=timeout)
+        results.append((endpoint, response.status_code, time.perf_counter() - start))
+        if endpoint == '/track-visit' and response.ok and (response.json() or {}).get('id'):
+            start = time.perf_counter()
+            response = requests.post(f"{target}/update-visit", json={'id': response.json()['id'], 'duration': random.randint(5, 300)},
+                                     headers=headers, timeout=timeout)
+            results.append(('/update-visit', response.status_code, time.perf_counter() - start))
+    except requests.RequestException:
+        results.append((endpoint, None, time.perf_counter() - start))
+    return results
+
+
+def replay(events, target, speed, duration, concurrency=512, timeout=60):
+    """Open-loop replay: requests go out on the recorded schedule whether or not earlier ones finished"""
+    if not events:
+        return [], 0.0, 0.0
+    first = events[0][0]
+    window = [e for e in events if (e[0] - first) / speed <= duration]
+    results, lags = [], []
+    lock = threading.Lock()
+
+    def run(event):
+        outcome = _send(target, event[2], event[3], event[1], timeout)
+        with lock:
+            results.extend(outcome)
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for event in window:
+            due = began + (event[0] - first) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            lags.append(max(0.0, -delay))
+            executor.submit(run, event)
+    elapsed = time.perf_counter() - began
+    return results, elapsed, max(lags) if lags else 0.0
+
+
+def summarize(results, elapsed):
+    by_endpoint = defaultdict(list)
+    for endpoint, status, seconds in results:
+        by_endpoint[endpoint].append((status, seconds))
+
+    report = {}
+    for endpoint, rows in sorted(by_endpoint.items()):
+        statuses = [s for s, _ in rows]
+        latencies = np.array([seconds for _, seconds in rows]) * 1000
+        report[endpoint] = {
+            'requests': len(rows),
+            'rps': len(rows) / elapsed if elapsed else 0.0,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            # 429/503 are admission control shedding load on purpose; everything else is a failure
+            'shed_rate': sum(s in (429, 503) for s in statuses) / len(rows),
+            'error_rate': sum(s is None or (s >= 400 and s not in (429, 503)) for s in statuses) / len(rows),
+        }
+    return report
+
+
+def print_report(speed, report, elapsed, lag):
+    print(f"\n▶ {speed}x  ({elapsed:.1f}s wall, max client lag {lag * 1000:.0f}ms)")
+    print(f"{'endpoint':<16}{'requests':>9}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'shed':>7}{'errors':>8}")
+    for endpoint, r in report.items():
+        print(f"{endpoint:<16}{r['requests']:>9}{r['rps']:>8.1f}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}"
+              f"{r['p99_ms']:>9.0f}{r['shed_rate']:>7.1%}{r['error_rate']:>8.1%}")
+
+
+def saturated(report, slo_p95_ms, max_failure_rate):
+    """Endpoints that missed the latency SLO or failed/shed more than allowed"""
+    return [endpoint for endpoint, r in report.items()
+            if r['p95_ms'] > slo_p95_ms or r['shed_rate'] + r['error_rate'] > max_failure_rate]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay logged traffic against a local instance")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Run the API with stubbed upstream providers")
+    serve_parser.add_argument("--port", type=int, default=5055)
+    serve_parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply every stubbed upstream latency")
+    serve_parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of upstream calls that fail")
+    serve_parser.add_argument("--dev-server", action="store_true",
+                              help="Use Flask's dev server instead of gunicorn (no workers or gthread pool, "
+                                   "so the numbers don't reflect production)")
+
+    run_parser = commands.add_parser("run", help="Replay exported logs/chat_logs rows")
+    run_parser.add_argument("--logs", help="Export of the logs table")
+    run_parser.add_argument("--chat-logs", help="Export of the chat_logs table")
+    run_parser.add_argument("--target", default="http://127.0.0.1:5055")
+    run_parser.add_argument("--speeds", type=float, nargs="+", default=[1, 10, 100], help="Replay speed multipliers, 1-100")
+    run_parser.add_argument("--duration", type=float, default=60, help="Wall-clock seconds to replay per speed")
+    run_parser.add_argument("--clients", type=int, default=200, help="Synthetic client IPs for rows without one")
+    run_parser.add_argument("--slo-p95-ms", type=float, default=5000)
+    run_parser.add_argument("--max-failure-rate", type=float, default=0.01)
+    run_parser.add_argument("--json", help="Also write every report to this file")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.port, args.latency_scale, args.error_rate, args.dev_server)
+        return
+
+    if not args.logs and not args.chat_logs:
+        parser.error("pass --logs and/or --chat-logs")
+    events = build_events(load_rows(args.logs) if args.logs else [],
+                          load_rows(args.chat_logs) if args.chat_logs else [], args.clients)
+    print(f"📼 {len(events)} recorded requests")
+
+    reports = {}
+    saturation = None
+    for speed in sorted(args.speeds):
+        results, elapsed, lag = replay(events, args.target, speed, args.duration)
+        report = reports[speed] = summarize(results, elapsed)
+        print_report(speed, report, elapsed, lag)
+        missed = saturated(report, args.slo_p95_ms, args.max_failure_rate)
+        if missed and saturation is None:
+            saturation = speed
+            print(f"⚠️  Saturated at {speed}x: {', '.join(missed)}")
+
+    if saturation is None:
+        print(f"\n✅ No saturation up to {max(args.speeds)}x")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'saturation_speed': saturation, 'reports': {str(k): v for k, v in reports.items()}}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Wisest decision scoring engine
+Vectorized port of calculateScore in src/CalculateDecision.tsx: normalize each metric,
+invert when lower is better, and weight every category by importance^2
+"""
+import re
+
+import numpy as np
+
+# Metric types, matching the "Direction" select in src/Main.tsx
+HIGHER_IS_BETTER = 0
+LOWER_IS_BETTER = 1
+YES_IS_OPTIMAL = 2
+NO_IS_OPTIMAL = 3
+RATING = 4
+
+MAX_DECISIONS_PER_REQUEST = 100
+MAX_OPTIONS = 2000
+MAX_CATEGORIES = 200
+
+_NUMBER = re.compile(r'-?\d+(\.\d+)?')
+
+
+def extract_number(value):
+    """Same as extractNumber on the frontend: first number in the value, else 0"""
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER.search(str(value))
+    return float(match.group(0)) if match else 0.0
+
+
+def _metric_value(value, metric_type):
+    # Accept raw Yes/No answers as well as the 1/0 the frontend already stores
+    if isinstance(value, str) and value.strip().lower() in ('yes', 'no'):
+        answer = value.strip().lower()
+        if metric_type == YES_IS_OPTIMAL:
+            return 1.0 if answer == 'yes' else 0.0
+        if metric_type == NO_IS_OPTIMAL:
+            return 1.0 if answer == 'no' else 0.0
+    return extract_number(value)
+
+
+def build_matrix(categories, metric_types, num_options):
+    """Options x categories matrix of numeric metric values"""
+    matrix = np.zeros((num_options, len(categories)), dtype=np.float64)
+    for ci, category in enumerate(categories):
+        metrics = category.get('metrics') or []
+        metric_type = metric_types[ci]
+        for oi in range(num_options):
+            value = metrics[oi] if oi < len(metrics) else None
+            matrix[oi, ci] = _metric_value(value, metric_type)
+    return matrix
+
+
+def normalize(matrix, metric_types):
+    """Min-max normalize every column to [0, 1], inverting lower-is-better columns"""
+    lower_is_better = np.asarray(metric_types) == LOWER_IS_BETTER
+    col_min = matrix.min(axis=-2, keepdims=True)
+    col_range = matrix.max(axis=-2, keepdims=True) - col_min
+    flat = col_range == 0
+
+    normalized = (matrix - col_min) / np.where(flat, 1.0, col_range)
+    normalized = np.where(lower_is_better, 1.0 - normalized, normalized)
+    normalized = np.clip(normalized, 0.0, 1.0)
+    # A category where every option ties contributes half its weight to everyone
+    return np.where(flat, 0.5, normalized)
+
+
+def score_matrix(matrix, metric_types, importances):
+    """Scores for every option in one pass: normalized metrics @ importance^2"""
+    weights = np.asarray(importances, dtype=np.float64) ** 2
+    return normalize(matrix, metric_types) @ weights
+
+
+def parse_decision(decision):
+    """Validate one decision payload and return (options, categories, metric_types)"""
+    options = decision.get('options') or []
+    categories = decision.get('categories') or []
+    metric_types = decision.get('metric_types', decision.get('metricTypes'))
+
+    if not options:
+        raise ValueError('options are required')
+    if not categories:
+        raise ValueError('categories are required')
+    if len(options) > MAX_OPTIONS or len(categories) > MAX_CATEGORIES:
+        raise ValueError(f'at most {MAX_OPTIONS} options and {MAX_CATEGORIES} categories are supported')
+    if metric_types is None:
+        metric_types = [HIGHER_IS_BETTER] * len(categories)
+    if len(metric_types) < len(categories):
+        raise ValueError('metric_types must have one entry per category')
+
+    metric_types = [int(t) for t in metric_types[:len(categories)]]
+    if any(t not in (HIGHER_IS_BETTER, LOWER_IS_BETTER, YES_IS_OPTIMAL, NO_IS_OPTIMAL, RATING) for t in metric_types):
+        raise ValueError('metric_types must be between 0 and 4')
+    return options, categories, metric_types
+
+
+def score_decision(decision):
+    """Score one decision and rank its options"""
+    options, categories, metric_types = parse_decision(decision)
+    importances = [extract_number(c.get('importance', 1)) for c in categories]
+
+    matrix = build_matrix(categories, metric_types, len(options))
+    scores = score_matrix(matrix, metric_types, importances)
+    max_possible = float(np.sum(np.square(importances))) or 1.0
+
+    # Stable sort keeps ties in input order, like Array.prototype.sort on the frontend
+    ranking = np.argsort(-scores, kind='stable')
+    best = int(ranking[0])
+
+    return {
+        'options': list(options),
+        'scores': [{'option': options[i], 'score': float(scores[i])} for i in range(len(options))],
+        'ranking': [options[i] for i in ranking],
+        'best_decision': options[best],
+        'max_possible': max_possible,
+        'best_percent': float(scores[best] / max_possible * 100),
+    }
+
+
+def score_batch(decisions):
+    """Score many decisions; a bad decision reports its own error without failing the rest"""
+    results = []
+    for decision in decisions:
+        try:
+            results.append(score_decision(decision))
+        except (ValueError, TypeError, AttributeError) as e:
+            results.append({'error': str(e)})
+    return results
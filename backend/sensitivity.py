@@ -0,0 +1,150 @@
+"""
+Monte Carlo weight-sensitivity analysis for Wisest decisions
+Perturbs importances and metric values, rescoring every sample as a batched matrix product
+"""
+import numpy as np
+
+import scoring
+
+DEFAULT_SAMPLES = 10000
+MAX_SAMPLES = 50000
+DEFAULT_WEIGHT_NOISE = 0.25  # log-normal sigma applied to each importance
+DEFAULT_METRIC_NOISE = 0.10  # relative sigma applied to numeric metric values
+
+# Upper bound on samples x options x categories held in memory at once
+BLOCK_ELEMENTS = 4_000_000
+
+
+def _sample_scores(matrix, metric_types, importances, samples, weight_noise, metric_noise, rng):
+    """Scores for `samples` perturbed copies of the decision, shape (samples, options)"""
+    num_options, num_categories = matrix.shape
+    numeric = np.isin(metric_types, (scoring.HIGHER_IS_BETTER, scoring.LOWER_IS_BETTER, scoring.RATING))
+    metric_noise = np.float32(metric_noise)
+    weight_noise = np.float32(weight_noise)
+    base = matrix.astype(np.float32)
+    weights = np.asarray(importances, dtype=np.float32)
+
+    block = max(1, BLOCK_ELEMENTS // max(1, num_options * num_categories))
+    out = np.empty((samples, num_options), dtype=np.float32)
+
+    for start in range(0, samples, block):
+        size = min(block, samples - start)
+        sampled_weights = weights * np.exp(weight_noise * rng.standard_normal((size, num_categories), dtype=np.float32))
+
+        # Yes/No answers are facts, so only numeric columns get measurement noise
+        sampled = np.broadcast_to(base, (size, num_options, num_categories)).copy()
+        noise = rng.standard_normal((size, num_options, int(numeric.sum())), dtype=np.float32)
+        sampled[:, :, numeric] *= 1.0 + metric_noise * noise
+
+        normalized = scoring.normalize(sampled, metric_types)
+        out[start:start + size] = np.einsum('soc,sc->so', normalized, sampled_weights ** 2)
+    return out
+
+
+def _break_even(matrix, metric_types, importances, best):
+    """Per category, the importance at which another option overtakes `best`
+
+    Holding other weights fixed, each option's score is linear in importance^2,
+    so the crossover with every rival has a closed form.
+    """
+    normalized = scoring.normalize(matrix, metric_types)
+    weights_sq = np.asarray(importances, dtype=np.float64) ** 2
+    totals = normalized @ weights_sq
+
+    results = []
+    for ci, x0 in enumerate(weights_sq):
+        column = normalized[:, ci]
+        rest = totals - column * x0
+        slope = column - column[best]
+        gap = rest[best] - rest
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossover = gap / slope
+        valid = (slope != 0) & (crossover > 0)
+        valid[best] = False
+
+        nearest = None
+        if valid.any():
+            candidates = np.where(valid, np.abs(crossover - x0), np.inf)
+            rival = int(np.argmin(candidates))
+            nearest = (rival, float(np.sqrt(crossover[rival])))
+        results.append(nearest)
+    return results
+
+
+def analyze(decision, samples=DEFAULT_SAMPLES, weight_noise=DEFAULT_WEIGHT_NOISE,
+            metric_noise=DEFAULT_METRIC_NOISE, seed=None):
+    """Win probability, rank stability and break-even weights for one decision"""
+    options, categories, metric_types = scoring.parse_decision(decision)
+    samples = int(samples)
+    if not 1 <= samples <= MAX_SAMPLES:
+        raise ValueError(f'samples must be between 1 and {MAX_SAMPLES}')
+    if weight_noise < 0 or metric_noise < 0:
+        raise ValueError('noise levels must be non-negative')
+
+    importances = [scoring.extract_number(c.get('importance', 1)) for c in categories]
+    matrix = scoring.build_matrix(categories, metric_types, len(options))
+    metric_types = np.asarray(metric_types)
+
+    base_scores = scoring.score_matrix(matrix, metric_types, importances)
+    base_ranking = np.argsort(-base_scores, kind='stable')
+    best = int(base_ranking[0])
+    base_rank = np.empty(len(options), dtype=np.int64)
+    base_rank[base_ranking] = np.arange(len(options))
+
+    rng = np.random.default_rng(seed)
+    sampled = _sample_scores(matrix, metric_types, importances, samples, weight_noise, metric_noise, rng)
+
+    winners = np.argmax(sampled, axis=1)
+    win_probability = np.bincount(winners, minlength=len(options)) / samples
+    order = np.argsort(-sampled, axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(len(options)), axis=1)
+    same_rank = (ranks == base_rank).mean(axis=0)
+
+    options_out = []
+    for oi, option in enumerate(options):
+        options_out.append({
+            'option': option,
+            'score': float(base_scores[oi]),
+            'rank': int(base_rank[oi]) + 1,
+            'win_probability': float(win_probability[oi]),
+            'rank_stability': float(same_rank[oi]),
+            'mean_rank': float(ranks[:, oi].mean()) + 1,
+        })
+
+    break_even = []
+    for ci, crossover in enumerate(_break_even(matrix, metric_types, importances, best)):
+        entry = {'category': categories[ci].get('title', f'Category {ci + 1}'), 'importance': importances[ci]}
+        if crossover is None:
+            entry.update({'break_even_importance': None, 'direction': None, 'overtaken_by': None})
+        else:
+            rival, weight = crossover
+            entry.update({
+                'break_even_importance': weight,
+                'direction': 'increase' if weight > importances[ci] else 'decrease',
+                'overtaken_by': options[rival],
+            })
+        break_even.append(entry)
+
+    return {
+        'best_decision': options[best],
+        'samples': samples,
+        'options': options_out,
+        'break_even': break_even,
+    }
+
+
+def summary_for_prompt(result):
+    """One or two plain sentences describing how fragile the win is"""
+    best = result['best_decision']
+    win = next(o['win_probability'] for o in result['options'] if o['option'] == best)
+    text = f"{best} still wins in {win * 100:.0f}% of {result['samples']} what-if scenarios with shifted priorities and values."
+
+    flips = [b for b in result['break_even'] if b['break_even_importance'] is not None]
+    if flips:
+        closest = min(flips, key=lambda b: abs(b['break_even_importance'] - b['importance']) / max(b['importance'], 1e-9))
+        text += (f" The result flips to {closest['overtaken_by']} if '{closest['category']}' importance"
+                 f" {'rises' if closest['direction'] == 'increase' else 'drops'} from {closest['importance']:g}"
+                 f" to {closest['break_even_importance']:.1f}.")
+    return text
@@ -0,0 +1,59 @@
+"""
+Single-flight coalescing of identical in-flight work
+Concurrent callers with the same key share one upstream computation and its result
+"""
+import re
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+
+def normalize_query(text):
+    """Case, whitespace and trailing punctuation don't change the question"""
+    return re.sub(r'\s+', ' ', (text or '').strip().lower()).rstrip('?!. ')
+
+
+class Group:
+    """Tracks in-flight calls per key; the first caller leads, the rest wait for its result"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                metrics.inc('wisest_singleflight_total', group=self.name, role='coalesced')
+                return future, False
+            future = self._calls[key] = Future()
+            metrics.inc('wisest_singleflight_total', group=self.name, role='leader')
+            return future, True
+
+    def _run(self, key, future, fn):
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def do(self, key, fn, timeout=None):
+        """Run fn() once per key at a time and return its result to every concurrent caller"""
+        future, leader = self._join(key)
+        if leader:
+            self._run(key, future, fn)
+        return future.result(timeout=timeout)
+
+    def submit(self, key, fn, executor):
+        """Like do(), but schedules the leader on `executor` and returns the shared future"""
+        future, leader = self._join(key)
+        if leader:
+            executor.submit(self._run, key, future, fn)
+        return future
+
+    def in_flight(self):
+        return len(self._calls)
@@ -0,0 +1,29 @@
+"""
+/chat/batch rate limiting, against the app with every upstream provider stubbed (see replay.py)
+
+    cd backend && python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+for name in ('GEMINI_API_KEY', 'GROQ_API_KEY', 'COHERE_API_KEY', 'SUPABASE_SERVICE_KEY'):
+    os.environ[name] = 'test-stub'
+os.environ['SUPABASE_URL'] = 'http://supabase.stub'
+os.environ['DECISIONS_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='wisest-test-'), 'decisions.db')
+
+import replay  # noqa: E402
+
+replay.install_stubs(scale=0.0)
+
+import api  # noqa: E402
+
+
+def test_full_batch_from_fresh_client_is_admitted():
+    questions = [f"What did Shirley build in project {i}?" for i in range(api.MAX_BATCH_QUESTIONS)]
+    response = api.app.test_client().post('/chat/batch', json={'questions': questions},
+                                          headers={'X-Forwarded-For': '203.0.113.10'})
+    assert response.status_code == 200
+    assert len(response.get_json()['results']) == len(questions)
@@ -3,23 +3,26 @@
 Reload RAG documents WITH embeddings using Cohere batch API
 """
 import os
+import argparse
 import json
 import requests
 import time
 from dotenv import load_dotenv
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema.document import Document
+from RAG.corpus import CORPORA, DEFAULT_CORPUS, corpus_config
+from RAG.dedupe import dedupe_chunks
 
 load_dotenv()
 
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_SERVICE_KEY')
 COHERE_API_KEY = os.environ.get('COHERE_API_KEY')
-DATA_PATH = 'Shirly8/ShirleyHuang-Data'
+DATA_PATH = corpus_config(DEFAULT_CORPUS)['data_path']
 
-def clear_database():
+def clear_database(table='documents'):
     """Clear all documents"""
-    url = f"{SUPABASE_URL}/rest/v1/documents?id=gte.0"
+    url = f"{SUPABASE_URL}/rest/v1/{table}?id=gte.0"
     headers = {
         "apikey": SUPABASE_KEY,
         "Authorization": f"Bearer {SUPABASE_KEY}",
@@ -28,9 +31,9 @@ def clear_database():
     response = requests.delete(url, headers=headers)
     print(f"✅ Database cleared")
 
-def load_documents():
+def load_documents(data_path=DATA_PATH):
     """Load documents from GitHub"""
-    api_url = f"https://api.github.com/repos/{DATA_PATH}/git/trees/main?recursive=1"
+    api_url = f"https://api.github.com/repos/{data_path}/git/trees/main?recursive=1"
     headers = {}
     github_token = os.environ.get('GITHUB_TOKEN')
     if github_token:
@@ -44,7 +47,7 @@ def load_documents():
 
     for item in tree.get('tree', []):
         if item['type'] == 'blob' and item['path'].startswith('RAG/') and (item['path'].endswith('.md') or item['path'].endswith('.txt')):
-            content_url = f"https://raw.githubusercontent.com/{DATA_PATH}/main/{item['path']}"
+            content_url = f"https://raw.githubusercontent.com/{data_path}/main/{item['path']}"
             content_response = requests.get(content_url, headers=headers)
             doc = Document(
                 page_content=content_response.text,
@@ -124,7 +127,7 @@ def generate_embeddings_batch(texts):
 
     return all_embeddings
 
-def add_to_supabase(chunks):
+def add_to_supabase(chunks, table='documents'):
     """Add chunks with embeddings to Supabase"""
     print(f"\n💾 Adding {len(chunks)} chunks with embeddings...")
 
@@ -134,7 +137,7 @@ def add_to_supabase(chunks):
     embeddings = generate_embeddings_batch(texts)
 
     # Add to Supabase
-    url = f"{SUPABASE_URL}/rest/v1/documents"
+    url = f"{SUPABASE_URL}/rest/v1/{table}"
     headers = {
         "apikey": SUPABASE_KEY,
         "Authorization": f"Bearer {SUPABASE_KEY}",
@@ -164,26 +167,43 @@ def add_to_supabase(chunks):
     return added_count
 
 def main():
+    parser = argparse.ArgumentParser(description="Reload a corpus with embeddings")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, choices=sorted(CORPORA), help="Which knowledge base to reload")
+    args = parser.parse_args()
+    config = corpus_config(args.corpus)
+
     print("=" * 60)
     print("🔄 RAG Database Update (With Embeddings)")
     print("=" * 60)
     print()
 
     print("🗑️  Clearing database...")
-    clear_database()
+    clear_database(config['table'])
 
     print("📥 Loading documents from GitHub...")
-    documents = load_documents()
+    documents = load_documents(config['data_path'])
     print(f"📊 Total: {len(documents)} documents")
 
     print("📑 Splitting documents...")
     chunks = split_documents(documents)
     chunks = create_ids(chunks)
     print(f"📊 Created: {len(chunks)} chunks")
+    chunks = dedupe_chunks(chunks)
 
     print("\n" + "=" * 60)
-    added = add_to_supabase(chunks)
+    added = add_to_supabase(chunks, config['table'])
     print(f"\n✅ Successfully added {added} documents with embeddings!")
+
+    # Refresh the local memory-mapped snapshot that serving workers search
+    from RAG.corpus import sync_corpus
+    sync_corpus(args.corpus)
+
+    # Precompute answers for the most asked questions against the new version
+    from RAG.warm_cache import warm
+    try:
+        warm(corpus_name=args.corpus)
+    except Exception as e:
+        print(f"⚠️  Cache warm-up failed: {e}")
     print("=" * 60)
 
 if __name__ == "__main__":
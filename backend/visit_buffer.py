@@ -0,0 +1,112 @@
+"""
+Write-behind buffer for /update-visit heartbeats
+Pages report their duration repeatedly and only the latest value matters, so updates are
+merged in memory per row and flushed to Supabase in bulk on an interval and at shutdown.
+The bulk write goes through the update_visits function (visit_buffer.sql), which only
+updates existing logs rows, never inserts and never shortens a stored duration
+"""
+import atexit
+import os
+import threading
+
+import metrics
+import providers
+
+FLUSH_INTERVAL = float(os.environ.get('VISIT_FLUSH_INTERVAL_S', 10))
+MAX_BATCH = 500
+
+
+class RejectedRows(Exception):
+    """Supabase refused a batch (4xx): retrying the same rows can't succeed"""
+
+
+class WriteBehindBuffer:
+    def __init__(self, flush_rows, interval=FLUSH_INTERVAL):
+        self.flush_rows = flush_rows
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def put(self, row_id, payload):
+        """O(1): merge into the pending update for this row, newest values win"""
+        with self._lock:
+            existing = self._pending.get(row_id)
+            if existing is None:
+                self._pending[row_id] = dict(payload)
+            else:
+                existing.update(payload)
+                metrics.inc('wisest_visit_updates_coalesced_total')
+            size = len(self._pending)
+        metrics.set_gauge('wisest_visit_buffer_rows', size)
+
+    def flush(self):
+        """Write every pending row; on an outage rows go back unless a newer update arrived"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            rows = [{'id': row_id, **payload} for row_id, payload in batch.items()]
+            written = 0
+            for start in range(0, len(rows), MAX_BATCH):
+                chunk = rows[start:start + MAX_BATCH]
+                try:
+                    written += self._write(chunk)
+                except Exception as e:
+                    # Supabase down or unreachable: keep the rows for the next flush
+                    print(f"[WARN] Visit flush failed for {len(chunk)} rows: {e}")
+                    with self._lock:
+                        for row in chunk:
+                            row_id = row.pop('id')
+                            self._pending.setdefault(row_id, row)
+
+            metrics.inc('wisest_visit_rows_flushed_total', written)
+            metrics.set_gauge('wisest_visit_buffer_rows', len(self._pending))
+            return written
+
+    def _write(self, rows):
+        """Write rows; a rejected batch is split until the bad rows are isolated and dropped"""
+        try:
+            self.flush_rows(rows)
+            return len(rows)
+        except RejectedRows as e:
+            if len(rows) == 1:
+                print(f"[WARN] Dropping visit update for row {rows[0]['id']}: {e}")
+                metrics.inc('wisest_visit_rows_dropped_total')
+                return 0
+            middle = len(rows) // 2
+            return self._write(rows[:middle]) + self._write(rows[middle:])
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='visit-flush', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+
+def supabase_update(supabase_url, headers):
+    """flush_rows implementation: one update_visits RPC per batch, existing rows only"""
+    def flush_rows(rows):
+        with metrics.upstream('supabase', 'log_update_bulk'):
+            response = providers.sessions['supabase'].post(
+                f"{supabase_url}/rest/v1/rpc/update_visits",
+                headers=headers,
+                json={'p_rows': rows},
+                timeout=10
+            )
+        if 400 <= response.status_code < 500:
+            raise RejectedRows(f"HTTP {response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+    return flush_rows
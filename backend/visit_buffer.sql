@@ -0,0 +1,20 @@
+-- Bulk update behind visit_buffer.py
+-- Run once in the Supabase SQL editor. Applies the pending duration/page of many visits in one
+-- statement; ids with no logs row are ignored (an upsert would have inserted them). Durations
+-- only grow: a stale flush from another worker can arrive after a newer one, so it mustn't
+-- shorten what's stored (greatest() skips nulls, so a missing duration keeps the old one).
+-- p_rows: [{"id", "duration"?, "page"?}, ...]. Returns how many rows were updated.
+create or replace function update_visits(p_rows jsonb)
+returns integer
+language sql
+as $$
+    with updated as (
+        update logs
+        set duration = greatest(logs.duration, (visit.data->>'duration')::numeric),
+            page = coalesce(visit.data->>'page', logs.page)
+        from jsonb_array_elements(p_rows) as visit(data)
+        where logs.id = (visit.data->>'id')::bigint
+        returning logs.id
+    )
+    select count(*)::integer from updated;
+$$;
@@ -141,6 +141,7 @@ const CalculateDecision: React.FC<CalculateDecisionProps> = ({
           method: 'POST', headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
             options, categories: categories.map(c => ({ title: c.title, metrics: c.metrics, importance: c.importance })),
+            metric_types: metricTypes,
             scores: sc.map((s, i) => ({ option: options[i], score: s })),
             best_decision: options[bestIdx],
             main_Consideration: mainConsideration,
@@ -292,45 +293,28 @@ const CalculateDecision: React.FC<CalculateDecisionProps> = ({
   };
 
   // DB save logic
-  const saveDecision = async (userId: string) => {
-    const title = decisionName || mainConsideration || `Decision ${new Date().toLocaleDateString()}`;
-    const desc = `Decision between: ${options.join(', ')}`;
-    if (selectedDecisionId) {
-      const { data, error } = await supabase.from('decisions').update({ title, description: desc, ai_feedback: feedback, updated_at: new Date().toISOString() }).eq('id', selectedDecisionId).select().single();
-      if (error) throw error; return data;
-    }
-    const { data: existing } = await supabase.from('decisions').select('id').eq('user_id', userId).eq('title', title);
-    if (existing && existing.length > 0) {
-      const { data, error } = await supabase.from('decisions').update({ description: desc, ai_feedback: feedback, updated_at: new Date().toISOString() }).eq('id', existing[0].id).select().single();
-      if (error) throw error; return data;
-    }
-    const { data, error } = await supabase.from('decisions').insert({ user_id: userId, title, description: desc, ai_feedback: feedback }).select().single();
-    if (error) throw error; return data;
-  };
-
   const saveToDatabase = useCallback(async () => {
     setSaveStatus('Saving...');
     try {
-      const { data: { user } } = await supabase.auth.getUser();
-      if (!user) { setSaveStatus('Please sign in'); return; }
-      const decisionData = await saveDecision(user.id);
-      const decisionId = selectedDecisionId || decisionData.id;
-      await supabase.from('decision_values').delete().eq('decision_id', decisionId);
-      await supabase.from('decision_categories').delete().eq('decision_id', decisionId);
-      await supabase.from('decision_options').delete().eq('decision_id', decisionId);
-      const optionIds: string[] = [];
-      for (let i = 0; i < options.length; i++) {
-        const { data } = await supabase.from('decision_options').insert({ decision_id: decisionData.id, name: options[i], note: choiceConsiderations[options[i]] || null }).select().single();
-        if (data) optionIds.push(data.id);
-      }
-      for (let ci = 0; ci < categories.length; ci++) {
-        const { data: catData } = await supabase.from('decision_categories').insert({ decision_id: decisionData.id, name: categories[ci].title, importance: categories[ci].importance, higher_is_better: metricTypes[ci] === 0 }).select().single();
-        if (catData) {
-          for (let oi = 0; oi < options.length; oi++) {
-            await supabase.from('decision_values').insert({ decision_id: decisionData.id, category_id: catData.id, option_id: optionIds[oi], value: extractNumber(categories[ci].metrics[oi]) });
-          }
-        }
-      }
+      const { data: { session } } = await supabase.auth.getSession();
+      if (!session) { setSaveStatus('Please sign in'); return; }
+      // The whole decision (options, categories, values) is saved in one transactional call
+      const response = await fetch('https://wisest.onrender.com/history', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${session.access_token}` },
+        body: JSON.stringify({
+          id: selectedDecisionId || undefined,
+          title: decisionName || mainConsideration || `Decision ${new Date().toLocaleDateString()}`,
+          description: `Decision between: ${options.join(', ')}`,
+          ai_feedback: feedback,
+          options: options.map(o => ({ name: o, note: choiceConsiderations[o] || null })),
+          categories: categories.map((c, ci) => ({
+            name: c.title, importance: c.importance, higher_is_better: metricTypes[ci] === 0,
+            values: options.map((_, oi) => extractNumber(c.metrics[oi]))
+          }))
+        }),
+      });
+      if (!response.ok) throw new Error('Save failed');
       setSaveStatus('Saved!');
       setTimeout(() => setSaveStatus(''), 4000);
     } catch { setSaveStatus('Failed to save.'); setTimeout(() => setSaveStatus(''), 4000); }
@@ -364,6 +348,7 @@ const CalculateDecision: React.FC<CalculateDecisionProps> = ({
         method: 'POST', headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           options, categories: categories.map(c => ({ title: c.title, metrics: c.metrics, importance: c.importance })),
+          metric_types: metricTypes,
           scores: scores.map((s, i) => ({ option: options[i], score: s })),
           best_decision: bestDecision,
           main_Consideration: mainConsideration + '\n\nAdditional question: ' + followUpInput,
@@ -87,11 +87,11 @@ const DecisionHistory: React.FC<DecisionHistoryProps> = ({ onSelectDecision, onB
     if (!window.confirm('Delete this decision? This cannot be undone.')) return;
     try {
       setDeletingDecision(decisionId);
-      await supabase.from('decision_values').delete().eq('decision_id', decisionId);
-      await supabase.from('decision_categories').delete().eq('decision_id', decisionId);
-      await supabase.from('decision_options').delete().eq('decision_id', decisionId);
-      const { error } = await supabase.from('decisions').delete().eq('id', decisionId);
-      if (error) throw error;
+      const { data: { session } } = await supabase.auth.getSession();
+      const response = await fetch(`https://wisest.onrender.com/history/${decisionId}`, {
+        method: 'DELETE', headers: { Authorization: `Bearer ${session?.access_token}` },
+      });
+      if (!response.ok) throw new Error('Delete failed');
       setDecisions(prev => prev.filter(d => d.id !== decisionId));
     } catch {
       alert('Failed to delete decision.');